@@ -0,0 +1,77 @@
+# Benchmark of the access to the SQLite databases
+#
+# Compares the pooled connections of utils/db.py with opening a new connection in every call,
+# as the get_db helpers did before, for a read of canismajor and another of pubcred.
+# The databases are created in a temporary directory with 5000 entities and 2000 credentials.
+#
+# Run from the app directory:
+#   python bench_db.py
+
+import io
+import sys
+import time
+import sqlite3
+import tempfile
+import contextlib
+
+import orjson
+
+from settings import settings
+settings.DATABASE_DIR = tempfile.mkdtemp(prefix="canispy-bench-")
+
+from blockchain import canismajor, pubcred
+from utils import db as pooled
+
+
+def new_connection(database_name: str) -> sqlite3.Connection:
+    """A new connection in every call, without tuning"""
+    db = sqlite3.connect(database_name, detect_types=sqlite3.PARSE_DECLTYPES)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def populate(num_entities: int = 5000, num_credentials: int = 2000):
+    db = canismajor.create_db()
+    rows = [(
+        f"urn:ngsi-ld:Bench:{i}",
+        orjson.dumps({"id": f"urn:ngsi-ld:Bench:{i}", "type": "Bench", "value": i}),
+        orjson.dumps({"vc": {}}),
+        "0x%064x" % i,
+        "0x%064x" % (i + num_entities),
+    ) for i in range(num_entities)]
+    with pooled.transaction(db):
+        db.executemany(
+            "INSERT INTO stamping (ngsi_id, ngsi_value, ngsi_receipt, id_hash, value_hash, status) VALUES (?, ?, ?, ?, ?, 'anchored')",
+            rows
+        )
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        pubcred.erase_db()
+        for i in range(num_credentials):
+            pubcred.new_certificate(f"uuid{i}", "x" * 500)
+
+
+def bench(name: str, f, n: int = 2000):
+    start = time.perf_counter()
+    for i in range(n):
+        f(i)
+    elapsed = time.perf_counter() - start
+    print(f"  {name:20} {elapsed / n * 1e6:6.0f} us/call")
+
+
+def run():
+    bench("list_one_item", lambda i: canismajor.list_one_item(f"urn:ngsi-ld:Bench:{i}"))
+    bench("pubcred.certificate", lambda i: pubcred.certificate(f"uuid{i}"))
+
+
+if __name__ == "__main__":
+    print(sys.version)
+    populate()
+
+    print("New connection per call:")
+    canismajor.get_connection = pubcred.get_connection = new_connection
+    run()
+
+    print("Pooled connections:")
+    canismajor.get_connection = pubcred.get_connection = pooled.get_connection
+    run()
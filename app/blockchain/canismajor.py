@@ -5,9 +5,15 @@ import sqlite3
 from sqlite3.dbapi2 import Connection
 import uuid as unique_id
 import time
+import threading
+import asyncio
+import struct
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from pathlib import Path
 
 # For the data models
-from typing import Dict, Optional, cast
+from typing import Dict, List, Optional, Tuple, cast
 from pydantic import BaseModel, BaseSettings
 
 from web3 import Web3
@@ -20,6 +26,9 @@ from blockchain import tolar_hashnet
 from eth_account import Account
 from hexbytes import HexBytes
 
+from utils.merkletree import MerkleTree, leaf_hash, verify_MHT_proof
+from utils.que import FIFOFile, FullError
+
 try:
     from devtools import debug
 except ImportError:
@@ -28,6 +37,7 @@ except ImportError:
 
 # The settings for the system
 from settings import settings
+from utils.db import get_connection, transaction
 
 # Initialize logging
 log = logging.getLogger(__name__)
@@ -37,6 +47,11 @@ DATABASE_NAME = os.path.join(settings.DATABASE_DIR, DATABASE_FILE)
 
 drop_table_script = """
 DROP TABLE IF EXISTS stamping;
+DROP TABLE IF EXISTS stamping_value;
+DROP TABLE IF EXISTS stamping_leaves;
+DROP TABLE IF EXISTS tx_receipt;
+DROP TABLE IF EXISTS timestamp_event;
+DROP TABLE IF EXISTS indexer_checkpoint;
 """
 
 create_table_script = """
@@ -44,23 +59,98 @@ CREATE TABLE IF NOT EXISTS stamping (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     ngsi_id TEXT NOT NULL,
     ngsi_value TEXT NOT NULL,
-    ngsi_receipt TEXT NOT NULL
+    ngsi_receipt TEXT NOT NULL,
+    ngsi_proof TEXT,
+    id_hash TEXT,
+    value_hash TEXT,
+    status TEXT,
+    ngsi_type TEXT
+);
+
+CREATE TABLE IF NOT EXISTS stamping_value (
+    value_hash TEXT PRIMARY KEY,
+    ngsi_value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS stamping_leaves (
+    value_hash TEXT PRIMARY KEY,
+    leaves BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tx_receipt (
+    tx_hash BLOB PRIMARY KEY,
+    receipt BLOB NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS timestamp_event (
+    tx_hash TEXT NOT NULL,
+    log_index INTEGER NOT NULL,
+    id_hash TEXT NOT NULL,
+    value_hash TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    block_timestamp INTEGER,
+    PRIMARY KEY (tx_hash, log_index)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS indexer_checkpoint (
+    name TEXT PRIMARY KEY,
+    block_number INTEGER NOT NULL
 );
 """
 
+# Columns added after the first version of the table, with their definitions
+added_columns = {
+    "ngsi_proof": "TEXT",
+    "id_hash": "TEXT",
+    "value_hash": "TEXT",
+    "status": "TEXT",
+    "ngsi_type": "TEXT",
+}
+
+# Indexes of the table (some of them depend on the added columns)
+create_index_script = """
+CREATE INDEX IF NOT EXISTS stamping_ngsi_id ON stamping (ngsi_id, id);
+CREATE INDEX IF NOT EXISTS stamping_hashes ON stamping (id_hash, value_hash);
+CREATE INDEX IF NOT EXISTS stamping_id_hash ON stamping (id_hash, id);
+CREATE INDEX IF NOT EXISTS stamping_ngsi_type ON stamping (ngsi_type, id);
+CREATE INDEX IF NOT EXISTS timestamp_event_hashes ON timestamp_event (id_hash, value_hash, block_number);
+"""
+
 def create_db() -> Connection:
     """Create the table if it does not exist
     """
     db = get_db()
     db.executescript(create_table_script)
+
+    # Upgrade tables created by previous versions
+    existing_columns = [row["name"] for row in db.execute("PRAGMA table_info(stamping)")]
+    for column, definition in added_columns.items():
+        if column not in existing_columns:
+            db.execute(f"ALTER TABLE stamping ADD COLUMN {column} {definition}")
+            if column == "ngsi_type":
+                # Fill the type of the entities stamped before the column existed
+                db.execute("UPDATE stamping SET ngsi_type = json_extract(CAST(ngsi_value AS TEXT), '$.type')")
+    db.executescript(create_index_script)
+    db.commit()
+
+    # Calculate the hashes of the entities stamped before the hashes were stored
+    rows = db.execute("SELECT id, ngsi_id, ngsi_value FROM stamping WHERE id_hash IS NULL").fetchall()
+    with transaction(db):
+        for row in rows:
+            value = row["ngsi_value"]
+            if isinstance(value, str):
+                value = bytes(value, "utf-8")
+            db.execute(
+                "UPDATE stamping SET id_hash = ?, value_hash = ? WHERE id = ?",
+                (Web3.toHex(hash_string(row["ngsi_id"])), Web3.toHex(hashlib.sha256(value).digest()), row["id"])
+            )
+
     return db
 
 def get_db() -> Connection:
     """Get a database handle
     """
-    db = sqlite3.connect(DATABASE_NAME, detect_types=sqlite3.PARSE_DECLTYPES)
-    db.row_factory = sqlite3.Row
-    return db
+    return get_connection(DATABASE_NAME)
 
 def erase_db() -> Connection:
     """Erase the table
@@ -86,6 +176,13 @@ Timestamper = b.bind_contract(Timestamper_full_path)
 owner_account = "Timestamper"
 owner_password = "ThePassword"
 
+def unlock_owner_account():
+    """Unlock in advance the account signing the timestamps, so the first entity does not wait for it"""
+    try:
+        wallet.signer_registry.unlock(owner_account, owner_password)
+    except Exception as e:
+        log.warning(f"Can not unlock account {owner_account}: {e}")
+
 tol = tolar_hashnet.acc
 tol.set_contract_wrapper(Timestamper)
 
@@ -104,66 +201,1293 @@ def default(obj):
         return obj.hex()
     raise TypeError
 
-def timestamp(id: str, value: dict) -> dict:
-    """Timestamp the hashes of an id and value.
-    """
-
-    # Order the dict keys, to make the serialization repeatable
-    sorted_value = sorted(value.items())
-    print(sorted_value)
+# Size of the hash of each attribute, in the leaves stored for an entity value
+LEAF_SIZE = 32
 
+def attribute_leaf(name: str, attribute) -> bytes:
+    """The leaf of an attribute in the Merkle Tree of the entity value:
+    the leaf hash of the serialization of [name, value], with the keys ordered.
+    """
+    return leaf_hash(orjson.dumps([name, attribute], option=orjson.OPT_SORT_KEYS))
+
+def attributes_root(leaves: List[bytes]) -> bytes:
+    """The root of the Merkle Tree with the leaves of the attributes, ordered by name"""
+    if len(leaves) == 0:
+        # The hash of an empty tree as per IETF-RFC6962
+        return hashlib.sha256(b"").digest()
+    return MerkleTree(leaves, prehashed=True).build_MHT().value
+
+def split_leaves(leaves: bytes) -> List[bytes]:
+    return [leaves[i:i + LEAF_SIZE] for i in range(0, len(leaves), LEAF_SIZE)]
+
+def entity_hashes(id: str, value: dict) -> Tuple[bytes, int, int, bytes]:
+    """Serialize the entity and calculate the hashes of its id and value.
+    The hash of the value is the root of a Merkle Tree with one leaf per attribute, ordered by name,
+    so a single attribute can be proved without the rest of the entity.
+    Returns the serialized value, the hashes as integers ready for the Timestamper contract,
+    and the leaves of the attributes concatenated.
+    """
 
-    # Serialize the dict, ordering the keys lexicographically 
+    # Serialize the dict, ordering the keys lexicographically to make the serialization repeatable
     sorted_dict = orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
 
     # Hash the "id" (of type string)
     id_hash = Web3.toInt(hash_string(id))
 
-    # Hash the serialized version of the received dict object
-    h = hashlib.sha256()
-    h.update(sorted_dict)
-    d = h.digest()
-    value_hash = Web3.toInt(d)
-    print("++++++++++++++++++++++++++++++++")
-    print(value_hash)
+    # Hash each attribute, and then the tree of the attributes
+    leaves = [attribute_leaf(name, value[name]) for name in sorted(value)]
+    value_hash = Web3.toInt(attributes_root(leaves))
+
+    return sorted_dict, id_hash, value_hash, b"".join(leaves)
+
+def legacy_value_hash(sorted_dict: bytes) -> int:
+    """The hash of the value of entities stamped before attribute hashing: the hash of the serialized value"""
+    return Web3.toInt(hashlib.sha256(sorted_dict).digest())
+
+def timestamp(id: str, value: dict, hashes: Tuple[bytes, int, int, bytes] = None) -> dict:
+    """Timestamp the hashes of an id and value.
+    Depending on the configuration, the entity is anchored in its own transaction,
+    as a leaf of a Merkle Tree anchored together with other entities, or as one of the
+    entities sent in a single batchTimestamp transaction.
+    If the same entity (same id and value) was already stamped, or is being stamped now,
+    its receipt is returned without writing again in the blockchain.
+    The hashes can be given if already calculated by entity_hashes (or update_attributes).
+    """
+
+    sorted_dict, id_hash, value_hash, leaves = hashes or entity_hashes(id, value)
+    item = PendingStamp(id, sorted_dict, id_hash, value_hash, entity_type=value.get("type"), leaves=leaves)
+
+    other, row = claim(item)
+    if other is not None:
+        # The same entity is being anchored by another request
+        return other.wait(settings.ANCHOR_TIMEOUT)
+    if row is not None:
+        return stamped_result(row)
+
+    if timestamp_buffer is not None:
+        # Wait until the batch with our entity is anchored
+        timestamp_buffer.put_item(item)
+        return item.wait(settings.ANCHOR_TIMEOUT)
+
+    try:
+        anchor_single(item)
+        store_batch([item])
+    except Exception as e:
+        item.set_result(error=e)
+        raise
+    return item.receipt
+
+async def timestamp_wait_async(id: str, value: dict, hashes: Tuple[bytes, int, int, bytes] = None) -> dict:
+    """The same as timestamp, for async code: the request waits for the anchoring
+    of its entity without blocking the event loop.
+    """
+
+    loop = asyncio.get_running_loop()
+
+    # Hashing and looking for the entity in the database are done in a thread
+    sorted_dict, id_hash, value_hash, leaves = hashes or await loop.run_in_executor(None, entity_hashes, id, value)
+    item = PendingStamp(id, sorted_dict, id_hash, value_hash, entity_type=value.get("type"), leaves=leaves)
+
+    other, row = await loop.run_in_executor(None, claim, item)
+    if other is not None:
+        return await other.wait_async(settings.ANCHOR_TIMEOUT)
+    if row is not None:
+        return stamped_result(row)
+
+    if timestamp_buffer is not None:
+        timestamp_buffer.put_item(item)
+        return await item.wait_async(settings.ANCHOR_TIMEOUT)
+
+    # Without buffer, the transaction is sent and its receipt awaited in the event loop,
+    # and only storing the entity takes a thread
+    try:
+        await anchor_single_async(item)
+        await loop.run_in_executor(None, store_batch, [item])
+    except Exception as e:
+        item.set_result(error=e)
+        raise
+    return item.receipt
+
+def timestamp_many(entities: List[dict]) -> List["PendingStamp"]:
+    """Timestamp a list of entities together, without waiting for other requests.
+    The entities are anchored in as few batches as possible (the maximum batch size depends
+    on the anchoring mode). Returns the anchored items in the same order, each one with
+    its receipt or with the error if the batch where it was included failed.
+    Entities already stamped or being stamped are not anchored again.
+    """
+
+    items = []
+    to_anchor = []
+    duplicates = []
+    for value in entities:
+        sorted_dict, id_hash, value_hash, leaves = entity_hashes(value["id"], value)
+        item = PendingStamp(value["id"], sorted_dict, id_hash, value_hash, entity_type=value.get("type"), leaves=leaves)
+        items.append(item)
+
+        other, row = claim(item)
+        if other is not None:
+            duplicates.append((item, other))
+        elif row is not None:
+            set_stamped_result(item, row)
+        else:
+            to_anchor.append(item)
+
+    anchor_batch = anchor_function(settings.CANISMAJOR_ANCHOR_MODE)
+    size = max_batch_size(settings.CANISMAJOR_ANCHOR_MODE)
+
+    for start in range(0, len(to_anchor), size):
+        batch = to_anchor[start:start + size]
+        try:
+            anchor_batch(batch)
+            store_batch(batch)
+        except Exception as e:
+            log.error(f"Error anchoring batch of {len(batch)} entities: {e}")
+            for item in batch:
+                item.set_result(error=e)
+
+    # The entities which were being anchored by other requests, or repeated in the list
+    for item, other in duplicates:
+        try:
+            item.set_result(receipt=other.wait(settings.ANCHOR_TIMEOUT))
+        except Exception as e:
+            item.set_result(error=e)
+
+    return items
+
+def existing_entities(ngsi_ids: List[str]) -> set:
+    """The subset of the entity ids which have already been stamped"""
+
+    db = get_db()
+    existing = set()
+    for ngsi_id in set(ngsi_ids):
+        row = db.execute('SELECT 1 FROM stamping WHERE ngsi_id = ? LIMIT 1', (ngsi_id,)).fetchone()
+        if row is not None:
+            existing.add(ngsi_id)
+    return existing
+
+
+####################################################
+# START: Deduplication
+
+# An entity is not stamped again only if its value is the same as in its latest version.
+# If the value changes and then goes back to a previous one (A -> B -> A), the last A is
+# a new version, with its own row and receipt.
+
+# The latest version of each entity being anchored now, indexed by id_hash
+in_flight: Dict[int, "PendingStamp"] = {}
+in_flight_lock = threading.RLock()
+
+def find_stamped(id_hash: int, value_hash: int) -> Optional[sqlite3.Row]:
+    """The latest version of the entity, anchored or pending to be anchored, if it has the same value"""
+
+    db = get_db()
+    row = db.execute(
+        "SELECT id, ngsi_id, status, ngsi_receipt, value_hash FROM stamping WHERE id_hash = ? ORDER BY id DESC LIMIT 1",
+        (Web3.toHex(to_32byte(id_hash)),)
+    ).fetchone()
+    if row is None or row["value_hash"] != Web3.toHex(to_32byte(value_hash)):
+        return None
+    return row
+
+def claim(item: "PendingStamp") -> Tuple[Optional["PendingStamp"], Optional[sqlite3.Row]]:
+    """Register the item as being anchored, unless the same entity is already stamped.
+    Returns the item being anchored by another request or the row of the stamped entity,
+    or (None, None) if the caller has to anchor the item.
+    """
+
+    with in_flight_lock:
+        # Check first the items in flight: they are stored in the database before leaving in_flight
+        latest = in_flight.get(item.id_hash)
+        if latest is not None:
+            if latest.key() == item.key():
+                return latest, None
+        else:
+            row = find_stamped(item.id_hash, item.value_hash)
+            if row is not None:
+                return None, row
+
+        in_flight[item.id_hash] = item
+        return None, None
+
+def release(item: "PendingStamp"):
+    """The item is not in flight anymore"""
+    with in_flight_lock:
+        if in_flight.get(item.id_hash) is item:
+            del in_flight[item.id_hash]
+
+def stamped_result(row: sqlite3.Row) -> dict:
+    """The receipt of an entity already stamped, or its ticket if it is still pending to be anchored"""
+
+    if row["status"] == "pending":
+        return {
+            "id": row["ngsi_id"],
+            "ticket": str(row["id"]),
+            "status": "pending"
+        }
+    return orjson.loads(row["ngsi_receipt"])
+
+def set_stamped_result(item: "PendingStamp", row: sqlite3.Row):
+    if row["status"] == "pending":
+        item.ticket = str(row["id"])
+        item.set_result()
+    else:
+        item.set_result(receipt=orjson.loads(row["ngsi_receipt"]))
+
+# END: Deduplication
+####################################################
+
+
+####################################################
+# START: Batching of timestamps
+
+# Prefix of the identifier of each batch. The hash of the identifier is anchored
+# in the blockchain together with the root of the Merkle Tree
+MERKLE_BATCH_PREFIX = "urn:canismajor:merklebatch:"
+
+def to_32byte(val: int) -> bytes:
+    return Web3.toBytes(val).rjust(32, b'\0')
+
+class PendingStamp:
+    """An entity waiting to be anchored in the blockchain.
+    If the entity was already stored as pending, row_id is its row in the stamping table.
+    """
+
+    def __init__(self, id: str, sorted_dict: bytes, id_hash: int, value_hash: int, row_id: int = None, entity_type: str = None, leaves: bytes = None) -> None:
+        self.id = id
+        self.entity_type = entity_type
+        self.sorted_dict = sorted_dict
+        self.leaves = leaves
+        self.id_hash = id_hash
+        self.value_hash = value_hash
+        self.row_id = row_id
+        self.receipt = None
+        self.tx_receipt = None
+        # The transaction (in the list sent for the batch) and the event of the entity
+        self.tx_index = 0
+        self.log_index = 0
+        # The ledgers which did not confirm before the reply, with the future of their receipts
+        self.late: Dict[str, Future] = {}
+        self.proof = None
+        self.error = None
+        self.ticket = None
+        self.done = threading.Event()
+        # The same, to be awaited by async code
+        self.future = Future()
+
+    def key(self) -> Tuple[int, int]:
+        return (self.id_hash, self.value_hash)
+
+    def leaf(self) -> bytes:
+        """The leaf of the Merkle Tree: the hash of the concatenation of the id and value hashes"""
+        return leaf_hash(to_32byte(self.id_hash) + to_32byte(self.value_hash))
+
+    def set_result(self, receipt: dict = None, error: Exception = None):
+        self.receipt = receipt
+        self.error = error
+        self.done.set()
+        if not self.future.done():
+            self.future.set_result(None)
+        release(self)
+
+    def wait(self, timeout: float = None) -> dict:
+        """Block until the entity is anchored and return its receipt"""
+        if not self.done.wait(timeout):
+            raise TimeoutError(f"Entity {self.id} not anchored after {timeout} seconds")
+        if self.error is not None:
+            raise self.error
+        return self.receipt
+
+    async def wait_async(self, timeout: float = None) -> dict:
+        """The same as wait, without blocking the event loop"""
+        try:
+            # Several requests may be waiting for the same entity, so the future is not cancelled
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.future)), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Entity {self.id} not anchored after {timeout} seconds")
+        if self.error is not None:
+            raise self.error
+        return self.receipt
+
+
+class TimestampBuffer:
+    """Accumulates entities and anchors them together with the anchor_batch function.
+    The batch is anchored when it reaches maxItems entities or when the oldest entity has been
+    waiting for maxInterval seconds, whatever happens first.
+    """
+
+    def __init__(self,
+        anchor_batch,               # Function called with the list of PendingStamp to anchor
+        maxItems: int = 1024,       # Maximum number of entities to notarize in a batch
+        maxInterval: float = 2.0    # Notarize every maxInterval (seconds) even if not enough entities received yet
+    ) -> None:
+        self.anchor_batch = anchor_batch
+        self.maxItems = maxItems
+        self.maxInterval = maxInterval
+        self.pending: List[PendingStamp] = []
+        self.oldest_pending = 0.0
+        self.condition = threading.Condition()
+        self.worker = None
+
+    def put(self, id: str, sorted_dict: bytes, id_hash: int, value_hash: int, entity_type: str = None) -> PendingStamp:
+        """Add an entity to the next batch. Returns an object to wait for the receipt."""
+
+        item = PendingStamp(id, sorted_dict, id_hash, value_hash, entity_type=entity_type)
+        return self.put_item(item)
+
+    def put_item(self, item: PendingStamp) -> PendingStamp:
+        """Add an entity already prepared to the next batch"""
+
+        with self.condition:
+            # The background worker is started on first use
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, name="TimestampBuffer", daemon=True)
+                self.worker.start()
+
+            if len(self.pending) == 0:
+                self.oldest_pending = time.monotonic()
+            self.pending.append(item)
+
+            # Wake up the worker to start timing a new batch, or because the batch is full
+            if len(self.pending) == 1 or len(self.pending) >= self.maxItems:
+                self.condition.notify()
+
+        return item
+
+    def _next_batch(self) -> List[PendingStamp]:
+        """Wait until there is a batch ready to anchor and remove it from the buffer"""
+
+        with self.condition:
+            while True:
+                if len(self.pending) >= self.maxItems:
+                    break
+                if len(self.pending) > 0:
+                    remaining = self.oldest_pending + self.maxInterval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                else:
+                    self.condition.wait()
+
+            batch = self.pending[:self.maxItems]
+            self.pending = self.pending[self.maxItems:]
+            if len(self.pending) > 0:
+                self.oldest_pending = time.monotonic()
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self.anchor_batch(batch)
+                store_batch(batch)
+            except Exception as e:
+                log.error(f"Error anchoring batch of {len(batch)} entities: {e}")
+                for item in batch:
+                    item.set_result(error=e)
+
+
+####################################################
+# START: Anchoring in several ledgers
+
+def send_to_redt(contract_funs: list) -> list:
+    """Send the transactions to Red T and return their receipts.
+    The transactions are sent back-to-back, and then we collect their receipts.
+    """
 
     # Get the JWK key from the wallet
     owner_key = wallet.get_account(owner_account, owner_password)
     if owner_key is None:
         raise Exception("Invalid account")
 
-    #owner_key = Account.from_key("0x22aabb811efca4e6f4748bd18a46b502fa85549df9fa07da649c0a148d7d5530")
+    # Send all the transactions without waiting for the receipts
+    tx_hashes = []
+    for contract_fun in contract_funs:
+        success, tx_receipt, tx_hash = b.send_signed_tx(
+            contract_fun, owner_key.privateKey, wait=False)
+        tx_hashes.append(tx_hash)
+
+    # All the receipts are waited for at most the timeout configured for the ledger
+    deadline = time.monotonic() + settings.LEDGER_TIMEOUTS.get("redt", settings.ANCHOR_TIMEOUT)
+    tx_receipts = []
+    for tx_hash in tx_hashes:
+        timeout = max(0, deadline - time.monotonic())
+        success, tx_receipt, tx_hash = b.wait_for_tx(tx_hash, timeout=timeout, address=owner_key.address)
+        if not success:
+            raise Exception(f"Transaction {Web3.toHex(tx_hash)} failed")
+        tx_receipts.append(tx_receipt)
+
+    return tx_receipts
+
+async def send_to_redt_async(contract_funs: list) -> list:
+    """The same as send_to_redt, as a coroutine: waiting for the receipts does not take a thread"""
+
+    # Unlocking the account the first time is slow, so it is done in a thread
+    loop = asyncio.get_running_loop()
+    owner_key = await loop.run_in_executor(None, wallet.get_account, owner_account, owner_password)
+    if owner_key is None:
+        raise Exception("Invalid account")
 
-    private_key = owner_key.privateKey
-    print("PK++++++++++++++++++++++++++++++")
-    print(private_key.hex())
-    # Get the contract wrapper
-    contract_fun = Timestamper.functions.timestamp(id_hash, value_hash)
+    tx_hashes = []
+    for contract_fun in contract_funs:
+        success, tx_receipt, tx_hash = await b.send_signed_tx_async(
+            contract_fun, owner_key.privateKey, wait=False)
+        tx_hashes.append(tx_hash)
+
+    deadline = time.monotonic() + settings.LEDGER_TIMEOUTS.get("redt", settings.ANCHOR_TIMEOUT)
+    tx_receipts = []
+    for tx_hash in tx_hashes:
+        timeout = max(0, deadline - time.monotonic())
+        success, tx_receipt, tx_hash = await b.wait_for_tx_async(tx_hash, timeout=timeout, address=owner_key.address)
+        if not success:
+            raise Exception(f"Transaction {Web3.toHex(tx_hash)} failed")
+        tx_receipts.append(tx_receipt)
+
+    return tx_receipts
+
+def send_to_tolar(contract_funs: list) -> list:
+    """Send the transactions to Tolar HashNet and return their receipts"""
+
+    # Send all the transactions back-to-back (nonces are allocated locally),
+    # and then wait for their receipts, which are all requested when a new block arrives
+    tx_hashes = []
+    for contract_fun in contract_funs:
+        tx_data = tol.get_function_data(contract_fun)
+        tx_hash = tol.SendExecuteFunctionTransaction(tx_data, wait=False)
+        if tx_hash is None:
+            raise Exception("Transaction in Tolar HashNet failed")
+        tol.receipts.track(tx_hash)
+        tx_hashes.append(tx_hash)
+
+    tol_receipts = []
+    for tx_hash in tx_hashes:
+        tol_receipt = tol.receipts.wait(tx_hash, timeout=settings.LEDGER_TIMEOUTS.get("tolar", settings.ANCHOR_TIMEOUT))
+        if tol_receipt is None:
+            raise Exception(f"Transaction {tx_hash} in Tolar HashNet not confirmed")
+        tol_receipts.append(tol_receipt)
+
+    return tol_receipts
+
+# The ledgers where entities can be anchored, with the function sending the transactions
+LEDGERS = {
+    "redt": send_to_redt,
+    "tolar": send_to_tolar,
+}
+
+# The ledgers that can be used from async code without a thread. The others are sent
+# from the threads of the ledger, also in async code
+LEDGERS_ASYNC = {
+    "redt": send_to_redt_async,
+}
+
+# Each ledger is waited in its own thread, so the slowest one does not delay the others.
+# Every ledger has its own pool, with a thread for each request that may be anchoring at the same
+# time, so a slow ledger (which goes on after its timeout) never takes the threads of the others
+ledger_executors = {
+    ledger: ThreadPoolExecutor(max_workers=settings.LEDGER_WORKERS, thread_name_prefix=f"Ledger-{ledger}")
+    for ledger in LEDGERS
+}
+
+# The tasks of the ledgers that go on in the event loop after the reply, referenced until they finish
+background_tasks = set()
+
+def send_to_ledgers(contract_funs: list) -> Tuple[Dict[str, list], Dict[str, Future]]:
+    """Send the transactions to all the configured ledgers concurrently, and wait until
+    ANCHOR_QUORUM of them confirm, or until each one has exhausted its timeout.
+    Returns the receipts of the ledgers which confirmed (one list per ledger, with one receipt
+    per transaction), and the futures of the ledgers which are still running.
+    """
 
-    # Execute the transaction
-    success, tx_receipt, tx_hash = b.send_signed_tx(
-        contract_fun, private_key)
+    start = time.monotonic()
+    futures = {}
+    for ledger in settings.ANCHOR_LEDGERS:
+        futures[ledger_executors[ledger].submit(LEDGERS[ledger], contract_funs)] = ledger
+
+    def deadline(future: Future) -> float:
+        return start + settings.LEDGER_TIMEOUTS.get(futures[future], settings.ANCHOR_TIMEOUT)
+
+    quorum = min(settings.ANCHOR_QUORUM, len(futures))
+    confirmed = {}
+    errors = []
+    running = set(futures)
+    late = set()
+    while len(running) > 0 and len(confirmed) < quorum:
+        timeout = max(0, min(deadline(f) for f in running) - time.monotonic())
+        done, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            ledger = futures[future]
+            try:
+                confirmed[ledger] = future.result()
+            except Exception as e:
+                log.error(f"Error anchoring in {ledger}: {e}")
+                errors.append(f"{ledger}: {e}")
+
+        # We do not wait more for the ledgers past their timeout, but they go on in the background
+        now = time.monotonic()
+        expired = set(f for f in running if deadline(f) <= now)
+        for future in expired:
+            errors.append(f"{futures[future]}: timeout")
+        running -= expired
+        late |= expired
+
+    if len(confirmed) < quorum:
+        raise Exception(f"Only {len(confirmed)} of {quorum} ledgers confirmed the transactions: {errors}")
+
+    return confirmed, {futures[f]: f for f in running | late}
+
+def thread_future(task: asyncio.Future, ledger: str) -> Future:
+    """A future with the result of the task, completed from a thread of the ledger.
+    The callbacks of the late receipts store them in the database, which must not be
+    done in the event loop.
+    """
 
-    # Execute transaction in Tolar Hashnet
-    # tx_data = tol.get_transaction_data(id_hash, value_hash)
-    # tol_receipt = tol.SendExecuteFunctionTransaction(tx_data)
-    tol_receipt = None
+    future = Future()
 
-    # Convert the transaction receipt to a standard python dict
-    receipt = receipts_as_vc(tx_receipt, tol_receipt)
+    def done(task: asyncio.Future):
+        try:
+            result = task.result()
+        except BaseException as e:
+            ledger_executors[ledger].submit(future.set_exception, e)
+        else:
+            ledger_executors[ledger].submit(future.set_result, result)
 
-    serialized_receipt = orjson.dumps(receipt, default=default)
+    task.add_done_callback(done)
+    return future
 
-    # Store the data in the local database
-    db = get_db()
-    db.execute(
-        'REPLACE INTO stamping (ngsi_id, ngsi_value, ngsi_receipt) VALUES (?, ?, ?)',
-        (id, sorted_dict, serialized_receipt)
+async def send_to_ledger_async(ledger: str, contract_funs: list) -> list:
+    if ledger in LEDGERS_ASYNC:
+        return await LEDGERS_ASYNC[ledger](contract_funs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(ledger_executors[ledger], LEDGERS[ledger], contract_funs)
+
+async def send_to_ledgers_async(contract_funs: list) -> Tuple[Dict[str, list], Dict[str, Future]]:
+    """The same as send_to_ledgers, for async code. Red T is sent and waited for in the
+    event loop, so a request waiting for its receipt does not take a thread.
+    """
+
+    loop = asyncio.get_running_loop()
+    start = time.monotonic()
+    tasks = {}
+    for ledger in settings.ANCHOR_LEDGERS:
+        tasks[loop.create_task(send_to_ledger_async(ledger, contract_funs))] = ledger
+
+    def deadline(task: asyncio.Future) -> float:
+        return start + settings.LEDGER_TIMEOUTS.get(tasks[task], settings.ANCHOR_TIMEOUT)
+
+    quorum = min(settings.ANCHOR_QUORUM, len(tasks))
+    confirmed = {}
+    errors = []
+    running = set(tasks)
+    late = set()
+    while len(running) > 0 and len(confirmed) < quorum:
+        timeout = max(0, min(deadline(t) for t in running) - time.monotonic())
+        done, running = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+        for task in done:
+            ledger = tasks[task]
+            try:
+                confirmed[ledger] = task.result()
+            except Exception as e:
+                log.error(f"Error anchoring in {ledger}: {e}")
+                errors.append(f"{ledger}: {e}")
+
+        now = time.monotonic()
+        expired = set(t for t in running if deadline(t) <= now)
+        for task in expired:
+            errors.append(f"{tasks[task]}: timeout")
+        running -= expired
+        late |= expired
+
+    # The ledgers still running go on in the background. The futures keep their tasks alive
+    # until they finish, and take their results (or errors) when they do
+    late_futures = {tasks[t]: thread_future(t, tasks[t]) for t in running | late}
+    for task in running | late:
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    if len(confirmed) < quorum:
+        raise Exception(f"Only {len(confirmed)} of {quorum} ledgers confirmed the transactions: {errors}")
+
+    return confirmed, late_futures
+
+def ledger_credential(ledger: str, ledger_receipt: dict, log_index: int = 0) -> dict:
+    """The part of the receipt of an entity corresponding to one ledger"""
+    if ledger == "redt":
+        return redt_credential(ledger_receipt, log_index)
+    return tolar_credential(ledger_receipt, log_index)
+
+def ledgers_receipt(batch: List[PendingStamp], confirmed: Dict[str, list], late: Dict[str, Future]):
+    """Create the receipt of each entity of the batch from the receipts of the ledgers which confirmed.
+    Each item must have its tx_index and log_index already set.
+    """
+
+    for item in batch:
+        credentials = []
+        for ledger in settings.ANCHOR_LEDGERS:
+            if ledger in confirmed:
+                credentials.append(ledger_credential(ledger, confirmed[ledger][item.tx_index], item.log_index))
+        item.receipt = credentials_as_vc(credentials)
+        if "redt" in confirmed:
+            item.tx_receipt = confirmed["redt"][item.tx_index]
+        item.late = late
+
+def wait_late_receipts(batch: List[PendingStamp]):
+    """Append the receipts of the ledgers which confirm after the reply to the stored receipts.
+    Called once the batch is stored.
+    """
+
+    late = {}
+    for item in batch:
+        for ledger, future in item.late.items():
+            late.setdefault(future, (ledger, []))[1].append(item)
+
+    for future, (ledger, items) in late.items():
+        future.add_done_callback(
+            lambda f, ledger=ledger, items=items: append_late_receipts(ledger, f, items))
+
+def append_late_receipts(ledger: str, future: Future, batch: List[PendingStamp]):
+    """Append the part of a ledger to the stored receipts of the entities"""
+
+    try:
+        ledger_receipts = future.result()
+    except Exception as e:
+        log.error(f"Error anchoring {len(batch)} entities in {ledger}: {e}")
+        return
+
+    with transaction(get_db()) as db:
+        for item in batch:
+            row = db.execute(
+                "SELECT id, ngsi_receipt FROM stamping WHERE id_hash = ? AND value_hash = ? AND status = 'anchored' ORDER BY id DESC LIMIT 1",
+                (Web3.toHex(to_32byte(item.id_hash)), Web3.toHex(to_32byte(item.value_hash)))
+            ).fetchone()
+            if row is None:
+                continue
+
+            receipt = orjson.loads(row["ngsi_receipt"])
+            credential = ledger_credential(ledger, ledger_receipts[item.tx_index], item.log_index)
+            receipt["vc"]["credentialSubject"]["NGSIv2ReceiptCredential"].append(credential)
+            db.execute(
+                "UPDATE stamping SET ngsi_receipt = ? WHERE id = ?",
+                (orjson.dumps(receipt, default=default), row["id"])
+            )
+
+        if ledger == "redt":
+            for tx_receipt in ledger_receipts:
+                db.execute(
+                    "INSERT OR IGNORE INTO tx_receipt (tx_hash, receipt) VALUES (?, ?)",
+                    (bytes(tx_receipt["transactionHash"]), pack_receipt(tx_receipt))
+                )
+
+# END: Anchoring in several ledgers
+####################################################
+
+def anchor_single(item: PendingStamp):
+    """Anchor the entity in its own transaction.
+    """
+    anchor_single_batch([item])
+
+async def anchor_single_async(item: PendingStamp):
+    """The same as anchor_single, for async code"""
+
+    item.tx_index = 0
+    contract_fun = Timestamper.functions.timestamp(item.id_hash, item.value_hash)
+    confirmed, late = await send_to_ledgers_async([contract_fun])
+    ledgers_receipt([item], confirmed, late)
+
+def anchor_single_batch(batch: List[PendingStamp]):
+    """Anchor each entity of the batch in its own transaction, in all the ledgers.
+    """
+
+    contract_funs = []
+    for index, item in enumerate(batch):
+        contract_funs.append(Timestamper.functions.timestamp(item.id_hash, item.value_hash))
+        item.tx_index = index
+
+    confirmed, late = send_to_ledgers(contract_funs)
+    ledgers_receipt(batch, confirmed, late)
+
+def anchor_merkle_batch(batch: List[PendingStamp]):
+    """Anchor the root of the Merkle Tree of the entities, and create the receipt
+    of each entity including its inclusion proof.
+    """
+
+    # Build the Merkle Tree with the entities in the batch
+    tree = MerkleTree([item.leaf() for item in batch], prehashed=True)
+    root = tree.build_MHT().value
+
+    # The batch is identified by a unique name, whose hash is anchored with the root
+    batch_id = MERKLE_BATCH_PREFIX + unique_id.uuid4().hex
+    batch_id_hash = Web3.toInt(hash_string(batch_id))
+
+    # Anchor the root of the tree
+    contract_fun = Timestamper.functions.timestamp(batch_id_hash, Web3.toInt(root))
+    confirmed, late = send_to_ledgers([contract_fun])
+    ledgers_receipt(batch, confirmed, late)
+
+    # Add to the receipt of each entity its inclusion proof in the tree
+    for index, item in enumerate(batch):
+        item.proof = {
+            "batchId": batch_id,
+            "root": Web3.toHex(root),
+            "leafIndex": index,
+            "leaf": Web3.toHex(item.leaf()),
+            "path": tree.export_inclusion_proof(index)
+        }
+        item.receipt["vc"]["credentialSubject"]["merkleProof"] = item.proof
+
+def anchor_timestamp_batch(batch: List[PendingStamp]):
+    """Anchor the entities with a single call to batchTimestamp, and create the receipt
+    of each entity from its own Timestamp event.
+    """
+
+    # One transaction emits one Timestamp event for each entity, in the same order
+    id_hashes = [item.id_hash for item in batch]
+    value_hashes = [item.value_hash for item in batch]
+    contract_fun = Timestamper.functions.batchTimestamp(id_hashes, value_hashes)
+    confirmed, late = send_to_ledgers([contract_fun])
+
+    if "redt" in confirmed:
+        tx_receipt = confirmed["redt"][0]
+        if len(tx_receipt["logs"]) != len(batch):
+            raise Exception(f"Expected {len(batch)} Timestamp events, received {len(tx_receipt['logs'])}")
+
+        for index, item in enumerate(batch):
+            # Sanity check: the indexed topics of the event are the hashes of the entity
+            topics = tx_receipt["logs"][index]["topics"]
+            if Web3.toInt(topics[1]) != item.id_hash or Web3.toInt(topics[2]) != item.value_hash:
+                raise Exception(f"Timestamp event {index} does not correspond to entity {item.id}")
+
+    for index, item in enumerate(batch):
+        item.log_index = index
+    ledgers_receipt(batch, confirmed, late)
+
+def store_batch(batch: List[PendingStamp]):
+    """Store the anchored entities in a single database transaction, and only then
+    wake up the callers waiting for them.
+    """
+
+    inserts = []
+    values = []
+    leaves = []
+    updates = []
+    for item in batch:
+        serialized_receipt = orjson.dumps(item.receipt, default=default)
+        serialized_proof = orjson.dumps(item.proof) if item.proof is not None else None
+        if item.row_id is None:
+            value_hash = Web3.toHex(to_32byte(item.value_hash))
+            inserts.append((item.id, serialized_receipt, serialized_proof,
+                Web3.toHex(to_32byte(item.id_hash)), value_hash, item.entity_type))
+            values.append((value_hash, item.sorted_dict))
+            if item.leaves is not None:
+                leaves.append((value_hash, item.leaves))
+        else:
+            updates.append((serialized_receipt, serialized_proof, item.row_id))
+
+    # Keep the transaction receipts, to serve them without asking the blockchain node
+    tx_receipts = {}
+    for item in batch:
+        if item.tx_receipt is not None:
+            tx_receipts[bytes(item.tx_receipt["transactionHash"])] = item.tx_receipt
+
+    with transaction(get_db()) as db:
+        # The values are stored only once, even if several entities (or versions) have the same value
+        db.executemany(
+            "INSERT OR IGNORE INTO stamping_value (value_hash, ngsi_value) VALUES (?, ?)",
+            values
+        )
+        db.executemany(
+            "INSERT OR IGNORE INTO stamping_leaves (value_hash, leaves) VALUES (?, ?)",
+            leaves
+        )
+        db.executemany(
+            """INSERT INTO stamping (ngsi_id, ngsi_value, ngsi_receipt, ngsi_proof, id_hash, value_hash, ngsi_type, status)
+            VALUES (?, '', ?, ?, ?, ?, ?, 'anchored')""",
+            inserts
+        )
+        db.executemany(
+            "UPDATE stamping SET ngsi_receipt = ?, ngsi_proof = ?, status = 'anchored' WHERE id = ?",
+            updates
+        )
+        db.executemany(
+            "INSERT OR IGNORE INTO tx_receipt (tx_hash, receipt) VALUES (?, ?)",
+            [(tx_hash, pack_receipt(tx_receipt)) for tx_hash, tx_receipt in tx_receipts.items()]
+        )
+
+    for item in batch:
+        item.set_result(receipt=item.receipt)
+
+    # The receipts of the slower ledgers are added when they arrive
+    wait_late_receipts(batch)
+
+def anchor_function(anchor_mode: str):
+    """The function that anchors a batch of entities with the anchoring mode"""
+
+    if anchor_mode == "merkle":
+        return anchor_merkle_batch
+    if anchor_mode == "batch":
+        return anchor_timestamp_batch
+    return anchor_single_batch
+
+def max_batch_size(anchor_mode: str) -> int:
+    """Maximum number of entities anchored together with the anchoring mode"""
+
+    if anchor_mode == "merkle":
+        return settings.MERKLE_MAX_LEAVES
+    return settings.BATCH_MAX_ENTITIES
+
+def new_timestamp_buffer(anchor_mode: str) -> Optional[TimestampBuffer]:
+    """Create the buffer of entities for the anchoring mode, or None if entities are not batched"""
+
+    if anchor_mode == "merkle":
+        return TimestampBuffer(
+            anchor_merkle_batch,
+            maxItems=settings.MERKLE_MAX_LEAVES,
+            maxInterval=settings.MERKLE_MAX_INTERVAL
+        )
+
+    if anchor_mode == "batch":
+        return TimestampBuffer(
+            anchor_timestamp_batch,
+            maxItems=settings.BATCH_MAX_ENTITIES,
+            maxInterval=settings.BATCH_MAX_INTERVAL
+        )
+
+    return None
+
+# Buffer of entities waiting to be anchored
+timestamp_buffer = new_timestamp_buffer(settings.CANISMAJOR_ANCHOR_MODE)
+
+# END: Batching of timestamps
+####################################################
+
+
+####################################################
+# START: Asynchronous ingestion
+
+# The write-ahead log with the hashes of the entities pending to be anchored
+WAL_FILE = os.path.join(settings.DATABASE_DIR, "fifo.que")
+
+class AsyncIngestion:
+    """Durable asynchronous ingestion of entities.
+    Each entity is stored as pending (committed with synchronous=FULL) and then its hashes are appended
+    to a write-ahead log (a FIFOFile), which is fsync'ed before acknowledging the entity to the caller.
+    So every record in the log has its row in the database, with the value to anchor.
+    A background drainer anchors the entities in the log and removes them only after they are anchored,
+    so entities are not lost if the server stops before anchoring them.
+    """
+
+    def __init__(self, wal_file: str = WAL_FILE, maxsize: int = 10000, maxItems: int = 1024) -> None:
+        # With fsync_time=0 every write to the log is fsync'ed
+        self.wal = FIFOFile(Path(wal_file), maxsize=maxsize, fsync_time=0)
+        self.maxItems = maxItems
+        # The pending entities recovered at startup which did not fit in the log. They are
+        # appended to it by the drainer as it makes room, before accepting new entities
+        self.overflow = deque()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.worker = None
+
+    def start(self):
+        """Recover the entities pending from a previous run and start the background drainer"""
+
+        self.recover()
+        self.worker = threading.Thread(target=self._run, name="AsyncIngestion", daemon=True)
+        self.worker.start()
+
+    def submit(self, id: str, sorted_dict: bytes, id_hash: int, value_hash: int, entity_type: str = None, leaves: bytes = None) -> int:
+        """Store the entity as pending and append it to the log. Returns the ticket of the entity."""
+
+        # The row must survive a crash: the log only has the hashes of the entity
+        with transaction(get_db(), durable=True) as db:
+            db.execute(
+                "INSERT OR IGNORE INTO stamping_value (value_hash, ngsi_value) VALUES (?, ?)",
+                (Web3.toHex(to_32byte(value_hash)), sorted_dict)
+            )
+            if leaves is not None:
+                db.execute(
+                    "INSERT OR IGNORE INTO stamping_leaves (value_hash, leaves) VALUES (?, ?)",
+                    (Web3.toHex(to_32byte(value_hash)), leaves)
+                )
+            cursor = db.execute(
+                """INSERT INTO stamping (ngsi_id, ngsi_value, ngsi_receipt, id_hash, value_hash, ngsi_type, status)
+                VALUES (?, '', '', ?, ?, ?, 'pending')""",
+                (id, Web3.toHex(to_32byte(id_hash)), Web3.toHex(to_32byte(value_hash)), entity_type)
+            )
+        ticket = cursor.lastrowid
+
+        try:
+            with self.lock:
+                if len(self.overflow) > 0:
+                    raise FullError("Queue is full, recovering pending entities")
+                self.wal.put_hashes(to_32byte(id_hash), to_32byte(value_hash))
+        except Exception:
+            # The entity was not accepted
+            with transaction(get_db()) as db:
+                db.execute("DELETE FROM stamping WHERE id = ?", (ticket,))
+            raise
+
+        self.wakeup.set()
+        return ticket
+
+    def recover(self):
+        """Append to the log the pending entities which did not reach it before a crash.
+        The ones that do not fit are kept in the overflow, and appended later by the drainer.
+        """
+
+        with self.lock:
+            in_log = Counter(self.wal.peek_many(self.wal.size))
+
+            db = get_db()
+            rows = db.execute("SELECT id_hash, value_hash FROM stamping WHERE status = 'pending' ORDER BY id").fetchall()
+            for row in rows:
+                record = (HexBytes(row["id_hash"]), HexBytes(row["value_hash"]))
+                if in_log[record] > 0:
+                    in_log[record] -= 1
+                else:
+                    self.overflow.append(record)
+            self._refill()
+
+        if len(self.overflow) > 0:
+            log.warning(f"{len(self.overflow)} pending entities do not fit in the log, they will be appended as it is drained")
+
+    def _refill(self):
+        """Append to the log the entities of the overflow that fit. Called with the lock held."""
+
+        while len(self.overflow) > 0 and not self.wal.full():
+            self.wal.put_hashes(*self.overflow.popleft())
+
+    def _pending_stamps(self, records: List[Tuple]) -> List[PendingStamp]:
+        """Get from the database the pending entities corresponding to the records of the log"""
+
+        db = get_db()
+        batch = []
+        assigned = set()
+        for id_hash, value_hash in records:
+            rows = db.execute(
+                SELECT_ITEMS + " WHERE id_hash = ? AND stamping.value_hash = ? AND status = 'pending' ORDER BY id",
+                (Web3.toHex(id_hash), Web3.toHex(value_hash))
+            ).fetchall()
+            row = next((row for row in rows if row["id"] not in assigned), None)
+            if row is None:
+                # Anchored and stored before a crash, but not yet dropped from the log
+                log.warning(f"Entity {Web3.toHex(id_hash)} in the log is not pending in the database")
+                continue
+            assigned.add(row["id"])
+            batch.append(PendingStamp(row["ngsi_id"], item_value(row), Web3.toInt(id_hash), Web3.toInt(value_hash), row_id=row["id"]))
+
+        return batch
+
+    def _run(self):
+        anchor_batch = anchor_function(settings.CANISMAJOR_ANCHOR_MODE)
+        retry_delay = 1
+
+        while True:
+            self.wakeup.clear()
+            with self.lock:
+                records = self.wal.peek_many(self.maxItems)
+
+            if len(records) == 0:
+                self.wakeup.wait(1)
+                continue
+
+            try:
+                batch = self._pending_stamps(records)
+                if len(batch) > 0:
+                    anchor_batch(batch)
+                    store_batch(batch)
+            except Exception as e:
+                # The entities stay in the log, and we retry later
+                log.error(f"Error anchoring {len(records)} entities from the log: {e}")
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 60)
+                continue
+
+            retry_delay = 1
+            with self.lock:
+                self.wal.drop(len(records))
+                self._refill()
+
+
+async_ingestion: AsyncIngestion = None
+
+# Entities being stored in the log now, indexed by (id_hash, value_hash)
+submitting: Dict[Tuple[int, int], threading.Event] = {}
+
+def start_async_ingestion():
+    """Start accepting entities asynchronously and anchoring them in the background"""
+    global async_ingestion
+    async_ingestion = AsyncIngestion(
+        maxsize=settings.ASYNC_INGESTION_QUEUE_SIZE,
+        maxItems=max_batch_size(settings.CANISMAJOR_ANCHOR_MODE)
     )
-    # Commit database
-    db.commit()
+    async_ingestion.start()
 
-    return receipt
+def timestamp_async(id: str, value: dict, hashes: Tuple[bytes, int, int, bytes] = None) -> dict:
+    """Accept the entity to be timestamped in the background.
+    Returns as soon as the entity is durably stored, with a ticket to follow its status.
+    """
+
+    sorted_dict, id_hash, value_hash, leaves = hashes or entity_hashes(id, value)
+    key = (id_hash, value_hash)
+
+    while True:
+        with in_flight_lock:
+            # Do not stamp again an entity with the same id and value
+            row = find_stamped(id_hash, value_hash)
+            if row is not None:
+                return stamped_result(row)
+
+            other = submitting.get(key)
+            if other is None:
+                done = threading.Event()
+                submitting[key] = done
+                break
+
+        # The same entity is being stored by another request: reply with its ticket
+        other.wait()
+
+    # The fsyncs of the database and the log are done without holding the lock
+    try:
+        ticket = async_ingestion.submit(id, sorted_dict, id_hash, value_hash, value.get("type"), leaves)
+    finally:
+        with in_flight_lock:
+            del submitting[key]
+        done.set()
+
+    return {
+        "id": id,
+        "ticket": str(ticket),
+        "status": "pending"
+    }
+
+# END: Asynchronous ingestion
+
+####################################################
+# START: Indexer of Timestamp events
+
+# Topic of the Timestamp(uint256 indexed id_hash, uint256 indexed value_hash) event
+TIMESTAMP_TOPIC = Web3.toHex(Web3.keccak(text="Timestamp(uint256,uint256)"))
+
+class EventIndexer:
+    """Background indexer of the Timestamp events emitted by the Timestamper contract.
+    The events are pulled with eth_getLogs in ranges of blocks, several ranges in parallel,
+    and stored in the timestamp_event table together with the last processed block,
+    so verifications can be answered from the local database without asking the node.
+    The network uses IBFT, so blocks are final and there is no need to handle reorgs.
+    """
+
+    def __init__(self, start_block: int = 0, chunk_size: int = 2000, workers: int = 4, poll_interval: float = 2.0) -> None:
+        self.start_block = start_block
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="EventIndexer")
+        self.worker = None
+
+    def start(self):
+        self.worker = threading.Thread(target=self._run, name="EventIndexer", daemon=True)
+        self.worker.start()
+
+    def checkpoint(self) -> int:
+        """The last block already indexed, or start_block - 1 if nothing was indexed yet"""
+
+        block_number = indexed_block()
+        if block_number is None:
+            return self.start_block - 1
+        return block_number
+
+    def _fetch_range(self, from_block: int, to_block: int) -> list:
+        """The Timestamp events in the range of blocks (both included).
+        If the node refuses the range (eg. too many results), it is split in two halves.
+        """
+
+        try:
+            return w3.eth.get_logs({
+                "address": Timestamper.address,
+                "fromBlock": from_block,
+                "toBlock": to_block,
+                "topics": [TIMESTAMP_TOPIC]
+            })
+        except Exception as e:
+            if from_block == to_block:
+                raise
+            middle = (from_block + to_block) // 2
+            log.warning(f"Splitting range {from_block}-{to_block} of events: {e}")
+            return self._fetch_range(from_block, middle) + self._fetch_range(middle + 1, to_block)
+
+    def _fetch_chunk(self, block_range: Tuple[int, int]) -> list:
+        """The rows for the timestamp_event table with the events in the range of blocks"""
+
+        events = self._fetch_range(*block_range)
+
+        # The time of the blocks with events, to say when the entities were anchored
+        block_times = {}
+        for block_number in sorted(set(event["blockNumber"] for event in events)):
+            block_times[block_number] = w3.eth.get_block(block_number)["timestamp"]
+
+        rows = []
+        for event in events:
+            topics = event["topics"]
+            rows.append((
+                Web3.toHex(event["transactionHash"]),
+                event["logIndex"],
+                Web3.toHex(topics[1]),
+                Web3.toHex(topics[2]),
+                event["blockNumber"],
+                block_times[event["blockNumber"]]
+            ))
+        return rows
+
+    def index_once(self) -> int:
+        """Index the events from the checkpoint to the latest block.
+        Returns the number of events indexed.
+        """
+
+        from_block = self.checkpoint() + 1
+        latest_block = w3.eth.block_number
+
+        num_events = 0
+        while from_block <= latest_block:
+            # Fetch in parallel one range of blocks per worker
+            ranges = []
+            while len(ranges) < self.workers and from_block <= latest_block:
+                to_block = min(from_block + self.chunk_size - 1, latest_block)
+                ranges.append((from_block, to_block))
+                from_block = to_block + 1
+
+            # Store the ranges in order, each one with the checkpoint in the same transaction.
+            # If a range fails, the previous ones are kept and we retry from it later
+            for block_range, rows in zip(ranges, self.executor.map(self._fetch_chunk, ranges)):
+                with transaction(get_db()) as db:
+                    db.executemany(
+                        """INSERT OR IGNORE INTO timestamp_event
+                        (tx_hash, log_index, id_hash, value_hash, block_number, block_timestamp)
+                        VALUES (?, ?, ?, ?, ?, ?)""",
+                        rows
+                    )
+                    db.execute(
+                        "INSERT OR REPLACE INTO indexer_checkpoint (name, block_number) VALUES ('Timestamper', ?)",
+                        (block_range[1],)
+                    )
+                num_events += len(rows)
+
+        return num_events
+
+    def _run(self):
+        retry_delay = self.poll_interval
+
+        while True:
+            try:
+                self.index_once()
+                retry_delay = self.poll_interval
+            except Exception as e:
+                log.error(f"Error indexing Timestamp events: {e}")
+                retry_delay = min(retry_delay * 2, 60)
+            time.sleep(retry_delay)
+
+
+event_indexer: EventIndexer = None
+
+def start_event_indexer():
+    """Start indexing the Timestamp events in the background"""
+    global event_indexer
+    event_indexer = EventIndexer(
+        start_block=settings.INDEXER_START_BLOCK,
+        chunk_size=settings.INDEXER_CHUNK_SIZE,
+        workers=settings.INDEXER_WORKERS,
+        poll_interval=settings.INDEXER_POLL_INTERVAL
+    )
+    event_indexer.start()
+
+def indexed_block() -> Optional[int]:
+    """The last block indexed, or None if nothing was indexed yet"""
+
+    db = get_db()
+    row = db.execute("SELECT block_number FROM indexer_checkpoint WHERE name = 'Timestamper'").fetchone()
+    if row is None:
+        return None
+    return row["block_number"]
+
+def find_event(id_hash: str, value_hash: str) -> Optional[sqlite3.Row]:
+    """The first indexed Timestamp event with the hashes (in hex)"""
+
+    db = get_db()
+    return db.execute(
+        "SELECT * FROM timestamp_event WHERE id_hash = ? AND value_hash = ? ORDER BY block_number LIMIT 1",
+        (id_hash, value_hash)
+    ).fetchone()
+
+def find_anchoring(id: str, id_hash: int, value_hash: int) -> Tuple[Optional[sqlite3.Row], Optional[dict]]:
+    """The indexed event anchoring the hashes, and the inclusion proof if they were anchored in a Merkle Tree"""
+
+    id_hash_hex = Web3.toHex(to_32byte(id_hash))
+    value_hash_hex = Web3.toHex(to_32byte(value_hash))
+
+    # The entity anchored in its own Timestamp event
+    event = find_event(id_hash_hex, value_hash_hex)
+    if event is not None:
+        return event, None
+
+    # Or as a leaf of the Merkle Tree anchored in a batch
+    db = get_db()
+    rows = db.execute(
+        "SELECT ngsi_proof FROM stamping WHERE id_hash = ? AND value_hash = ? AND ngsi_proof IS NOT NULL ORDER BY id",
+        (id_hash_hex, value_hash_hex)
+    ).fetchall()
+    leaf = leaf_hash(to_32byte(id_hash) + to_32byte(value_hash))
+    for row in rows:
+        proof = orjson.loads(row["ngsi_proof"])
+        root = HexBytes(proof["root"])
+        if not verify_MHT_proof(leaf, proof["path"], bytes(root)):
+            log.warning(f"Invalid inclusion proof for entity {id} in batch {proof['batchId']}")
+            continue
+        batch_id_hash = Web3.toHex(to_32byte(Web3.toInt(hash_string(proof["batchId"]))))
+        event = find_event(batch_id_hash, Web3.toHex(root))
+        if event is not None:
+            return event, proof
+
+    return None, None
+
+def verify_entity(id: str, value: dict) -> dict:
+    """Check if this exact entity (id and value) was anchored in the blockchain, and when.
+    Only the events indexed locally are used, without calls to the blockchain node.
+    Entities anchored in a Merkle Tree are verified with the inclusion proof stored with them,
+    against the root in the event of their batch.
+    """
+
+    sorted_dict, id_hash, value_hash, leaves = entity_hashes(id, value)
+
+    result = {
+        "id": id,
+        "idHash": Web3.toHex(to_32byte(id_hash)),
+        "valueHash": Web3.toHex(to_32byte(value_hash)),
+        "anchored": False,
+        "indexedBlock": indexed_block()
+    }
+
+    event, proof = find_anchoring(id, id_hash, value_hash)
+    if event is None:
+        # The entity may have been stamped before attribute hashing
+        value_hash = legacy_value_hash(sorted_dict)
+        event, proof = find_anchoring(id, id_hash, value_hash)
+        if event is None:
+            return result
+        result["valueHash"] = Web3.toHex(to_32byte(value_hash))
+
+    result["anchored"] = True
+    result["blockNumber"] = event["block_number"]
+    result["blockTimestamp"] = event["block_timestamp"]
+    result["transactionHash"] = event["tx_hash"]
+    result["logIndex"] = event["log_index"]
+    if proof is not None:
+        result["merkleProof"] = proof
+
+    return result
+
+# END: Indexer of Timestamp events
+
+####################################################
 
 def checktimestamp() -> bool:
     """Check if smart contract is accessible.
@@ -180,6 +1504,17 @@ def checktimestamp() -> bool:
     print("OK")
     return True
 
+async def checktimestamp_async() -> bool:
+    """The same as checktimestamp, with the async provider"""
+
+    hash1 = 0x555555555555
+    hash2 = 0x88888888888888888
+
+    # Call the timestamp function as a call, not transaction. It fails if the contract is not accessible
+    await b.call_async(Timestamper.functions.timestamp(hash1, hash2))
+
+    return True
+
 # For the menu operations
 def m_timestamp():
     """Timestamp a hash.
@@ -206,6 +1541,46 @@ def m_timestamp():
 
     return receipt
 
+# Select the items with their values, stored apart in the stamping_value table.
+# Items stamped before the values were stored apart have the value inline in the ngsi_value column
+SELECT_ITEMS = """SELECT stamping.*, stamping_value.ngsi_value AS stored_value FROM stamping
+LEFT JOIN stamping_value ON stamping_value.value_hash = stamping.value_hash"""
+
+def item_value(item: sqlite3.Row):
+    """The serialized value of an item selected with SELECT_ITEMS"""
+    if item["stored_value"] is not None:
+        return item["stored_value"]
+    return item["ngsi_value"]
+
+def item_from_row(item: sqlite3.Row) -> dict:
+    """Convert a row of the stamping table to the dict returned to the callers"""
+
+    # Rows created before asynchronous ingestion do not have status, and are anchored
+    status = item["status"] or "anchored"
+
+    item_d = {
+        "id": item["ngsi_id"],
+        "value": orjson.loads(item_value(item)),
+        "status": status
+    }
+    if status == "pending":
+        # The entity is still waiting in the write-ahead log
+        item_d["ticket"] = str(item["id"])
+        return item_d
+
+    item_d["receipt"] = orjson.loads(item["ngsi_receipt"])
+    if item["ngsi_proof"] is not None:
+        item_d["proof"] = orjson.loads(item["ngsi_proof"])
+
+    return item_d
+
+def latest_version(ngsi_id: str) -> Optional[sqlite3.Row]:
+    """The row of the latest version of the entity"""
+    db = get_db()
+    return db.execute(
+        SELECT_ITEMS + ' WHERE ngsi_id = ? ORDER BY id DESC LIMIT 1', (ngsi_id,)
+    ).fetchone()
+
 def list_one_item(ngsi_id: str):
     """List one item.
 
@@ -213,22 +1588,97 @@ def list_one_item(ngsi_id: str):
     {"name": "ngsi_id", "prompt": "Id of the item"}
     """
 
-    db = get_db()
-
-    all_items = db.execute('SELECT * FROM stamping WHERE ngsi_id = ?', (ngsi_id,)).fetchall()
-    if len(all_items) == 0:
+    # The latest version of the entity, using the index on (ngsi_id, id)
+    item = latest_version(ngsi_id)
+    if item is None:
         return {}
-    
-    item = all_items[-1]
-    
 
-    item_d = {
-        "id": item["ngsi_id"],
-        "value": orjson.loads(item["ngsi_value"]),
-        "receipt": orjson.loads(item["ngsi_receipt"])
+    return item_from_row(item)
+
+def list_item_history(ngsi_id: str, limit: int = 100, cursor: Optional[int] = None) -> dict:
+    """List the versions of an entity with their receipts, from the newest to the oldest.
+    Pagination is done with a cursor: the "next" field of a page is the cursor to get the following one,
+    and is None in the last page.
+    """
+
+    db = get_db()
+
+    if cursor is None:
+        rows = db.execute(
+            SELECT_ITEMS + ' WHERE ngsi_id = ? ORDER BY id DESC LIMIT ?', (ngsi_id, limit)
+        ).fetchall()
+    else:
+        rows = db.execute(
+            SELECT_ITEMS + ' WHERE ngsi_id = ? AND id < ? ORDER BY id DESC LIMIT ?', (ngsi_id, cursor, limit)
+        ).fetchall()
+
+    versions = []
+    for row in rows:
+        item_d = item_from_row(row)
+        item_d["version"] = row["id"]
+        versions.append(item_d)
+
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = rows[-1]["id"]
+
+    return {
+        "id": ngsi_id,
+        "versions": versions,
+        "next": next_cursor
     }
 
-    return item_d
+def query_items(limit: int = 20, offset: int = 0, cursor: Optional[int] = None, entity_type: Optional[str] = None) -> List[dict]:
+    """List a page of items, in the order they were stamped.
+    Deep pages should use cursor (the version of the last item of the previous page)
+    instead of offset, so SQLite does not have to skip all the previous rows.
+    """
+
+    sql = SELECT_ITEMS + ' WHERE id > ?'
+    params = [cursor if cursor is not None else 0]
+    if entity_type is not None:
+        sql += ' AND ngsi_type = ?'
+        params.append(entity_type)
+    sql += ' ORDER BY id LIMIT ? OFFSET ?'
+    params.extend([limit, offset])
+
+    db = get_db()
+
+    items = []
+    for row in db.execute(sql, params):
+        item_d = item_from_row(row)
+        item_d["version"] = row["id"]
+        items.append(item_d)
+
+    return items
+
+def iter_items(cursor: Optional[int] = None, entity_type: Optional[str] = None, limit: Optional[int] = None, chunk_size: int = 500):
+    """Iterate the items in the order they were stamped, reading them from the database in chunks.
+    Memory use does not depend on the size of the table.
+    Each chunk is read in a single call, so the generator can be resumed from any thread.
+    """
+
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        items = query_items(size, 0, cursor, entity_type)
+        yield from items
+
+        if len(items) < size:
+            return
+        cursor = items[-1]["version"]
+        if remaining is not None:
+            remaining -= len(items)
+
+def count_items(entity_type: Optional[str] = None) -> int:
+    """Number of items, optionally only those of one type"""
+
+    db = get_db()
+    if entity_type is None:
+        row = db.execute('SELECT COUNT(*) FROM stamping').fetchone()
+    else:
+        row = db.execute('SELECT COUNT(*) FROM stamping WHERE ngsi_type = ?', (entity_type,)).fetchone()
+    return row[0]
 
 def list_all():
     """List all items.
@@ -238,14 +1688,122 @@ def list_all():
 
     db = get_db()
 
-    items = db.execute('SELECT * FROM stamping ORDER BY id').fetchall()
+    # The values of the entities are stored once in stamping_value, and ngsi_value is empty
+    items = db.execute(SELECT_ITEMS + ' ORDER BY id').fetchall()
     list_accumulator = []
     for item in items:
-        list_accumulator.append({k: item[k] for k in item.keys()})
+        item_d = {k: item[k] for k in item.keys() if k != "stored_value"}
+        item_d["ngsi_value"] = item_value(item)
+        list_accumulator.append(item_d)
 
     return list_accumulator
 
     
+####################################################
+# START: Attributes of entities
+
+# Members of an entity which are not attributes and can not be modified
+NOT_ATTRIBUTES = ("id", "type", "@context")
+
+def stored_leaves(row: sqlite3.Row, value: dict) -> List[bytes]:
+    """The leaves of the attributes of a stored version, ordered by name.
+    They are calculated again only for the entities stamped before attribute hashing.
+    """
+
+    db = get_db()
+    leaves_row = db.execute(
+        "SELECT leaves FROM stamping_leaves WHERE value_hash = ?", (row["value_hash"],)
+    ).fetchone()
+    if leaves_row is not None:
+        return split_leaves(leaves_row["leaves"])
+
+    return [attribute_leaf(name, value[name]) for name in sorted(value)]
+
+def update_attributes(ngsi_id: str, attributes: dict, append: bool = False, overwrite: bool = True):
+    """Create a new version of the entity, modifying the given attributes of the latest version.
+    When append is True new attributes are added, and existing ones are replaced only if overwrite is True.
+    Only the modified attributes are hashed again: the leaves of the others are reused to get the new root.
+    Returns the new value, its hashes (as returned by entity_hashes), the names of the updated attributes
+    and the list of the ones not updated with the reason, or None if the entity does not exist.
+    """
+
+    row = latest_version(ngsi_id)
+    if row is None:
+        return None
+
+    value = orjson.loads(item_value(row))
+    names = sorted(value)
+    leaves = dict(zip(names, stored_leaves(row, value)))
+
+    updated = []
+    not_updated = []
+    for name, attribute in attributes.items():
+        if name in NOT_ATTRIBUTES:
+            if name != "@context":
+                not_updated.append({"attributeName": name, "reason": f"{name} can not be modified"})
+            continue
+        if name in value:
+            if append and not overwrite:
+                not_updated.append({"attributeName": name, "reason": "Attribute already exists"})
+                continue
+        elif not append:
+            not_updated.append({"attributeName": name, "reason": "Attribute does not exist"})
+            continue
+
+        value[name] = attribute
+        leaves[name] = attribute_leaf(name, attribute)
+        updated.append(name)
+
+    # The new root only needs the hashes of the interior nodes of the tree
+    sorted_leaves = [leaves[name] for name in sorted(value)]
+    sorted_dict = orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+    id_hash = Web3.toInt(hash_string(ngsi_id))
+    value_hash = Web3.toInt(attributes_root(sorted_leaves))
+    hashes = (sorted_dict, id_hash, value_hash, b"".join(sorted_leaves))
+
+    return value, hashes, updated, not_updated
+
+def attribute_proof(ngsi_id: str, name: str) -> Optional[dict]:
+    """The proof that an attribute is part of the latest version of the entity: the inclusion proof of
+    the attribute in the tree of the attributes, whose root is the value hash anchored in the receipt.
+    Returns None if the entity or the attribute do not exist.
+    """
+
+    row = latest_version(ngsi_id)
+    if row is None:
+        return None
+
+    value = orjson.loads(item_value(row))
+    if name not in value:
+        return None
+
+    names = sorted(value)
+    leaves = stored_leaves(row, value)
+    tree = MerkleTree(leaves, prehashed=True)
+    root = tree.build_MHT().value
+    if Web3.toHex(root) != row["value_hash"]:
+        raise Exception(f"Entity {ngsi_id} was stamped before attribute hashing, and its attributes can not be proved")
+
+    index = names.index(name)
+    proof = {
+        "id": ngsi_id,
+        "attributeName": name,
+        "attributeValue": value[name],
+        "leafIndex": index,
+        "leaf": Web3.toHex(leaves[index]),
+        "path": tree.export_inclusion_proof(index),
+        "idHash": row["id_hash"],
+        "valueHash": row["value_hash"],
+        "status": row["status"] or "anchored"
+    }
+    if proof["status"] != "pending":
+        proof["receipt"] = orjson.loads(row["ngsi_receipt"])
+
+    return proof
+
+# END: Attributes of entities
+####################################################
+
 def get_receipt(tx_hash):
     """Get the transaction receipt from the blockchain, and
     create a Claims object for a Verifiable Credential in JWT format.
@@ -253,14 +1811,127 @@ def get_receipt(tx_hash):
     signed later.
     """
 
-    # Get the raw transaction receipt from the blockchain
-    raw_receipt = redt.get_transaction_receipt(tx_hash)
+    # Get the transaction receipt from the local store, or from the blockchain the first time.
+    # Receipts are final in our IBFT network, so they never have to be fetched again
+    raw_receipt = stored_receipt(tx_hash)
+    if raw_receipt is None:
+        raw_receipt = w3.eth.get_transaction_receipt(tx_hash)
+        store_receipt(raw_receipt)
+        raw_receipt = unpack_receipt(pack_receipt(raw_receipt))
 
     # And convert to an unsigned Verifiable Credential
     receipt = receipt_as_vc2(raw_receipt)
 
     return receipt
 
+async def get_receipt_async(tx_hash):
+    """The same as get_receipt, asking the blockchain node with the async provider.
+    The local store of receipts is accessed in a thread, without blocking the event loop.
+    """
+
+    loop = asyncio.get_running_loop()
+
+    raw_receipt = await loop.run_in_executor(None, stored_receipt, tx_hash)
+    if raw_receipt is None:
+        raw_receipt = await b.get_transaction_receipt_async(tx_hash)
+        await loop.run_in_executor(None, store_receipt, raw_receipt)
+        raw_receipt = unpack_receipt(pack_receipt(raw_receipt))
+
+    return receipt_as_vc2(raw_receipt)
+
+####################################################
+# START: Local store of transaction receipts
+
+# Compact binary format of the receipts, with only the fields we use:
+#   blockHash, blockNumber, transactionHash, transactionIndex, status, from, has_to, to, number of logs
+# and for each log:
+#   address, logIndex, number of topics, length of data, the topics and the data
+RECEIPT_HEADER = struct.Struct(">32sQ32sIB20sB20sH")
+RECEIPT_LOG = struct.Struct(">20sIBH")
+
+def pack_receipt(tx_receipt) -> bytes:
+    """Serialize a receipt (raw from web3, or in JSON format) in the compact binary format"""
+
+    to = tx_receipt["to"]
+    parts = [RECEIPT_HEADER.pack(
+        HexBytes(tx_receipt["blockHash"]),
+        tx_receipt["blockNumber"],
+        HexBytes(tx_receipt["transactionHash"]),
+        tx_receipt["transactionIndex"],
+        tx_receipt.get("status", 1),
+        HexBytes(tx_receipt["from"]),
+        to is not None,
+        HexBytes(to) if to is not None else bytes(20),
+        len(tx_receipt["logs"])
+    )]
+
+    for log_entry in tx_receipt["logs"]:
+        topics = log_entry["topics"]
+        data = HexBytes(log_entry.get("data", b""))
+        parts.append(RECEIPT_LOG.pack(HexBytes(log_entry["address"]), log_entry["logIndex"], len(topics), len(data)))
+        parts.extend(HexBytes(topic) for topic in topics)
+        parts.append(bytes(data))
+
+    return b"".join(parts)
+
+def unpack_receipt(data: bytes) -> dict:
+    """Deserialize a receipt stored in the compact binary format, in the same JSON format
+    returned by redt.get_transaction_receipt
+    """
+
+    (block_hash, block_number, tx_hash, tx_index, status,
+        from_address, has_to, to_address, num_logs) = RECEIPT_HEADER.unpack_from(data, 0)
+    offset = RECEIPT_HEADER.size
+
+    logs = []
+    for i in range(num_logs):
+        address, log_index, num_topics, data_length = RECEIPT_LOG.unpack_from(data, offset)
+        offset += RECEIPT_LOG.size
+        topics = []
+        for j in range(num_topics):
+            topics.append(Web3.toHex(data[offset:offset+32]))
+            offset += 32
+        log_data = data[offset:offset+data_length]
+        offset += data_length
+        logs.append({
+            "address": Web3.toChecksumAddress(address),
+            "logIndex": log_index,
+            "topics": topics,
+            "data": Web3.toHex(log_data)
+        })
+
+    return {
+        "blockHash": Web3.toHex(block_hash),
+        "blockNumber": block_number,
+        "transactionHash": Web3.toHex(tx_hash),
+        "transactionIndex": tx_index,
+        "status": status,
+        "from": Web3.toChecksumAddress(from_address),
+        "to": Web3.toChecksumAddress(to_address) if has_to else None,
+        "logs": logs
+    }
+
+def store_receipt(tx_receipt):
+    """Keep the receipt of a transaction, to serve it later without asking the blockchain node"""
+
+    with transaction(get_db()) as db:
+        db.execute(
+            "INSERT OR IGNORE INTO tx_receipt (tx_hash, receipt) VALUES (?, ?)",
+            (bytes(tx_receipt["transactionHash"]), pack_receipt(tx_receipt))
+        )
+
+def stored_receipt(tx_hash) -> Optional[dict]:
+    """The receipt of the transaction from the local store, or None if it is not there"""
+
+    db = get_db()
+    row = db.execute("SELECT receipt FROM tx_receipt WHERE tx_hash = ?", (bytes(HexBytes(tx_hash)),)).fetchone()
+    if row is None:
+        return None
+    return unpack_receipt(row["receipt"])
+
+# END: Local store of transaction receipts
+####################################################
+
 class ReceiptModel(BaseModel):
     iss: str
     sub: str
@@ -381,20 +2052,14 @@ def receipt_as_vc2(tx_receipt: dict) -> dict:
     return credential
 
 
-def receipts_as_vc(tx_receipt: TxReceipt, tol_receipt: dict) -> dict:
-    """Convert a raw tx receipt to an unsigned Verifiable Credential"""
-
-    # Generate a random UUID, not related to anything in the credential
-    uid = unique_id.uuid4().hex
-
-    # Current time and expiration
-    now = int(time.time())
-    one_year = 365*24*60*60
-    exp = now + one_year  # The token will expire in 365 days
+def redt_credential(tx_receipt: TxReceipt, log_index: int = 0) -> dict:
+    """The part of the receipt with the transaction in Red T.
+    The log_index selects the event of the entity when the transaction anchored several entities.
+    """
 
     logs = []
     
-    for item in tx_receipt["logs"][0]["topics"]:
+    for item in tx_receipt["logs"][log_index]["topics"]:
         logs.append(Web3.toHex(item))
 
     cred_redt = {
@@ -406,28 +2071,55 @@ def receipts_as_vc(tx_receipt: TxReceipt, tol_receipt: dict) -> dict:
         "transactionIndex": tx_receipt["transactionIndex"],
         "from": tx_receipt["from"],
         "to": tx_receipt["to"],
+        "logIndex": tx_receipt["logs"][log_index]["logIndex"],
+        "logs": logs,
+    }
+
+    return cred_redt
+
+def tolar_credential(tol_receipt: dict, log_index: int = 0) -> dict:
+    """The part of the receipt with the transaction in Tolar HashNet"""
+
+    logs = []
+    for item in tol_receipt["logs"][log_index]["topics"]:
+        logs.append("0x"+item)
+
+    cred_tol = {
+        "issuedAt": "tolar.hashnet",
+        "levelOfAssurance": 2,
+        "blockHash": tol_receipt["blockHash"],
+        "blockNumber": int(tol_receipt["blockIndex"]),
+        "transactionHash": tol_receipt["transactionHash"],
+        "from": tol_receipt["senderAddress"],
+        "to": tol_receipt["receiverAddress"],
         "logs": logs,
     }
 
-    NGSIv2ReceiptCredential = [cred_redt]
+    return cred_tol
+
+def receipts_as_vc(tx_receipt: TxReceipt, tol_receipt: dict, log_index: int = 0) -> dict:
+    """Convert a raw tx receipt to an unsigned Verifiable Credential.
+    The log_index selects the event of the entity when the transaction anchored several entities.
+    """
 
+    NGSIv2ReceiptCredential = []
+    if tx_receipt:
+        NGSIv2ReceiptCredential.append(redt_credential(tx_receipt, log_index))
     if tol_receipt:
-        logs = []
-        for item in tol_receipt["logs"][0]["topics"]:
-            logs.append("0x"+item)
-
-        cred_tol = {
-            "issuedAt": "tolar.hashnet",
-            "levelOfAssurance": 2,
-            "blockHash": tol_receipt["blockHash"],
-            "blockNumber": int(tol_receipt["blockIndex"]),
-            "transactionHash": tol_receipt["transactionHash"],
-            "from": tol_receipt["senderAddress"],
-            "to": tol_receipt["receiverAddress"],
-            "logs": logs,
-        }
+        NGSIv2ReceiptCredential.append(tolar_credential(tol_receipt))
+
+    return credentials_as_vc(NGSIv2ReceiptCredential)
+
+def credentials_as_vc(NGSIv2ReceiptCredential: List[dict]) -> dict:
+    """Build the unsigned Verifiable Credential with the parts of the receipt of each ledger"""
 
-        NGSIv2ReceiptCredential.append(cred_tol)
+    # Generate a random UUID, not related to anything in the credential
+    uid = unique_id.uuid4().hex
+
+    # Current time and expiration
+    now = int(time.time())
+    one_year = 365*24*60*60
+    exp = now + one_year  # The token will expire in 365 days
 
     # Generate Verifiable Credential
     credential = {
@@ -1,6 +1,5 @@
 import os
 import time
-import sqlite3
 import json
 from sqlite3.dbapi2 import Connection
 from eth_utils.crypto import keccak
@@ -12,8 +11,9 @@ from typing import Optional, Tuple
 
 from web3.main import Web3
 
-from blockchain import trustframework as tf
+from blockchain import didcache
 from blockchain import wallet
+from utils.db import get_connection, transaction
 
 from jwcrypto import jwt, jwk, jws
 from jwcrypto.common import base64url_decode, base64url_encode, json_decode, json_encode
@@ -35,9 +35,7 @@ CREATE TABLE certificate (
 
 
 def get_db() -> Connection:
-    db = sqlite3.connect(DATABASE_NAME, detect_types=sqlite3.PARSE_DECLTYPES)
-    db.row_factory = sqlite3.Row
-    return db
+    return get_connection(DATABASE_NAME)
 
 
 def erase_db() -> Connection:
@@ -63,12 +61,12 @@ def new_certificate(diag_id: str, certificate: str) -> HexBytes:
     # Calculate the hash
     hash = Web3.keccak(text=certificate)
 
-    db.execute(
-        'REPLACE INTO certificate (diag_id, hash, cert) VALUES (?, ?, ?)',
-        (diag_id, hash.hex(), certificate)
-    )
-    # Commit database, just in case
-    db.commit()
+    # Commit database, or roll back if it fails
+    with transaction(db):
+        db.execute(
+            'REPLACE INTO certificate (diag_id, hash, cert) VALUES (?, ?, ?)',
+            (diag_id, hash.hex(), certificate)
+        )
 
     # Return certificate hash to caller
     return hash
@@ -103,7 +101,7 @@ def list_certificates():
 def new_signed_credential(iss=None, sub=None, certificate=None, password=None):
 
     # Try to resolve the Issuer and get its DID Document
-    DID, name, DIDDocument, active = tf.resolver.resolveDID(iss)
+    DID, name, DIDDocument, active = didcache.resolve(iss)
 
     # Check if the Issuer exists and return if not
     if DIDDocument is None:
@@ -317,7 +315,7 @@ def verify_cert_token(cert_token:str) -> dict:
     DID = key_components[0]
 
     # 4. Perform resolution of the DID of the issuer, and get the public key
-    _DID, name, didDoc, active = tf.resolver.resolveDID(DID)
+    _DID, name, didDoc, active = didcache.resolve(DID)
     if didDoc is None:
         print(f"No DIDDoc found for DID: {DID}")
         return None
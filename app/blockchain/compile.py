@@ -72,6 +72,23 @@ def m_compile():
     compile_solidity_file("PublicSelfDeclarations.sol")
     compile_solidity_file("ENSRegistry.sol")
     compile_solidity_file("PublicResolver.sol")
+    compile_solidity_file("Multicall.sol")
+
+def deploy_Multicall(deploy_key: HexBytes):
+
+    Multicall_full_path = os.path.join(settings.CONTRACTS_OUTPUT_DIR, "Multicall")
+    print(f"Deploying {Multicall_full_path}")
+    success, tx_receipt, multicall_address = redt.deploy_contract(
+        Multicall_full_path,
+        private_key=deploy_key
+    )
+    if success == False:
+        print("Error deploying the contract")
+        print(tx_receipt)
+        exit(1)
+
+    return multicall_address
+
 
 def m_compile_canis_major():
     """Compiles the Smart Contracts.
@@ -139,20 +156,51 @@ def m_deploy():
     PublicResolver_address = deploy_PublicResolver(ENS_address, ROOT_key)
     print(f"Publicresolver deployed at address: {PublicResolver_address}")
 
+    # Deploy the Multicall contract, used to read many records of the Trust Framework at once
+    print(f"\n==> Deploying Multicall")
+    Multicall_address = deploy_Multicall(ROOT_key)
+    print(f"Multicall deployed at address: {Multicall_address}")
+
     # Reconnect to the blockchain, this time binding the contracts just deployed
     tf.connect_blockchain(settings.BLOCKCHAIN_NODE_IP)
 
+    # The configuration transactions are sent back-to-back, and executed in order of their nonces
+    tx_hashes = []
+
     # Set the PublicResolver as the resolver of the ROOT node, so it can access all other nodes
     print(f"\n==> Set the PublicResolver as the resolver of the ROOT node")
-    tf.ens.setResolver("root", PublicResolver_address, ROOT_key)
-    print(f"Done")
+    _, _, tx_hash = tf.ens.setResolver("root", PublicResolver_address, ROOT_key, wait=False)
+    tx_hashes.append(tx_hash)
 
     # And assign approval to the PublicResolver contract so it can call ENS methods
-    tf.ens.setApprovalForAll(PublicResolver_address, True, ROOT_key)
+    _, _, tx_hash = tf.ens.setApprovalForAll(PublicResolver_address, True, ROOT_key, wait=False)
+    tx_hashes.append(tx_hash)
 
     # And assign the name "root" to that special root node, to reverse-resolve its name_hash
     print(f"\n==> Assign the name root to the root node, for reverse resolution")
-    success, tx_receipt, tx_hash = tf.resolver.setName(
-        "root", "root", ROOT_key)
+    _, _, tx_hash = tf.resolver.setName(
+        "root", "root", ROOT_key, wait=False)
+    tx_hashes.append(tx_hash)
+
+    # Now wait for all the receipts
+    for tx_hash in tx_hashes:
+        success, tx_receipt, tx_hash = redt.wait_for_tx(tx_hash, address=ROOT_address)
+        if success == False:
+            print(f"Error in transaction {tx_hash.hex()}")
+            exit(1)
     print(f"Done")
 
+
+def m_deploy_multicall():
+    """Deploys only the Multicall contract, to aggregate reads in an existing deployment.
+
+    --- Definitions ---
+    """
+    ROOT_address, ROOT_key = wallet.account_from_name("ROOT", "ThePassword")
+
+    print(f"\n==> Deploying Multicall with root account: {ROOT_address}")
+    Multicall_address = deploy_Multicall(ROOT_key)
+    print(f"Multicall deployed at address: {Multicall_address}")
+
+    # Bind it so it is used from now on
+    tf.connect_blockchain(settings.BLOCKCHAIN_NODE_IP)
@@ -0,0 +1,599 @@
+# Shared cache of DID Documents
+#
+# Resolving a DID asks the blockchain node twice (nodeFromDID and AlaDIDPublicEntity),
+# and DID Documents change very rarely, so resolutions are cached in two tiers:
+#   - An in-memory LRU cache per process, with DIDCACHE_MEMORY_SIZE entries
+#   - A SQLite database shared by all the worker processes of the server
+# Entries are invalidated when the blockchain says that the DID Document changed:
+# a background watcher follows the AlaDIDDocumentChanged events of the PublicResolver
+# and the NewOwner events of ENS (setAlaDIDPublicEntity creates again the subnode),
+# and removes the resolutions of the affected nodes from both tiers.
+# Entries also expire after DIDCACHE_TTL seconds, in case some change is missed.
+# DIDs not found are remembered in memory for DIDCACHE_NEGATIVE_TTL seconds, so floods of unknown
+# DIDs do not reach the node, and concurrent resolutions of the same DID are coalesced in one.
+# The memory tier also keeps the reply of the resolver API already serialized, with its ETag.
+
+import os
+import json
+import asyncio
+import time
+import threading
+import logging
+import hashlib
+from datetime import datetime
+from email.utils import format_datetime
+from concurrent.futures import Future
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+import orjson
+from cachetools import TTLCache
+from hexbytes import HexBytes
+from web3 import Web3
+
+from blockchain import redt as b
+from blockchain import trustframework as tf
+
+# The settings for the system
+from settings import settings
+from utils.db import get_connection, transaction
+
+log = logging.getLogger(__name__)
+
+# The SQLite database shared by the worker processes
+DATABASE_NAME = os.path.join(settings.DATABASE_DIR, "didcache.sqlite")
+
+create_table_script = """
+CREATE TABLE IF NOT EXISTS did_document (
+    did TEXT PRIMARY KEY,
+    node BLOB NOT NULL,
+    name TEXT,
+    diddoc TEXT NOT NULL,
+    active INTEGER NOT NULL,
+    expires REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS did_document_node ON did_document (node);
+
+CREATE TABLE IF NOT EXISTS didcache_checkpoint (
+    name TEXT PRIMARY KEY,
+    block_number INTEGER NOT NULL
+);
+"""
+
+# The events signaling that the DID Document of a node may have changed
+DIDDOCUMENT_CHANGED_TOPIC = Web3.toHex(Web3.keccak(text="AlaDIDDocumentChanged(bytes32,string)"))
+NEW_OWNER_TOPIC = Web3.toHex(Web3.keccak(text="NewOwner(bytes32,bytes32,address)"))
+
+
+class Resolution(NamedTuple):
+    """A cached resolution of a DID. The DID was not found if didDoc is None."""
+    node: bytes
+    DID: str
+    name: str
+    didDoc: dict
+    active: bool
+    # The reply of the resolver API, serialized once: the body, a strong ETag and the Last-Modified header
+    body: bytes = None
+    etag: str = None
+    last_modified: str = None
+
+
+def http_date(timestamp: str) -> Optional[str]:
+    """Convert a timestamp of a DID Document (eg. "2020-12-23T13:35:23Z") to the HTTP format"""
+
+    try:
+        return format_datetime(datetime.fromisoformat(timestamp.replace("Z", "+00:00")), usegmt=True)
+    except Exception:
+        return None
+
+def rendered(entry: tuple) -> Resolution:
+    """The resolution with the serialized reply of the resolver API"""
+
+    entry = Resolution(*entry[:5])
+    if entry.didDoc is None:
+        return entry
+
+    body = orjson.dumps({"payload": entry.didDoc})
+    etag = '"' + hashlib.sha256(body).hexdigest() + '"'
+
+    last_modified = None
+    if isinstance(entry.didDoc.get("updated"), str):
+        last_modified = http_date(entry.didDoc["updated"])
+
+    return entry._replace(body=body, etag=etag, last_modified=last_modified)
+
+
+# The in-memory tier: DID -> Resolution
+memory_cache = TTLCache(settings.DIDCACHE_MEMORY_SIZE, settings.DIDCACHE_TTL)
+# The DIDs not found, with a short expiration because they may be created at any moment
+negative_cache = TTLCache(settings.DIDCACHE_MEMORY_SIZE, settings.DIDCACHE_NEGATIVE_TTL)
+memory_lock = threading.Lock()
+
+# Number of invalidations done by this process. A resolution read from the blockchain (or from the
+# shared tier) before an invalidation may be stale, so it is cached only if the generation did not
+# change while it was being read. Changes of DID Documents are rare, so one counter for all the
+# nodes is enough: the DIDs not found are invalidated by a change in any node anyway.
+generation = 0
+
+# The resolutions being performed now, shared by all the callers asking for the same DID:
+# concurrent Futures for the threads, and asyncio Futures (or Tasks) for the coroutines
+inflight: Dict[str, Future] = {}
+inflight_lock = threading.Lock()
+inflight_async: Dict[str, asyncio.Future] = {}
+# The tasks resolving several DIDs, referenced until they finish, even if their callers are cancelled
+resolving_tasks = set()
+
+_db_initialized = False
+
+def get_db():
+    global _db_initialized
+
+    db = get_connection(DATABASE_NAME)
+    if not _db_initialized:
+        db.executescript(create_table_script)
+        _db_initialized = True
+    return db
+
+
+####################################################
+# START: Resolution
+
+def _get_memory(DID: str) -> Optional[Resolution]:
+    with memory_lock:
+        entry = memory_cache.get(DID)
+        if entry is None:
+            entry = negative_cache.get(DID)
+        return entry
+
+def _put_memory(DID: str, entry: tuple, started: int) -> Optional[Resolution]:
+    """Cache the resolution in memory, unless there was an invalidation after the read started.
+    Returns the resolution with the serialized reply, or None if it was not cached.
+    """
+    entry = rendered(entry)
+    with memory_lock:
+        if generation != started:
+            return None
+        memory_cache[DID] = entry
+    return entry
+
+def _get_shared(DID: str) -> Optional[Resolution]:
+    """The resolution stored by any process in the shared tier, if it did not expire"""
+
+    row = get_db().execute(
+        "SELECT node, did, name, diddoc, active FROM did_document WHERE did = ? AND expires > ?",
+        (DID, time.time())
+    ).fetchone()
+    if row is None:
+        return None
+
+    return Resolution(HexBytes(row["node"]), row["did"], row["name"], json.loads(row["diddoc"]), bool(row["active"]))
+
+def _put_shared(DID: str, entry: Resolution):
+
+    with transaction(get_db()) as db:
+        db.execute(
+            "INSERT OR REPLACE INTO did_document (did, node, name, diddoc, active, expires) VALUES (?, ?, ?, ?, ?, ?)",
+            (DID, bytes(entry.node), entry.name, json.dumps(entry.didDoc), int(entry.active), time.time() + settings.DIDCACHE_TTL)
+        )
+
+def _store(DID: str, entry: tuple, started: int) -> Resolution:
+    """Cache a resolution in both tiers. DIDs not found are cached only in memory, for a short time.
+    started is the generation when the resolution was read: if any node was invalidated since then,
+    the resolution is returned to the caller but not cached, because it may be stale.
+    """
+
+    entry, shared = _store_memory(DID, entry, started)
+    if shared:
+        _store_shared(DID, entry, started)
+    return entry
+
+async def _store_async(DID: str, entry: tuple, started: int) -> Resolution:
+    """The same as _store. The shared tier is written in a thread, because another process
+    may be holding the lock of the database.
+    """
+
+    entry, shared = _store_memory(DID, entry, started)
+    if shared:
+        await asyncio.get_running_loop().run_in_executor(None, _store_shared, DID, entry, started)
+    return entry
+
+def _store_memory(DID: str, entry: tuple, started: int) -> Tuple[Resolution, bool]:
+    """Cache a resolution in memory. Returns the resolution with the serialized reply,
+    and whether it must be stored also in the shared tier.
+    """
+
+    entry = Resolution(*entry)
+    if entry.didDoc is None:
+        with memory_lock:
+            if generation == started:
+                negative_cache[DID] = entry
+        return entry, False
+
+    cached = _put_memory(DID, entry, started)
+    if cached is None:
+        log.info(f"DID {DID} changed while it was being resolved, not cached")
+        return rendered(entry), False
+    return cached, True
+
+def _store_shared(DID: str, entry: Resolution, started: int):
+    """Store in the shared tier a resolution already cached in memory"""
+
+    try:
+        _put_shared(DID, entry)
+        # An invalidation may have deleted the node from the shared tier just before we wrote it
+        if generation != started:
+            _forget(DID)
+    except Exception as e:
+        # The memory tier is enough to answer, so a busy database is not an error for the caller
+        log.warning(f"Error storing DID {DID} in the shared cache: {e}")
+
+def _forget(DID: str):
+    """Remove the resolution of the DID from both tiers"""
+
+    with memory_lock:
+        memory_cache.pop(DID, None)
+    with transaction(get_db()) as db:
+        db.execute("DELETE FROM did_document WHERE did = ?", (DID,))
+
+def _cached(DID: str) -> Optional[Resolution]:
+    """The resolution from the memory tier or the shared one, or None"""
+
+    entry = _get_memory(DID)
+    if entry is not None:
+        return entry
+    return _cached_shared(DID)
+
+async def _cached_async(DID: str) -> Optional[Resolution]:
+    """The same as _cached, reading the shared tier in a thread"""
+
+    entry = _get_memory(DID)
+    if entry is not None:
+        return entry
+    return await asyncio.get_running_loop().run_in_executor(None, _cached_shared, DID)
+
+def _cached_shared(DID: str) -> Optional[Resolution]:
+    """The resolution from the shared tier, which is then cached in memory, or None"""
+
+    started = generation
+    try:
+        entry = _get_shared(DID)
+    except Exception as e:
+        log.warning(f"Error reading DID {DID} from the shared cache: {e}")
+        return None
+
+    if entry is not None:
+        # If it was invalidated meanwhile, it is resolved again in the blockchain
+        entry = _put_memory(DID, entry, started)
+    return entry
+
+def _resolve_once(DID: str) -> Resolution:
+    """Resolve the DID in the blockchain, or wait for the thread already doing it"""
+
+    with inflight_lock:
+        future = inflight.get(DID)
+        leader = future is None
+        if leader:
+            future = Future()
+            inflight[DID] = future
+
+    if not leader:
+        return future.result()
+
+    try:
+        # Another thread may have finished resolving it after we looked in the cache
+        entry = _cached(DID)
+        if entry is None:
+            started = generation
+            entry = _store(DID, tf.resolver.resolveDIDNode(DID), started)
+        future.set_result(entry)
+        return entry
+    except Exception as e:
+        # The waiting threads get the same error, which is not cached
+        future.set_exception(e)
+        raise
+    finally:
+        with inflight_lock:
+            del inflight[DID]
+
+async def _resolve_and_store_async(DID: str) -> Resolution:
+    started = generation
+    return await _store_async(DID, await tf.resolver.resolveDIDNode_async(DID), started)
+
+def _inflight_async(DID: str, loop) -> Optional[asyncio.Future]:
+    """The resolution of the DID being performed now in the event loop, if any"""
+
+    future = inflight_async.get(DID)
+    if future is None or future.get_loop() is not loop:
+        return None
+    return future
+
+def _add_inflight_async(DID: str, future: asyncio.Future):
+
+    inflight_async[DID] = future
+
+    def done(future):
+        if inflight_async.get(DID) is future:
+            del inflight_async[DID]
+    future.add_done_callback(done)
+
+async def _resolve_once_async(DID: str) -> Resolution:
+    """Async version of _resolve_once. The resolution runs in its own task, so a caller
+    being cancelled (eg. the client disconnected) does not cancel it for the others.
+    """
+
+    loop = asyncio.get_running_loop()
+    task = _inflight_async(DID, loop)
+    if task is None:
+        task = loop.create_task(_resolve_and_store_async(DID))
+        _add_inflight_async(DID, task)
+
+    return await asyncio.shield(task)
+
+async def _resolve_many_and_store_async(DIDs: list, futures: Dict[str, asyncio.Future]):
+    """Resolve the DIDs and set the result of their futures. Whatever happens (an error,
+    fewer entries than DIDs or the task being cancelled), every future ends with a result
+    or an exception, so nobody waits forever for a DID.
+    """
+
+    started = generation
+    error = None
+    try:
+        entries = await tf.resolver.resolveDIDNodes_async(DIDs)
+
+        # Cache them in memory here, and in the shared tier all together in a thread
+        stored = {}
+        for DID, entry in zip(DIDs, entries):
+            try:
+                stored[DID] = _store_memory(DID, entry, started)
+            except Exception as e:
+                futures[DID].set_exception(e)
+
+        def store_shared():
+            for DID, (entry, shared) in stored.items():
+                if shared:
+                    _store_shared(DID, entry, started)
+        await asyncio.get_running_loop().run_in_executor(None, store_shared)
+
+        for DID, (entry, shared) in stored.items():
+            futures[DID].set_result(entry)
+    except asyncio.CancelledError:
+        # The waiters were not cancelled, so they get an error instead
+        error = RuntimeError("Resolution of the DIDs cancelled")
+        raise
+    except Exception as e:
+        error = e
+    finally:
+        for DID, future in futures.items():
+            if not future.done():
+                future.set_exception(error or RuntimeError(f"DID {DID} not returned by the resolver"))
+
+async def resolve_many_async(DIDs: List[str]) -> Dict[str, Union[Tuple[str, str, Dict, bool], Exception]]:
+    """Resolve several DIDs. The ones in the cache are answered from it, and all the others
+    are resolved together, with one batch of requests to the node per step of the resolution.
+    Returns a dict with the same result as resolve for each DID, or the exception raised.
+    """
+
+    loop = asyncio.get_running_loop()
+
+    # The memory tier is read here, and the shared tier in a thread with a single call
+    entries = {}
+    not_in_memory = []
+    for DID in dict.fromkeys(DIDs):
+        entry = _get_memory(DID)
+        if entry is not None:
+            entries[DID] = entry
+        else:
+            not_in_memory.append(DID)
+
+    if len(not_in_memory) > 0:
+        shared = await loop.run_in_executor(None, lambda: [_cached_shared(DID) for DID in not_in_memory])
+    else:
+        shared = []
+
+    waiting = {}
+    misses = []
+    for DID, entry in zip(not_in_memory, shared):
+        if entry is not None:
+            entries[DID] = entry
+            continue
+
+        # Join the resolution of the DID if somebody else is already performing it
+        future = _inflight_async(DID, loop)
+        if future is not None:
+            waiting[DID] = future
+        else:
+            misses.append(DID)
+
+    if len(misses) > 0:
+        futures = {DID: loop.create_future() for DID in misses}
+        for DID, future in futures.items():
+            _add_inflight_async(DID, future)
+        waiting.update(futures)
+        task = loop.create_task(_resolve_many_and_store_async(misses, futures))
+        resolving_tasks.add(task)
+        task.add_done_callback(resolving_tasks.discard)
+
+    for DID, future in waiting.items():
+        try:
+            entries[DID] = await asyncio.shield(future)
+        except Exception as e:
+            entries[DID] = e
+
+    # In the order of the request
+    results = {}
+    for DID in dict.fromkeys(DIDs):
+        entry = entries[DID]
+        if isinstance(entry, Exception):
+            results[DID] = entry
+        else:
+            results[DID] = (entry.DID, entry.name, entry.didDoc, entry.active)
+    return results
+
+def resolve(DID: str) -> Tuple[str, str, Dict, bool]:
+    """Resolve a DID like tf.resolver.resolveDID, using the cache"""
+
+    entry = _cached(DID)
+    if entry is None:
+        entry = _resolve_once(DID)
+
+    return entry.DID, entry.name, entry.didDoc, entry.active
+
+async def resolution_async(DID: str) -> Resolution:
+    """The cached resolution of the DID, including the serialized reply of the resolver API.
+    Only the memory tier is read in the event loop, and the shared tier in a thread.
+    """
+
+    entry = await _cached_async(DID)
+    if entry is None:
+        entry = await _resolve_once_async(DID)
+    return entry
+
+async def resolve_async(DID: str) -> Tuple[str, str, Dict, bool]:
+    """Async version of resolve"""
+
+    entry = await resolution_async(DID)
+    return entry.DID, entry.name, entry.didDoc, entry.active
+
+def invalidate_node(node: bytes):
+    """Remove from both tiers the resolutions of DIDs pointing to the node.
+    The node of a DID not found is unknown, so any of them may have been created now.
+    """
+
+    global generation
+
+    node = bytes(node)
+
+    with memory_lock:
+        generation += 1
+        for DID in [DID for DID, entry in memory_cache.items() if bytes(entry.node) == node]:
+            del memory_cache[DID]
+        negative_cache.clear()
+
+    with transaction(get_db()) as db:
+        db.execute("DELETE FROM did_document WHERE node = ?", (node,))
+
+def clear():
+    """Remove all the resolutions from both tiers"""
+    global generation
+
+    with memory_lock:
+        generation += 1
+        memory_cache.clear()
+        negative_cache.clear()
+
+    with transaction(get_db()) as db:
+        db.execute("DELETE FROM did_document")
+
+# END: Resolution
+####################################################
+
+
+####################################################
+# START: Invalidation
+
+def changed_nodes(events: list) -> set:
+    """The nodes whose DID Document may have changed, according to the events"""
+
+    nodes = set()
+    for event in events:
+        topics = event["topics"]
+        if HexBytes(topics[0]) == HexBytes(DIDDOCUMENT_CHANGED_TOPIC):
+            nodes.add(bytes(HexBytes(topics[1])))
+        elif HexBytes(topics[0]) == HexBytes(NEW_OWNER_TOPIC):
+            # The subnode created or reassigned is the hash of the parent node and the label
+            nodes.add(bytes(Web3.keccak(HexBytes(topics[1]) + HexBytes(topics[2]))))
+    return nodes
+
+
+class DIDEventWatcher:
+    """Background watcher of the events which change DID Documents.
+    Each process follows the events from its own last block and cleans its memory tier.
+    The shared tier is cleaned by all of them (the deletes are idempotent), and the last
+    block processed is saved so a restarted server only has to look at the new blocks.
+    If there is no saved block, the shared tier can not be trusted and is emptied.
+    """
+
+    def __init__(self, poll_interval: float = 5.0, chunk_size: int = 2000) -> None:
+        self.poll_interval = poll_interval
+        self.chunk_size = chunk_size
+        self.last_block = None
+        self.worker = None
+
+    def start(self):
+        self.worker = threading.Thread(target=self._run, name="DIDEventWatcher", daemon=True)
+        self.worker.start()
+
+    def checkpoint(self) -> Optional[int]:
+        row = get_db().execute("SELECT block_number FROM didcache_checkpoint WHERE name = 'DIDDocument'").fetchone()
+        if row is None:
+            return None
+        return row["block_number"]
+
+    def save_checkpoint(self, block_number: int):
+        with transaction(get_db()) as db:
+            db.execute(
+                "INSERT INTO didcache_checkpoint (name, block_number) VALUES ('DIDDocument', ?) "
+                "ON CONFLICT(name) DO UPDATE SET block_number = MAX(block_number, excluded.block_number)",
+                (block_number,)
+            )
+
+    def _fetch_range(self, from_block: int, to_block: int) -> list:
+        return b.w3.eth.get_logs({
+            "address": [tf.PublicResolver.address, tf.ENS.address],
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "topics": [[DIDDOCUMENT_CHANGED_TOPIC, NEW_OWNER_TOPIC]]
+        })
+
+    def watch_once(self) -> int:
+        """Invalidate the nodes changed since the last block processed.
+        Returns the number of nodes invalidated.
+        """
+
+        latest_block = b.w3.eth.block_number
+
+        if self.last_block is None:
+            self.last_block = self.checkpoint()
+            if self.last_block is None:
+                # We do not know what happened before, so start with an empty cache
+                clear()
+                self.last_block = latest_block
+                self.save_checkpoint(latest_block)
+                return 0
+
+        num_nodes = 0
+        from_block = self.last_block + 1
+        while from_block <= latest_block:
+            to_block = min(from_block + self.chunk_size - 1, latest_block)
+            for node in changed_nodes(self._fetch_range(from_block, to_block)):
+                invalidate_node(node)
+                num_nodes += 1
+            self.last_block = to_block
+            self.save_checkpoint(to_block)
+            from_block = to_block + 1
+
+        return num_nodes
+
+    def _run(self):
+        retry_delay = self.poll_interval
+
+        while True:
+            try:
+                self.watch_once()
+                retry_delay = self.poll_interval
+            except Exception as e:
+                log.error(f"Error watching DID Document events: {e}")
+                retry_delay = min(retry_delay * 2, 60)
+            time.sleep(retry_delay)
+
+
+event_watcher: DIDEventWatcher = None
+
+def start_event_watcher():
+    """Start invalidating the cache with the events of the blockchain, in the background"""
+    global event_watcher
+    event_watcher = DIDEventWatcher(poll_interval=settings.DIDCACHE_POLL_INTERVAL)
+    event_watcher.start()
+
+# END: Invalidation
+####################################################
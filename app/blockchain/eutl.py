@@ -10,12 +10,13 @@ import xml.etree.ElementTree as ET
 import urllib
 import os
 import logging
-import sqlite3
 from pprint import pprint
 import xml.etree.ElementTree as ET
 
 from blockchain import trustframework as tf
-from blockchain import wallet
+from blockchain import wallet, redt
+
+from ens.utils import raw_name_to_hash
 
 try:
     from devtools import debug
@@ -25,6 +26,7 @@ except ImportError:
 
 # The settings for the system
 from settings import settings
+from utils.db import get_connection
 
 # Initialize logging
 log = logging.getLogger(__name__)
@@ -131,27 +133,39 @@ def m_lotl_dump():
     numberSubnodes = tf.ens.numberSubnodes("es.trust")
     print(f"Number of subnodes: {numberSubnodes}")
 
-    # Iterate for each TSP
-    for i in range(tf.ens.numberSubnodes("es.trust")):
-
-        # Get the subnode (in name_hash format)
-        tsp_node_hash = tf.ens.subnode("es.trust", i)
-        print(f"    Name: {tf.resolver.nameFromHash(tsp_node_hash)}")
+    # The data of all the TSPs and their services is read with a few requests to the node
+    PublicResolver = tf.PublicResolver
+    node_hash = raw_name_to_hash("es.trust")
+
+    # Get the subnodes (in name_hash format)
+    tsp_node_hashes = redt.batch_call(
+        [tf.ENS.functions.subnode(node_hash, i) for i in range(numberSubnodes)])
+
+    # Get the name, the data and the number of services of each TSP
+    tsp_records = redt.batch_call(
+        [f for tsp_node_hash in tsp_node_hashes for f in (
+            PublicResolver.functions.name(tsp_node_hash),
+            PublicResolver.functions.AlaTSP(tsp_node_hash),
+            PublicResolver.functions.AlaTSPNumberServices(tsp_node_hash))])
+
+    # Get all the services of all the TSPs
+    service_calls = []
+    for i, tsp_node_hash in enumerate(tsp_node_hashes):
+        numServices = tsp_records[3*i + 2]
+        for j in range(numServices):
+            service_calls.append(PublicResolver.functions.AlaTSPService(tsp_node_hash, j))
+    services = iter(redt.batch_call(service_calls))
 
-        # Get the data for the TSP
-        URI, org, active = tf.resolver.AlaTSP(node_hash=tsp_node_hash)
+    # Iterate for each TSP
+    for i in range(numberSubnodes):
+        name, (URI, org, active), numServices = tsp_records[3*i:3*i + 3]
+        print(f"    Name: {name}")
         print(f"    URI: {URI}, Org: {org}, Active: {active}")
-
-        # Get the number of services
-        numServices = tf.resolver.AlaTSPNumberServices(node_hash=tsp_node_hash)
         print(f"    Num Services: {numServices}")
 
         # Iterate all services
-        for i in range(numServices):
-            X509SKI, serviceName, X509Certificate, active = tf.resolver.AlaTSPService(
-                node_hash=tsp_node_hash,
-                index=i
-            )
+        for j in range(numServices):
+            X509SKI, serviceName, X509Certificate, active = next(services)
             print(f"        X509SKI: {X509SKI}, {serviceName}")
 
 
@@ -199,9 +213,7 @@ def m_import_estl_db():
 
 def get_db():
     db_name = os.path.join(settings.DATABASE_DIR, "pubcred_config.sqlite")
-    db = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-    db.row_factory = sqlite3.Row
-    return db
+    return get_connection(db_name)
 
 
 # Reset the root EU Trusted List table
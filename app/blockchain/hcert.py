@@ -19,12 +19,14 @@ from devtools import debug
 from web3.main import Web3
 
 from blockchain import trustframework as tf
+from blockchain import didcache
 from blockchain import wallet
 
 from jwcrypto import jwt, jwk, jws
 from jwcrypto.common import base64url_decode, base64url_encode, json_decode, json_encode
 
 from settings import settings
+from utils.db import get_connection, transaction
 
 if settings.PRODUCTION:
     DATABASE_FILE = "hcert.sqlite"
@@ -56,10 +58,7 @@ CREATE TABLE hcert (
 
 
 def get_db() -> Connection:
-    print(DATABASE_NAME)
-    db = sqlite3.connect(DATABASE_NAME, detect_types=sqlite3.PARSE_DECLTYPES)
-    db.row_factory = sqlite3.Row
-    return db
+    return get_connection(DATABASE_NAME)
 
 
 def erase_db() -> Connection:
@@ -82,12 +81,12 @@ def new_record(uuid: str, ctype: str, sformat: str, cert: str) -> str:
 
     db = get_db()
 
-    db.execute(
-        'REPLACE INTO pubcred (uuid, ctype, sformat, cert) VALUES (?, ?, ?, ?)',
-        (uuid, ctype, sformat, cert)
-    )
-    # Commit database
-    db.commit()
+    # Commit database, or roll back if it fails
+    with transaction(db):
+        db.execute(
+            'REPLACE INTO pubcred (uuid, ctype, sformat, cert) VALUES (?, ?, ?, ?)',
+            (uuid, ctype, sformat, cert)
+        )
 
     # Return certificate id to caller
     return uuid
@@ -220,7 +219,7 @@ def new_signed_credential(claims=None, jwk_key=None):
     issuer_did = claims["iss"]
 
     # Try to resolve the Issuer and get its DID Document
-    DID, name, DIDDocument, active = tf.resolver.resolveDID(issuer_did)
+    DID, name, DIDDocument, active = didcache.resolve(issuer_did)
 
     # Check if the Issuer exists and return if not
     if DIDDocument is None:
@@ -347,7 +346,7 @@ def new_signed_credential_w3c(claims=None, jwk_key=None):
     issuer_did = claims["iss"]
 
     # Try to resolve the Issuer and get its DID Document
-    DID, name, DIDDocument, active = tf.resolver.resolveDID(issuer_did)
+    DID, name, DIDDocument, active = didcache.resolve(issuer_did)
 
     # Check if the Issuer exists and return if not
     if DIDDocument is None:
@@ -745,7 +744,7 @@ def verify_cert_token(cert_token:str) -> dict:
     DID = key_components[0]
 
     # 4. Perform resolution of the DID of the issuer, and get the public key
-    _DID, name, didDoc, active = tf.resolver.resolveDID(DID)
+    _DID, name, didDoc, active = didcache.resolve(DID)
     if didDoc is None:
         print(f"No DIDDoc found for DID: {DID}")
         return None
@@ -809,7 +808,7 @@ def verify_cert_token_debug(cert_token:str) -> dict:
     DID = key_components[0]
 
     # 4. Perform resolution of the DID of the issuer, and get the public key
-    _DID, name, didDoc, active = tf.resolver.resolveDID(DID)
+    _DID, name, didDoc, active = didcache.resolve(DID)
     if didDoc is None:
         print(f"No DIDDoc found for DID: {DID}")
         return None
@@ -0,0 +1,291 @@
+# Materialized registry of Trusted Issuers
+#
+# The list of trusted issuers (the identities under the "ala" node) is read from the blockchain
+# when the server starts, and kept in memory and in a SQLite database, so the API answers
+# without asking the node, whatever the number of issuers.
+# The registry is refreshed incrementally with the events of the blockchain:
+#   - NewOwner of ENS under the parent node: a new issuer (subnodes are only appended),
+#     or an existing one registered again with setAlaDIDPublicEntity
+#   - AlaDIDDocumentChanged of the PublicResolver: the DID Document of an issuer changed,
+#     which may change the DID reported after the integrity check
+# Only the affected issuers are read again. In case some change is missed, the whole
+# registry is compared with the blockchain every ISSUERS_DIFF_INTERVAL seconds.
+# The reply of the API with all the issuers is serialized once per version of the registry.
+
+import os
+import time
+import hashlib
+import threading
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from hexbytes import HexBytes
+from web3 import Web3
+from ens.utils import raw_name_to_hash
+
+from blockchain import redt as b
+from blockchain import trustframework as tf
+from blockchain.didcache import DIDDOCUMENT_CHANGED_TOPIC, NEW_OWNER_TOPIC
+
+# The settings for the system
+from settings import settings
+from utils.db import get_connection, transaction
+
+log = logging.getLogger(__name__)
+
+# The SQLite database with the last version of the registry, to start quickly
+DATABASE_NAME = os.path.join(settings.DATABASE_DIR, "issuer_registry.sqlite")
+
+create_table_script = """
+CREATE TABLE IF NOT EXISTS trusted_issuer (
+    position INTEGER PRIMARY KEY,
+    node_hash TEXT NOT NULL,
+    did TEXT,
+    name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS registry_checkpoint (
+    name TEXT PRIMARY KEY,
+    block_number INTEGER NOT NULL
+);
+"""
+
+_db_initialized = False
+
+def get_db():
+    global _db_initialized
+
+    db = get_connection(DATABASE_NAME)
+    if not _db_initialized:
+        db.executescript(create_table_script)
+        _db_initialized = True
+    return db
+
+
+def page_reply(issuers: list, offset: int = 0, limit: Optional[int] = None) -> dict:
+    """The reply of the API with a page of the issuers. Without limit, all from the offset."""
+
+    if limit is None:
+        items = issuers[offset:]
+    else:
+        items = issuers[offset:offset + limit]
+
+    return {
+        "payload": items,
+        "total": len(issuers),
+        "offset": offset,
+        "limit": limit
+    }
+
+
+class IssuerRegistry:
+    """The trusted issuers under a node, in the order of the subnodes in ENS.
+    Each issuer is a dict with DID, name and node_hash, as returned by tf.dump_trusted_identities.
+    The data is replaced as a whole on every change, so readers always see a consistent version.
+    """
+
+    def __init__(self, node_name: str = "ala", poll_interval: float = 5.0, diff_interval: float = 600.0,
+            chunk_size: int = 2000) -> None:
+        self.node_name = node_name
+        self.node_hash = HexBytes(raw_name_to_hash(node_name))
+        self.poll_interval = poll_interval
+        self.diff_interval = diff_interval
+        self.chunk_size = chunk_size
+
+        # The current version: the issuers, the position of each node_hash, the serialized reply
+        # with all of them and its ETag (None until the registry is built)
+        self.version = None
+        self.last_block = None
+        self.last_diff = 0
+        self.worker = None
+
+    def ready(self) -> bool:
+        return self.version is not None
+
+    def start(self):
+        self.worker = threading.Thread(target=self._run, name="IssuerRegistry", daemon=True)
+        self.worker.start()
+
+    def _publish(self, issuers: list):
+        body = orjson.dumps(page_reply(issuers))
+        digest = hashlib.sha256(body).hexdigest()
+        positions = {HexBytes(issuer["node_hash"]).hex(): i for i, issuer in enumerate(issuers)}
+        self.version = (issuers, positions, body, digest)
+
+    def page(self, offset: int = 0, limit: Optional[int] = None) -> Tuple[bytes, str]:
+        """The serialized reply of the API for a page of issuers, and its strong ETag"""
+
+        issuers, positions, body, digest = self.version
+
+        if offset == 0 and limit is None:
+            return body, f'"{digest}"'
+
+        return orjson.dumps(page_reply(issuers, offset, limit)), f'"{digest}-{offset}-{limit}"'
+
+    ####################################################
+    # Storage
+
+    def load(self) -> bool:
+        """Load the registry saved by the last run (or by another process)"""
+
+        db = get_db()
+        row = db.execute("SELECT block_number FROM registry_checkpoint WHERE name = ?", (self.node_name,)).fetchone()
+        if row is None:
+            return False
+
+        rows = db.execute("SELECT node_hash, did, name FROM trusted_issuer ORDER BY position").fetchall()
+        issuers = [{"DID": r["did"], "name": r["name"], "node_hash": r["node_hash"]} for r in rows]
+
+        self._publish(issuers)
+        self.last_block = row["block_number"]
+        self.last_diff = time.time()
+        return True
+
+    def save(self, block_number: int, issuers: list, positions: List[int] = None):
+        """Save the issuers at the positions (all of them if None) and the block they come from"""
+
+        with transaction(get_db()) as db:
+            if positions is None:
+                db.execute("DELETE FROM trusted_issuer")
+                positions = range(len(issuers))
+
+            db.executemany(
+                "INSERT OR REPLACE INTO trusted_issuer (position, node_hash, did, name) VALUES (?, ?, ?, ?)",
+                [(i, issuers[i]["node_hash"], issuers[i]["DID"], issuers[i]["name"]) for i in positions]
+            )
+            db.execute(
+                "INSERT INTO registry_checkpoint (name, block_number) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET block_number = MAX(block_number, excluded.block_number)",
+                (self.node_name, block_number)
+            )
+
+    ####################################################
+    # Refresh
+
+    def build(self):
+        """Read the whole registry from the blockchain. If it changed, publish and save it."""
+
+        # The events from this block on will be processed again, which does no harm
+        latest_block = b.w3.eth.block_number
+        issuers = tf.dump_trusted_identities(self.node_name)
+
+        if self.version is None or issuers != self.version[0]:
+            self._publish(issuers)
+            self.save(latest_block, issuers)
+            log.info(f"Registry of trusted issuers built with {len(issuers)} issuers")
+        else:
+            self.save(latest_block, issuers, [])
+
+        self.last_block = latest_block
+        self.last_diff = time.time()
+
+    def _fetch_events(self, from_block: int, to_block: int) -> list:
+        return b.w3.eth.get_logs({
+            "address": [tf.ENS.address, tf.PublicResolver.address],
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "topics": [[NEW_OWNER_TOPIC, DIDDOCUMENT_CHANGED_TOPIC]]
+        })
+
+    def changes(self, events: list, positions: Dict[str, int]) -> Tuple[set, bool]:
+        """The positions of the issuers changed by the events, and whether there are new issuers"""
+
+        changed = set()
+        new_issuers = False
+        for event in events:
+            topics = event["topics"]
+
+            if HexBytes(topics[0]) == HexBytes(NEW_OWNER_TOPIC):
+                # Only the subnodes of our node
+                if HexBytes(topics[1]) != self.node_hash:
+                    continue
+                subnode = Web3.keccak(HexBytes(topics[1]) + HexBytes(topics[2])).hex()
+            else:
+                subnode = HexBytes(topics[1]).hex()
+
+            if subnode in positions:
+                changed.add(positions[subnode])
+            elif HexBytes(topics[0]) == HexBytes(NEW_OWNER_TOPIC):
+                new_issuers = True
+
+        return changed, new_issuers
+
+    def refresh_once(self) -> int:
+        """Apply the changes since the last block processed. Returns the number of issuers read again."""
+
+        latest_block = b.w3.eth.block_number
+        if latest_block <= self.last_block:
+            return 0
+
+        issuers, positions, body, digest = self.version
+
+        events = []
+        from_block = self.last_block + 1
+        while from_block <= latest_block:
+            to_block = min(from_block + self.chunk_size - 1, latest_block)
+            events.extend(self._fetch_events(from_block, to_block))
+            from_block = to_block + 1
+
+        changed, new_issuers = self.changes(events, positions)
+
+        # The issuers changed, and the subnodes added after the last ones we know
+        changed_positions = sorted(changed)
+        subnode_hashes = [bytes(HexBytes(issuers[i]["node_hash"])) for i in changed_positions]
+        if new_issuers:
+            number_subnodes = tf.ens.numberSubnodes(self.node_name)
+            new_hashes = b.batch_call([
+                tf.ENS.functions.subnode(self.node_hash, i) for i in range(len(issuers), number_subnodes)
+            ])
+            subnode_hashes.extend(new_hashes)
+            changed_positions.extend(range(len(issuers), number_subnodes))
+
+        if len(subnode_hashes) > 0:
+            entities = b.batch_call([
+                tf.PublicResolver.functions.AlaDIDPublicEntity(subnode_hash) for subnode_hash in subnode_hashes
+            ])
+
+            issuers = list(issuers)
+            for position, issuer in zip(changed_positions, tf.trusted_identities(subnode_hashes, entities)):
+                if position < len(issuers):
+                    issuers[position] = issuer
+                else:
+                    issuers.append(issuer)
+
+            self._publish(issuers)
+            log.info(f"Registry of trusted issuers refreshed: {len(changed_positions)} issuers read again")
+
+        self.save(latest_block, issuers, changed_positions)
+        self.last_block = latest_block
+        return len(changed_positions)
+
+    def _run(self):
+        retry_delay = self.poll_interval
+
+        while True:
+            try:
+                if self.version is None:
+                    # Start with the version saved, and catch up with the events
+                    if not self.load():
+                        self.build()
+                elif time.time() - self.last_diff >= self.diff_interval:
+                    self.build()
+                else:
+                    self.refresh_once()
+                retry_delay = self.poll_interval
+            except Exception as e:
+                log.error(f"Error refreshing the registry of trusted issuers: {e}")
+                retry_delay = min(retry_delay * 2, 60)
+            time.sleep(retry_delay)
+
+
+registry: IssuerRegistry = None
+
+def start_registry():
+    """Build the registry of trusted issuers and keep it updated, in the background"""
+    global registry
+    registry = IssuerRegistry(
+        poll_interval=settings.ISSUERS_POLL_INTERVAL,
+        diff_interval=settings.ISSUERS_DIFF_INTERVAL
+    )
+    registry.start()
@@ -3,24 +3,41 @@ import time
 import pprint
 import os
 import json
+import logging
+import threading
+import asyncio
+import weakref
+import aiohttp
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from collections import OrderedDict
 from hexbytes.main import HexBytes
 import web3
 from pathlib import Path
 
-from web3 import Web3
+from web3 import Web3, AsyncHTTPProvider
+from web3.eth import AsyncEth
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
 from eth_account import Account
 from eth_account.signers.local import LocalAccount
 from web3.eth import Eth
 from typing import Optional, Tuple
 
 from web3.types import TxReceipt
+from web3.exceptions import TimeExhausted, TransactionNotFound, ContractLogicError
+from web3._utils.request import make_post_request
 
 from devtools import debug as debug_print
 
 
+log = logging.getLogger(__name__)
+
 # Define the global variable w3, to be used later
 w3 = None
 
+# The same for the async version aw3, used by the async API
+aw3 = None
+
 ##########################################################################
 # Auxiliary procedures
 ##########################################################################
@@ -245,57 +262,382 @@ def bind_contract_with_address(contractName, address):
 
     return wrapper
 
-# Create a signed transaction with the private key, send it and wait timeout for the txreceipt
-def send_signed_tx(contract_function, private_key: HexBytes = None, timeout: int=20):
-
-    if debug:
-        print(f"Entering send_signed_tx with PrivateKey: {private_key}")
+####################################################
+# START: Nonce management
+
+# Errors from the node which mean that our local nonce is not in sync with the blockchain
+NONCE_ERRORS = (
+    "nonce too low",
+    "already known",
+    "known transaction",
+    "replacement transaction underpriced",
+)
+
+def is_nonce_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(text in message for text in NONCE_ERRORS)
+
+class NonceManager:
+    """Allocates the nonces of the transactions of each account locally.
+    The nonce of an account is read from the blockchain only the first time it is used
+    and when we detect that we are out of sync, so many transactions from the same
+    account can be sent back-to-back without waiting for the previous receipts.
+    """
+
+    def __init__(self) -> None:
+        self.nonces = {}
+        self.lock = threading.Lock()
+
+    def next_nonce(self, address: str) -> int:
+        """Allocate the nonce for the next transaction of the account"""
+
+        with self.lock:
+            if address not in self.nonces:
+                # Include the transactions of the account still in the pool of the node
+                self.nonces[address] = w3.eth.getTransactionCount(address, "pending")
+            nonce = self.nonces[address]
+            self.nonces[address] = nonce + 1
+        return nonce
+
+    async def next_nonce_async(self, address: str) -> int:
+        """The same as next_nonce, reading the nonce with the async provider if needed"""
+
+        with self.lock:
+            nonce = self.nonces.get(address)
+        if nonce is None:
+            nonce = await aw3.eth.get_transaction_count(address, "pending")
+
+        with self.lock:
+            # Another coroutine or thread may have read it while we were waiting
+            nonce = self.nonces.setdefault(address, nonce)
+            self.nonces[address] = nonce + 1
+        return nonce
+
+    def resync(self, address: str):
+        """Forget the local nonce of the account, so it is read again from the blockchain.
+        Called when the node rejects a nonce (too low) or when a nonce was allocated but not
+        used, which would leave a gap blocking all later transactions of the account.
+        """
+
+        with self.lock:
+            self.nonces.pop(address, None)
+
+# The nonces of all the accounts sending transactions from this process
+nonce_manager = NonceManager()
+
+# END: Nonce management
+####################################################
+
+####################################################
+# START: Receipt tracking
+
+# Seconds between checks of the block number while there are transactions waiting for receipts
+RECEIPT_POLL_INTERVAL = 0.5
+
+# Number of receipts kept after they arrive, for the callers that wait for them later
+RECEIPT_RESOLVED_SIZE = 10000
+
+class ReceiptTracker:
+    """Waits for the receipts of all the transactions sent from this process.
+    A single background thread follows the new blocks (polling eth_blockNumber, and only while
+    there are transactions waiting) and gets each new block once. The receipt is requested only
+    for the transactions that we are waiting for and that appear in the block, so the load on
+    the node does not grow with the number of concurrent transactions.
+    """
+
+    def __init__(self, poll_interval: float = RECEIPT_POLL_INTERVAL) -> None:
+        self.poll_interval = poll_interval
+        self.pending = {}
+        self.resolved = OrderedDict()
+        self.last_block = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.worker = None
+
+    def idle(self) -> bool:
+        with self.lock:
+            return len(self.pending) == 0
+
+    def track(self, tx_hash, current_block: Optional[int] = None) -> Future:
+        """Start waiting for the receipt of a transaction.
+        To avoid missing the block with the transaction, call it before sending the transaction.
+        The current block is read from the node if the tracker is idle and it is not given.
+        Returns a future which is resolved with the receipt.
+        """
+
+        tx_hash = HexBytes(tx_hash)
+
+        # When nobody was waiting, the blocks mined in the meantime are not followed:
+        # start from the current block, which is before the one with the transaction
+        if current_block is None and self.idle():
+            current_block = w3.eth.block_number
+
+        with self.lock:
+            if len(self.pending) == 0 and current_block is not None:
+                if self.last_block is None or self.last_block < current_block:
+                    self.last_block = current_block
+
+            # The background worker is started on first use
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, name="ReceiptTracker", daemon=True)
+                self.worker.start()
+
+            future = self.pending.get(tx_hash) or self.resolved.get(tx_hash)
+            if future is None:
+                future = Future()
+                self.pending[tx_hash] = future
+
+        self.wakeup.set()
+        return future
+
+    async def track_async(self, tx_hash) -> Future:
+        """The same as track, reading the current block with the async provider"""
+
+        current_block = None
+        if self.idle():
+            current_block = await aw3.eth.block_number
+        return self.track(tx_hash, current_block)
+
+    def forget(self, tx_hash):
+        """Stop waiting for the receipt of a transaction"""
+
+        with self.lock:
+            future = self.pending.pop(HexBytes(tx_hash), None)
+        if future is not None:
+            future.cancel()
+
+    def wait(self, tx_hash, timeout: float = 20) -> TxReceipt:
+        """Block until the receipt of the transaction is available"""
+
+        future = self._future_for(tx_hash)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            self.forget(tx_hash)
+            raise TimeExhausted(f"Transaction {HexBytes(tx_hash).hex()} is not in the chain after {timeout} seconds")
+
+    async def wait_async(self, tx_hash, timeout: float = 20) -> TxReceipt:
+        """Wait for the receipt of the transaction without blocking the event loop"""
+
+        future = await self._future_for_async(tx_hash)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self.forget(tx_hash)
+            raise TimeExhausted(f"Transaction {HexBytes(tx_hash).hex()} is not in the chain after {timeout} seconds")
+
+    def _future_for(self, tx_hash) -> Future:
+        """The future for the receipt of the transaction, tracking it if it was not done before sending it"""
+
+        with self.lock:
+            future = self.pending.get(HexBytes(tx_hash)) or self.resolved.get(HexBytes(tx_hash))
+        if future is not None:
+            return future
+
+        # The transaction may be already in a block that we have processed
+        future = self.track(tx_hash)
+        try:
+            receipt = w3.eth.get_transaction_receipt(tx_hash)
+        except TransactionNotFound:
+            return future
+
+        self._resolve(HexBytes(tx_hash), receipt)
+        return future
+
+    async def _future_for_async(self, tx_hash) -> Future:
+        """The same as _future_for, asking for the receipt with the async provider"""
+
+        if aw3 is None:
+            return self._future_for(tx_hash)
+
+        with self.lock:
+            future = self.pending.get(HexBytes(tx_hash)) or self.resolved.get(HexBytes(tx_hash))
+        if future is not None:
+            return future
+
+        future = await self.track_async(tx_hash)
+        try:
+            receipt = await aw3.eth.get_transaction_receipt(tx_hash)
+        except TransactionNotFound:
+            return future
+
+        self._resolve(HexBytes(tx_hash), receipt)
+        return future
+
+    def _resolve(self, tx_hash: HexBytes, receipt: TxReceipt):
+        with self.lock:
+            future = self.pending.pop(tx_hash, None)
+            if future is None:
+                return
+            # Keep the receipt for a while, in case the caller was not yet waiting for it
+            self.resolved[tx_hash] = future
+            if len(self.resolved) > RECEIPT_RESOLVED_SIZE:
+                self.resolved.popitem(last=False)
+        if not future.done():
+            future.set_result(receipt)
+
+    def _process_block(self, block_number: int):
+        """Resolve the transactions that we are waiting for included in the block"""
+
+        block = w3.eth.get_block(block_number)
+        with self.lock:
+            found = [HexBytes(tx_hash) for tx_hash in block["transactions"] if HexBytes(tx_hash) in self.pending]
+
+        for tx_hash in found:
+            receipt = w3.eth.get_transaction_receipt(tx_hash)
+            self._resolve(tx_hash, receipt)
+
+    def _run(self):
+        while True:
+            # Sleep while nobody is waiting for receipts
+            with self.lock:
+                idle = len(self.pending) == 0
+                if idle:
+                    self.wakeup.clear()
+            if idle:
+                self.wakeup.wait()
+                continue
+
+            try:
+                current_block = w3.eth.block_number
+                while True:
+                    with self.lock:
+                        # Stop following blocks as soon as nobody is waiting
+                        if len(self.pending) == 0 or self.last_block >= current_block:
+                            break
+                        block_number = self.last_block + 1
+
+                    self._process_block(block_number)
+
+                    with self.lock:
+                        # track() may have moved it forward while we were processing
+                        self.last_block = max(self.last_block, block_number)
+            except Exception as e:
+                log.error(f"Error tracking receipts: {e}")
+
+            time.sleep(self.poll_interval)
+
+# The tracker for all the transactions sent from this process
+receipt_tracker = ReceiptTracker()
+
+# END: Receipt tracking
+####################################################
+
+# Create a signed transaction with the private key and send it.
+# If wait is True, wait timeout for the txreceipt. Otherwise return as soon as the transaction
+# is sent (with the receipt as None), and the receipt can be collected later with wait_for_tx
+def send_signed_tx(contract_function, private_key: HexBytes = None, timeout: int=20, wait: bool=True):
+
+    log.debug("Entering send_signed_tx")
 
     # Obtain the account associated to the private key
     from_account = Account.privateKeyToAccount(private_key)
 
-    # Obtain the transaction count for the account, to build the nonce for the transaction
-    nonce = w3.eth.getTransactionCount(from_account.address)
-    if debug:
-        print(f"Nonce: {nonce}")
-
     # Define a high value of gas. For the moment this is not important
     gas = 9000000
 
-    # Create a transaction parameter specification with enough gas for executions
-    txparms = {
-        'gasPrice': 0,
-        'gas': gas,
-        'nonce': nonce
-    }
+    # Retry a few times if the node tells us that our nonce is out of sync
+    max_attempts = 3
+    for attempt in range(max_attempts):
+
+        # Allocate locally the nonce for the transaction
+        nonce = nonce_manager.next_nonce(from_account.address)
+        log.debug(f"Nonce: {nonce}")
+
+        # Create a transaction parameter specification with enough gas for executions
+        txparms = {
+            'gasPrice': 0,
+            'gas': gas,
+            'nonce': nonce
+        }
+
+        try:
+            # Build the transaction object for the invocation to the provided function
+            unsignedTx = contract_function.buildTransaction(txparms)
+            log.debug("Built the transaction object")
+            log.debug(f"Unsingend tx: {unsignedTx}")
+
+            # Sign the transaction with the private key
+            # This way we can send the transaction without relying on accounts hosted in any node
+            # It will act as sending the transaction from the account associated to the private key
+            signedTx = Account.signTransaction(unsignedTx, private_key)
+            log.debug(f"SignedTx: {signedTx}")
+
+            # Start tracking the receipt before sending, so we do not miss the block with the transaction
+            receipt_tracker.track(signedTx.hash)
+
+            # Send the signed transaction
+            try:
+                tx_hash = w3.eth.sendRawTransaction(signedTx.rawTransaction)
+            except Exception:
+                receipt_tracker.forget(signedTx.hash)
+                raise
+            log.debug(f"Transaction sent with hash: {tx_hash}")
+            break
+
+        except Exception as e:
+            # The nonce was not used, so we have to read it again from the blockchain
+            nonce_manager.resync(from_account.address)
+            if is_nonce_error(e) and attempt < max_attempts - 1:
+                log.warning(f"Nonce {nonce} rejected, retrying: {e}")
+                continue
+            raise
+
+    if not wait:
+        return True, None, tx_hash
+
+    return wait_for_tx(tx_hash, timeout, gas, from_account.address)
+
+# Send several transactions from the same account back-to-back, and then wait for all the receipts.
+# Returns a list with the result of each transaction, in the same format as send_signed_tx
+def send_signed_txs(contract_functions, private_key: HexBytes = None, timeout: int=20):
 
-    # Build the transaction object for the invocation to the provided function
-    unsignedTx = contract_function.buildTransaction(txparms)
-    if debug:
-        print(f"Built the transaction object")
-        print(f"Unsingend tx: {unsignedTx}")
+    from_account = Account.privateKeyToAccount(private_key)
 
-    # Sign the transaction with the private key
-    # This way we can send the transaction without relying on accounts hosted in any node
-    # It will act as sending the transaction from the account associated to the private key
-    signedTx = Account.signTransaction(unsignedTx, private_key)
-    if debug:
-        print(f"SignedTx: {signedTx}")
+    tx_hashes = []
+    for contract_function in contract_functions:
+        success, tx_receipt, tx_hash = send_signed_tx(contract_function, private_key, timeout, wait=False)
+        tx_hashes.append(tx_hash)
 
-    # Send the signed transaction
-    tx_hash = w3.eth.sendRawTransaction(signedTx.rawTransaction)
-    if debug:
-        print(f"Transaction sent with hash: {tx_hash}")
+    results = []
+    for tx_hash in tx_hashes:
+        results.append(wait_for_tx(tx_hash, timeout, address=from_account.address))
 
-    # Wait for the receipt at most "timeout" seconds
-    tx_receipt = w3.eth.waitForTransactionReceipt(tx_hash, timeout)
-    if debug:
-        print(f"Receipt: {tx_receipt}")
+    return results
+
+# Wait timeout for the receipt of a transaction sent with send_signed_tx
+def wait_for_tx(tx_hash, timeout: int=20, gas: int=9000000, address: str = None):
+
+    try:
+        # Wait for the receipt at most "timeout" seconds
+        tx_receipt = receipt_tracker.wait(tx_hash, timeout)
+    except Exception:
+        # The transaction may be stuck behind a gap in the nonces of the account
+        if address is not None:
+            nonce_manager.resync(address)
+        raise
+
+    return tx_result(tx_receipt, gas, tx_hash)
+
+# The same as wait_for_tx, to be awaited from async code
+async def wait_for_tx_async(tx_hash, timeout: int=20, gas: int=9000000, address: str = None):
+
+    try:
+        tx_receipt = await receipt_tracker.wait_async(tx_hash, timeout)
+    except Exception:
+        if address is not None:
+            nonce_manager.resync(address)
+        raise
+
+    return tx_result(tx_receipt, gas, tx_hash)
+
+def tx_result(tx_receipt, gas, tx_hash):
+
+    log.debug(f"Receipt: {tx_receipt}")
 
     # Check if the transaction executed correctly
     success = checkTxReceipt(tx_receipt, gas)
-    if debug:
-        print(f"Success: {success}")
+    log.debug(f"Success: {success}")
     return success, tx_receipt, tx_hash
 
 # To simplify waiting for the transaction receipt
@@ -303,7 +645,7 @@ def send_signed_tx(contract_function, private_key: HexBytes = None, timeout: int
 def waitForReceipt(tx_hash, timeout=20):
 
     # Wait for the receipt at most "timeout" seconds
-    receipt = w3.eth.waitForTransactionReceipt(tx_hash, timeout)
+    receipt = receipt_tracker.wait(tx_hash, timeout)
 
     # Check for successful transaction execution
     return (receipt.status == 1), receipt
@@ -321,6 +663,9 @@ def setup_provider(node_ip):
     from web3.middleware import geth_poa_middleware
     w3.middleware_onion.inject(geth_poa_middleware, layer=0)
 
+    # The async API uses the same node
+    setup_async_provider(node_ip)
+
     # Return the Web3 instance
     return w3
 
@@ -331,4 +676,303 @@ def get_transaction_receipt(tx_hash) -> TxReceipt:
     # Convert the transaction receipt to a standard python dict
     receipt = json.loads(Web3.toJSON(tx_receipt))
 
-    return receipt
\ No newline at end of file
+    return receipt
+
+
+####################################################
+# START: Async access
+#
+# The same operations as above for async code (like the API handlers), so waiting for the
+# blockchain node costs a coroutine instead of a thread. All requests share a keep-alive
+# aiohttp session.
+# Contracts are still bound with the sync w3 (web3 v5 does not have async contracts): we use
+# them only to encode the calls and decode the results.
+
+# The chain id, needed to build transactions without asking the node each time
+_chain_id = None
+
+# Maximum number of simultaneous connections to the node. Other requests wait for a free one
+ASYNC_MAX_CONNECTIONS = 100
+
+# Seconds to wait for the answer of the node
+ASYNC_REQUEST_TIMEOUT = 30
+
+class KeepAliveHTTPProvider(AsyncHTTPProvider):
+    """The AsyncHTTPProvider of web3, with one aiohttp session for each event loop, shared by
+    all its coroutines. The session keeps the connections to the node open between requests.
+    web3 keeps one session per thread, which fails if the event loop of the thread changes.
+    """
+
+    def __init__(self, endpoint_uri, max_connections: int = ASYNC_MAX_CONNECTIONS) -> None:
+        super().__init__(endpoint_uri)
+        self.max_connections = max_connections
+        self.sessions = weakref.WeakKeyDictionary()
+
+    def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session = self.sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=ASYNC_REQUEST_TIMEOUT),
+                raise_for_status=True
+            )
+            self.sessions[loop] = session
+        return session
+
+    async def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        async with self.session().post(self.endpoint_uri, data=request_data, headers=self.get_request_headers()) as response:
+            raw_response = await response.read()
+        return self.decode_rpc_response(raw_response)
+
+    async def make_batch_request(self, rpc_requests: list) -> list:
+        """Send several (method, params) requests in one JSON-RPC batch, and return their results"""
+        async with self.session().post(self.endpoint_uri, data=batch_payload(rpc_requests), headers=self.get_request_headers()) as response:
+            raw_response = await response.read()
+        return batch_results(raw_response, len(rpc_requests))
+
+    async def close(self):
+        """Close the session of the current event loop"""
+        session = self.sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+def setup_async_provider(node_ip):
+
+    global aw3
+    global _chain_id
+
+    aw3 = Web3(
+        KeepAliveHTTPProvider(node_ip),
+        modules={"eth": (AsyncEth,)},
+        middlewares=[]
+    )
+    _chain_id = None
+
+    return aw3
+
+async def call_async(contract_function, block_identifier="latest"):
+    """The same as contract_function.call(), with the async provider.
+    Returns the result in the same format: a single value, or a list if the function returns several.
+    """
+
+    tx = {
+        "to": contract_function.address,
+        "data": contract_function._encode_transaction_data()
+    }
+    return_data = await aw3.eth.call(tx, block_identifier)
+
+    return decode_result(contract_function, return_data)
+
+async def chain_id_async() -> int:
+    global _chain_id
+    if _chain_id is None:
+        _chain_id = await aw3.eth.chain_id
+    return _chain_id
+
+# The same as send_signed_tx, without blocking the event loop while talking with the node
+async def send_signed_tx_async(contract_function, private_key: HexBytes = None, timeout: int=20, wait: bool=True):
+
+    from_account = Account.privateKeyToAccount(private_key)
+    gas = 9000000
+
+    # With the chain id, building the transaction does not need the node
+    chain_id = await chain_id_async()
+
+    max_attempts = 3
+    for attempt in range(max_attempts):
+
+        nonce = await nonce_manager.next_nonce_async(from_account.address)
+
+        txparms = {
+            'gasPrice': 0,
+            'gas': gas,
+            'nonce': nonce,
+            'chainId': chain_id
+        }
+
+        try:
+            unsignedTx = contract_function.buildTransaction(txparms)
+            signedTx = Account.signTransaction(unsignedTx, private_key)
+
+            await receipt_tracker.track_async(signedTx.hash)
+            try:
+                tx_hash = await aw3.eth.send_raw_transaction(signedTx.rawTransaction)
+            except Exception:
+                receipt_tracker.forget(signedTx.hash)
+                raise
+            log.debug(f"Transaction sent with hash: {tx_hash}")
+            break
+
+        except Exception as e:
+            nonce_manager.resync(from_account.address)
+            if is_nonce_error(e) and attempt < max_attempts - 1:
+                log.warning(f"Nonce {nonce} rejected, retrying: {e}")
+                continue
+            raise
+
+    if not wait:
+        return True, None, tx_hash
+
+    return await wait_for_tx_async(tx_hash, timeout, gas, from_account.address)
+
+async def get_transaction_receipt_async(tx_hash) -> TxReceipt:
+    return await aw3.eth.get_transaction_receipt(tx_hash)
+
+# END: Async access
+####################################################
+
+####################################################
+# START: Read aggregation
+#
+# Calls to many view functions are sent to the node together, instead of one HTTP round trip
+# for each one. If the Multicall contract is deployed, up to MULTICALL_MAX_CALLS calls go in one
+# eth_call to its aggregate function. The eth_call requests are sent in JSON-RPC batches of
+# up to BATCH_MAX_REQUESTS, so even without Multicall there is one HTTP request per batch.
+
+# The Multicall contract, bound by bind_multicall if it has been deployed
+multicall = None
+
+MULTICALL_MAX_CALLS = 200
+BATCH_MAX_REQUESTS = 500
+
+def bind_multicall(contractName: str):
+    """Bind the Multicall contract if it has been compiled and deployed. Otherwise calls are
+    aggregated only with JSON-RPC batches.
+    """
+
+    global multicall
+
+    if os.path.exists(contractName + ".abi") and os.path.exists(contractName + ".addr"):
+        multicall = bind_contract(contractName)
+    else:
+        multicall = None
+
+    return multicall
+
+def decode_result(contract_function, return_data):
+    """Decode the data returned by a call, in the same format returned by contract_function.call():
+    a single value, or a list if the function returns several.
+    """
+
+    output_types = get_abi_output_types(contract_function.abi)
+    output_data = w3.codec.decode_abi(output_types, HexBytes(return_data))
+    normalized_data = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, output_data)
+
+    if len(normalized_data) == 1:
+        return normalized_data[0]
+    else:
+        return list(normalized_data)
+
+def batch_payload(rpc_requests: list) -> bytes:
+    payload = [
+        {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+        for i, (method, params) in enumerate(rpc_requests)
+    ]
+    return json.dumps(payload).encode("utf-8")
+
+def batch_results(raw_response: bytes, num_requests: int) -> list:
+    """The results of a JSON-RPC batch, in the order of the requests. Raises ValueError if any failed."""
+
+    responses = json.loads(raw_response)
+    if not isinstance(responses, list):
+        # The node did not accept the batch
+        raise ValueError(responses.get("error", responses))
+
+    results = [None] * num_requests
+    for response in responses:
+        if "error" in response:
+            raise ValueError(response["error"])
+        results[response["id"]] = response["result"]
+
+    return results
+
+def rpc_batch(rpc_requests: list) -> list:
+    """Send several (method, params) requests in one JSON-RPC batch, and return their results"""
+
+    raw_response = make_post_request(
+        w3.provider.endpoint_uri,
+        batch_payload(rpc_requests),
+        **w3.provider.get_request_kwargs()
+    )
+    return batch_results(raw_response, len(rpc_requests))
+
+def _call_request(contract_function, block: str) -> tuple:
+    tx = {
+        "to": contract_function.address,
+        "data": contract_function._encode_transaction_data()
+    }
+    return ("eth_call", [tx, block])
+
+def _prepare_batch(contract_functions: list, block_identifier):
+    """The eth_call requests for the contract functions, and the function to decode their results"""
+
+    if isinstance(block_identifier, int):
+        block = hex(block_identifier)
+    else:
+        block = block_identifier
+
+    if multicall is None:
+        rpc_requests = [_call_request(f, block) for f in contract_functions]
+
+        def decode(results: list) -> list:
+            return [decode_result(f, result) for f, result in zip(contract_functions, results)]
+
+        return rpc_requests, decode
+
+    # Several calls in each request to Multicall
+    chunks = []
+    rpc_requests = []
+    for start in range(0, len(contract_functions), MULTICALL_MAX_CALLS):
+        chunk = contract_functions[start:start + MULTICALL_MAX_CALLS]
+        aggregate = multicall.functions.aggregate(
+            [(f.address, HexBytes(f._encode_transaction_data())) for f in chunk])
+        chunks.append((chunk, aggregate))
+        rpc_requests.append(_call_request(aggregate, block))
+
+    def decode(results: list) -> list:
+        values = []
+        for (chunk, aggregate), result in zip(chunks, results):
+            blockNumber, call_results = decode_result(aggregate, result)
+            for f, (success, return_data) in zip(chunk, call_results):
+                if not success:
+                    raise ContractLogicError(f"Call to {f.fn_name} failed in Multicall")
+                values.append(decode_result(f, return_data))
+        return values
+
+    return rpc_requests, decode
+
+def batch_call(contract_functions: list, block_identifier="latest") -> list:
+    """Call all the contract functions with as few requests to the node as possible.
+    Returns their results in the same order and format as contract_function.call().
+    """
+
+    if len(contract_functions) == 0:
+        return []
+
+    rpc_requests, decode = _prepare_batch(contract_functions, block_identifier)
+
+    results = []
+    for start in range(0, len(rpc_requests), BATCH_MAX_REQUESTS):
+        results.extend(rpc_batch(rpc_requests[start:start + BATCH_MAX_REQUESTS]))
+
+    return decode(results)
+
+async def batch_call_async(contract_functions: list, block_identifier="latest") -> list:
+    """The same as batch_call, with the async provider. The batches are sent concurrently."""
+
+    if len(contract_functions) == 0:
+        return []
+
+    rpc_requests, decode = _prepare_batch(contract_functions, block_identifier)
+
+    batches = await asyncio.gather(*[
+        aw3.provider.make_batch_request(rpc_requests[start:start + BATCH_MAX_REQUESTS])
+        for start in range(0, len(rpc_requests), BATCH_MAX_REQUESTS)
+    ])
+
+    return decode([result for batch in batches for result in batch])
+
+# END: Read aggregation
+####################################################
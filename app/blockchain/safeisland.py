@@ -1,6 +1,5 @@
 import os
 import time
-import sqlite3
 import json
 import uuid as unique_id
 from sqlite3.dbapi2 import Connection
@@ -15,13 +14,14 @@ from devtools import debug
 
 from web3.main import Web3
 
-from blockchain import trustframework as tf
+from blockchain import didcache
 from blockchain import wallet
 
 from jwcrypto import jwt, jwk, jws
 from jwcrypto.common import base64url_decode, base64url_encode, json_decode, json_encode
 
 from settings import settings
+from utils.db import get_connection, transaction
 
 if settings.PRODUCTION:
     DATABASE_FILE = "safeislandcred.sqlite"
@@ -43,10 +43,7 @@ CREATE TABLE safeislandcred (
 
 
 def get_db() -> Connection:
-    print(DATABASE_NAME)
-    db = sqlite3.connect(DATABASE_NAME, detect_types=sqlite3.PARSE_DECLTYPES)
-    db.row_factory = sqlite3.Row
-    return db
+    return get_connection(DATABASE_NAME)
 
 
 def erase_db() -> Connection:
@@ -72,12 +69,12 @@ def new_certificate(uuid: str, certificate: str) -> str:
 
     db = get_db()
 
-    db.execute(
-        'REPLACE INTO safeislandcred (uuid, cert) VALUES (?, ?)',
-        (uuid, certificate)
-    )
-    # Commit database, just in case
-    db.commit()
+    # Commit database, or roll back if it fails
+    with transaction(db):
+        db.execute(
+            'REPLACE INTO safeislandcred (uuid, cert) VALUES (?, ?)',
+            (uuid, certificate)
+        )
 
     # Return certificate id to caller
     return uuid
@@ -285,7 +282,7 @@ def new_signed_credential(claims=None, jwk_key=None):
     issuer_did = claims["iss"]
 
     # Try to resolve the Issuer and get its DID Document
-    DID, name, DIDDocument, active = tf.resolver.resolveDID(issuer_did)
+    DID, name, DIDDocument, active = didcache.resolve(issuer_did)
 
     # Check if the Issuer exists and return if not
     if DIDDocument is None:
@@ -706,6 +703,37 @@ def verify_cert_token(cert_token:str) -> dict:
         signed the JWT
     """
 
+    # Steps 1 to 3
+    key_id, DID = cert_token_key_id(cert_token)
+    if key_id is None:
+        return None, None
+
+    # 4. Perform resolution of the DID of the issuer, and get the public key
+    _DID, name, didDoc, active = didcache.resolve(DID)
+    if didDoc is None:
+        print(f"No DIDDoc found for DID: {DID}")
+        return None, None
+
+    # Steps 5 to 7
+    return verify_cert_token_with_diddoc(cert_token, key_id, DID, didDoc)
+
+async def verify_cert_token_async(cert_token:str) -> dict:
+    """The same as verify_cert_token, without blocking the event loop while resolving the DID of the issuer"""
+
+    key_id, DID = cert_token_key_id(cert_token)
+    if key_id is None:
+        return None, None
+
+    _DID, name, didDoc, active = await didcache.resolve_async(DID)
+    if didDoc is None:
+        print(f"No DIDDoc found for DID: {DID}")
+        return None, None
+
+    return verify_cert_token_with_diddoc(cert_token, key_id, DID, didDoc)
+
+def cert_token_key_id(cert_token:str) -> Tuple[Optional[str], Optional[str]]:
+    """Get the key id used to sign the JWT and the DID of the issuer, without verifying it"""
+
     # 1. Deserialize the JWT without verifying it (we do not yet have the public key)
     cert_obj = jwt.JWT()
     cert_obj.deserialize(jwt=cert_token)
@@ -726,11 +754,10 @@ def verify_cert_token(cert_token:str) -> dict:
     # Get the DID component
     DID = key_components[0]
 
-    # 4. Perform resolution of the DID of the issuer, and get the public key
-    _DID, name, didDoc, active = tf.resolver.resolveDID(DID)
-    if didDoc is None:
-        print(f"No DIDDoc found for DID: {DID}")
-        return None, None
+    return key_id, DID
+
+def verify_cert_token_with_diddoc(cert_token:str, key_id: str, DID: str, didDoc: dict) -> dict:
+    """Verify the JWT with the key of the issuer in its DIDDocument"""
 
     # 5. Get the public key specified inside the DIDDocument
     keys = didDoc["verificationMethod"]
@@ -791,7 +818,7 @@ def verify_cert_token_debug(cert_token:str) -> dict:
     DID = key_components[0]
 
     # 4. Perform resolution of the DID of the issuer, and get the public key
-    _DID, name, didDoc, active = tf.resolver.resolveDID(DID)
+    _DID, name, didDoc, active = didcache.resolve(DID)
     if didDoc is None:
         print(f"No DIDDoc found for DID: {DID}")
         return None
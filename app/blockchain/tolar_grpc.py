@@ -0,0 +1,156 @@
+# Native gRPC client for the Tolar HashNet node
+#
+# The client is generated at runtime from the .proto files in the tolar/proto directory,
+# and keeps one long-lived channel to the node for all the calls (and another one for the
+# async calls), instead of running grpcurl for each call.
+# The responses are converted to the same JSON format produced by grpcurl, so the rest of
+# the code works in the same way with both.
+# It requires the optional packages grpcio and grpcio-tools. If they are not installed,
+# tolar_hashnet keeps using grpcurl.
+
+import sys
+import asyncio
+import logging
+import contextlib
+from typing import AsyncIterator, Iterator, Optional
+
+try:
+    import grpc
+    from google.protobuf import json_format
+except ImportError:
+    grpc = None
+
+# The settings for the system
+from settings import settings
+
+log = logging.getLogger(__name__)
+
+# The .proto files with the services used, relative to the application directory,
+# which is where the imports inside the .proto files are resolved
+PROTO_FILES = [
+    "tolar/proto/account.proto",
+    "tolar/proto/blockchain.proto",
+    "tolar/proto/client.proto",
+]
+
+
+def available() -> bool:
+    return grpc is not None
+
+@contextlib.contextmanager
+def proto_path():
+    """Set sys.path to find the .proto files while they are compiled, and restore it after.
+    The .proto files are searched in sys.path, which must have only strings
+    (attributedict inserts None in it when imported).
+    The imports in the .proto files are relative to the application directory.
+    """
+
+    saved_path = list(sys.path)
+    sys.path[:] = [path for path in sys.path if isinstance(path, str)]
+    if settings.INITIAL_DIR not in sys.path:
+        sys.path.append(settings.INITIAL_DIR)
+    try:
+        yield
+    finally:
+        sys.path[:] = saved_path
+
+def message_to_dict(message) -> dict:
+    """Convert a response to a dict, in the JSON format of grpcurl: fields in lowerCamelCase,
+    bytes in base64 and 64 bit integers as strings, including the fields with default values.
+    """
+    try:
+        return json_format.MessageToDict(message, including_default_value_fields=True)
+    except TypeError:
+        # Newer versions of protobuf renamed the argument
+        return json_format.MessageToDict(message, always_print_fields_with_no_presence=True)
+
+
+class TolarClient():
+    """Client of the services of a Tolar node, with a persistent channel.
+    Methods are identified by their full gRPC name, eg. "tolar.proto.BlockchainService.GetNonce",
+    and requests are dicts with the same format accepted by grpcurl.
+    """
+
+    def __init__(self, server: str) -> None:
+        if grpc is None:
+            raise RuntimeError("grpcio is not installed")
+
+        self.server = server
+
+        # Generate the message classes and stubs of the services
+        self.modules = {}
+        self.services = {}
+        self.stub_classes = {}
+        for proto_file in PROTO_FILES:
+            with proto_path():
+                protos, services = grpc.protos_and_services(proto_file)
+                self._add_module(protos)
+            for service in protos.DESCRIPTOR.services_by_name.values():
+                self.services[service.full_name] = service
+                self.stub_classes[service.full_name] = getattr(services, service.name + "Stub")
+
+        # The channel is created now, and connects on the first call
+        self.channel = grpc.insecure_channel(server)
+        self.stubs = {name: stub_class(self.channel) for name, stub_class in self.stub_classes.items()}
+
+        # The async channels must be created inside the event loop, on the first async call.
+        # There is one per event loop (eg. the one of the server and the one of the receipt waiter)
+        self.aio_channels = {}
+        self.aio_stubs = {}
+
+    def _add_module(self, protos):
+        """Keep the module of the messages of each .proto file, including the imported ones"""
+        self.modules[protos.DESCRIPTOR.name] = protos
+        for dependency in protos.DESCRIPTOR.dependencies:
+            if dependency.name not in self.modules:
+                self._add_module(grpc.protos(dependency.name))
+
+    def _request(self, method: str, data: Optional[dict]):
+        """The service, name and request message of a method called with data"""
+
+        service_name, method_name = method.rsplit(".", 1)
+        input_type = self.services[service_name].methods_by_name[method_name].input_type
+        request_class = getattr(self.modules[input_type.file.name], input_type.name)
+        request = json_format.ParseDict(data or {}, request_class())
+        return service_name, method_name, request
+
+    def call(self, method: str, data: dict = None, timeout: float = None) -> dict:
+        """Call a method with a single response. Raises grpc.RpcError if the call fails."""
+
+        service_name, method_name, request = self._request(method, data)
+        response = getattr(self.stubs[service_name], method_name)(request, timeout=timeout)
+        return message_to_dict(response)
+
+    def stream(self, method: str, data: dict = None, timeout: float = None) -> Iterator[dict]:
+        """Call a method with a stream of responses, like GetPaginatedBlocksByIndexStream"""
+
+        service_name, method_name, request = self._request(method, data)
+        for response in getattr(self.stubs[service_name], method_name)(request, timeout=timeout):
+            yield message_to_dict(response)
+
+    def _aio_stub(self, service_name: str):
+        loop = asyncio.get_running_loop()
+        stubs = self.aio_stubs.get(loop)
+        if stubs is None:
+            channel = grpc.aio.insecure_channel(self.server)
+            self.aio_channels[loop] = channel
+            stubs = {name: stub_class(channel) for name, stub_class in self.stub_classes.items()}
+            self.aio_stubs[loop] = stubs
+        return stubs[service_name]
+
+    async def call_async(self, method: str, data: dict = None, timeout: float = None) -> dict:
+        """Async version of call"""
+
+        service_name, method_name, request = self._request(method, data)
+        response = await getattr(self._aio_stub(service_name), method_name)(request, timeout=timeout)
+        return message_to_dict(response)
+
+    async def stream_async(self, method: str, data: dict = None, timeout: float = None) -> AsyncIterator[dict]:
+        """Async version of stream"""
+
+        service_name, method_name, request = self._request(method, data)
+        async for response in getattr(self._aio_stub(service_name), method_name)(request, timeout=timeout):
+            yield message_to_dict(response)
+
+    def close(self):
+        self.channel.close()
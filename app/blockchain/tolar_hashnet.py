@@ -7,8 +7,13 @@ import logging
 
 import base64
 import json
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from subprocess import run
 
+from typing import Dict, Iterator, Optional
+
 from hexbytes import HexBytes
 from devtools import debug
 
@@ -23,6 +28,8 @@ from blockchain import trustframework as tf
 from blockchain import wallet, certificates, safeisland, eutl, pubcred
 from blockchain import christmas, compile
 
+from blockchain import tolar_grpc
+
 from utils.menu import Menu, invoke
 
 timestamper_bin = "6080604052336000806101000a81548173ffffffffffffffffffffffffffffffffffffffff021916908373ffffffffffffffffffffffffffffffffffffffff16021790555034801561005057600080fd5b50336000806101000a81548173ffffffffffffffffffffffffffffffffffffffff021916908373ffffffffffffffffffffffffffffffffffffffff160217905550610530806100a06000396000f3fe608060405234801561001057600080fd5b5060043610610053576000357c01000000000000000000000000000000000000000000000000000000009004806351488aae14610058578063b97da33b14610074575b600080fd5b610072600480360381019061006d919061039b565b610090565b005b61008e60048036038101906100899190610413565b61016e565b005b60008054906101000a900473ffffffffffffffffffffffffffffffffffffffff1673ffffffffffffffffffffffffffffffffffffffff163373ffffffffffffffffffffffffffffffffffffffff16146100e857600080fd5b60005b82518110156101695781818151811061010757610106610453565b5b602002602001015183828151811061012257610121610453565b5b60200260200101517fa3865c00e01495fc2b86502cae36a4edb139f748682e7d80725a3d6571a482fa60405160405180910390a38080610161906104b1565b9150506100eb565b505050565b60008054906101000a900473ffffffffffffffffffffffffffffffffffffffff1673ffffffffffffffffffffffffffffffffffffffff163373ffffffffffffffffffffffffffffffffffffffff16146101c657600080fd5b80827fa3865c00e01495fc2b86502cae36a4edb139f748682e7d80725a3d6571a482fa60405160405180910390a35050565b6000604051905090565b600080fd5b600080fd5b600080fd5b6000601f19601f8301169050919050565b7f4e487b7100000000000000000000000000000000000000000000000000000000600052604160045260246000fd5b61025a82610211565b810181811067ffffffffffffffff8211171561027957610278610222565b5b80604052505050565b600061028c6101f8565b90506102988282610251565b919050565b600067ffffffffffffffff8211156102b8576102b7610222565b5b602082029050602081019050919050565b600080fd5b6000819050919050565b6102e1816102ce565b81146102ec57600080fd5b50565b6000813590506102fe816102d8565b92915050565b60006103176103128461029d565b610282565b9050808382526020820190506020840283018581111561033a576103396102c9565b5b835b81811015610363578061034f88826102ef565b84526020840193505060208101905061033c565b5050509392505050565b600082601f8301126103825761038161020c565b5b8135610392848260208601610304565b91505092915050565b600080604083850312156103b2576103b1610202565b5b600083013567ffffffffffffffff8111156103d0576103cf610207565b5b6103dc8582860161036d565b925050602083013567ffffffffffffffff8111156103fd576103fc610207565b5b6104098582860161036d565b9150509250929050565b6000806040838503121561042a57610429610202565b5b6000610438858286016102ef565b9250506020610449858286016102ef565b9150509250929050565b7f4e487b7100000000000000000000000000000000000000000000000000000000600052603260045260246000fd5b7f4e487b7100000000000000000000000000000000000000000000000000000000600052601160045260246000fd5b60006104bc826102ce565b91507fffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff8214156104ef576104ee610482565b5b60018201905091905056fea26469706673582212208c0c46ae3e2038f671c0dad478b46df5ced986ab216eecdd0cc6939874e4ef0a64736f6c63430008090033"
@@ -47,8 +54,8 @@ def bytes_to_b64str(v):
     return enc.decode("ascii")
 
 def int_to_b64str(v: int):
-    b = int(v)
-    enc = base64.b64encode(b.to_bytes((b.bit_length() + 7) // 8, "big"))
+    value = int(v)
+    enc = base64.b64encode(value.to_bytes((value.bit_length() + 7) // 8, "big"))
     return enc.decode("ascii")
 
 def hash(any_hash: str) -> str:
@@ -91,6 +98,219 @@ def addressb64(any_address: str) -> str:
 def list_top_services():
     run([grcmd, "-plaintext", gserver, "list"])    
 
+def pythonic_receipt(tx_receipt: dict) -> dict:
+    """Convert the hashes and addresses of a receipt returned by the node to hex strings"""
+
+    tx_receipt["blockHash"] = hash(tx_receipt['blockHash'])
+    tx_receipt['transactionHash'] = hash(tx_receipt['transactionHash'])
+    tx_receipt['senderAddress'] = address(tx_receipt['senderAddress'])
+    tx_receipt['receiverAddress'] = address(tx_receipt['receiverAddress'])
+    tx_receipt['newAddress'] = address(tx_receipt['newAddress'])
+    tx_receipt['gasUsed'] = b64str_to_int(tx_receipt['gasUsed'])
+
+    if "logs" in tx_receipt:
+        for log in tx_receipt["logs"]:
+            log['address'] = address(log['address'])
+            topics = log['topics']
+            for j in range(len(topics)):
+                topics[j] = hash(topics[j])
+
+    return tx_receipt
+
+
+class TolarNonceManager():
+    """Allocates locally the nonces of the transactions of each sender address.
+    The nonce is read from the node only the first time the address is used and after
+    a transaction fails, instead of calling GetNonce for every transaction.
+    """
+
+    def __init__(self, tolar: "Tolar") -> None:
+        self.tolar = tolar
+        self.nonces = {}
+        self.lock = threading.Lock()
+
+    def node_nonce(self, address: str) -> int:
+        """The nonce of the address in the node. Raises an exception if it can not be read,
+        because a wrong nonce would make all the following transactions fail.
+        """
+
+        out = self.tolar.call("GetNonce", {"address": addressb64(address)}, check=True)
+        return b64str_to_int(out["nonce"])
+
+    def next_nonce(self, address: str) -> int:
+        with self.lock:
+            if address not in self.nonces:
+                self.nonces[address] = self.node_nonce(address)
+            nonce = self.nonces[address]
+            self.nonces[address] = nonce + 1
+        return nonce
+
+    def resync(self, address: str):
+        with self.lock:
+            self.nonces.pop(address, None)
+
+
+class TolarReceiptWaiter():
+    """Waits for the receipts of the Tolar transactions sent from this process.
+    An asyncio task, in its own thread and event loop, follows the number of blocks with
+    GetBlockCount while there are transactions waiting. For each new block it gets the hashes
+    of its transactions, and asks for the receipts only of the ones we are waiting for, with at
+    most max_requests calls to the node at the same time. The polling interval grows exponentially
+    while there are no new blocks. After a period without transactions waiting, it starts again
+    from the latest block, asking directly for the receipts of the transactions sent in between.
+    """
+
+    def __init__(self, tolar: "Tolar", min_interval: float = 0.2, max_interval: float = 5.0, max_requests: int = 16) -> None:
+        self.tolar = tolar
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_requests = max_requests
+        self.pending: Dict[str, Future] = {}
+        self.last_block = None
+        self.lock = threading.Lock()
+        self.loop = None
+        self.wakeup = None
+        self.requests = None
+
+    def _start(self):
+        """Start the event loop of the waiter in its own thread (called with the lock held)"""
+
+        ready = threading.Event()
+
+        def run_loop():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.wakeup = asyncio.Event()
+            self.requests = asyncio.Semaphore(self.max_requests)
+            self.loop.create_task(self._follow())
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run_loop, name="TolarReceiptWaiter", daemon=True).start()
+        ready.wait()
+
+    def track(self, tx_hash: str) -> Future:
+        """Start waiting for the receipt of a transaction. Returns a future resolved with the receipt."""
+
+        tx_hash = hash(tx_hash)
+        with self.lock:
+            if self.loop is None:
+                self._start()
+            future = self.pending.get(tx_hash)
+            if future is None:
+                future = Future()
+                self.pending[tx_hash] = future
+
+        self.loop.call_soon_threadsafe(self.wakeup.set)
+
+        # The transaction may be already in a block older than the ones we follow
+        asyncio.run_coroutine_threadsafe(self._check([tx_hash]), self.loop)
+        return future
+
+    def wait(self, tx_hash: str, timeout: float = 30) -> Optional[dict]:
+        """Block until the receipt of the transaction is available, or None after the timeout"""
+
+        future = self.track(tx_hash)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            self.forget(tx_hash)
+            return None
+
+    async def wait_async(self, tx_hash: str, timeout: float = 30) -> Optional[dict]:
+        """Wait for the receipt of the transaction without blocking the event loop of the caller"""
+
+        future = self.track(tx_hash)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self.forget(tx_hash)
+            return None
+
+    def forget(self, tx_hash: str):
+        with self.lock:
+            future = self.pending.pop(hash(tx_hash), None)
+        if future is not None:
+            future.cancel()
+
+    async def _receipt(self, tx_hash: str) -> Optional[dict]:
+        """The receipt of the transaction, or None if it is not yet in a block"""
+
+        data = {"transaction_hash": hashb64(tx_hash)}
+        try:
+            async with self.requests:
+                tx_receipt = await self.tolar.call_async("GetTransactionReceipt", data, quiet=True)
+        except Exception:
+            return None
+        if tx_receipt is None:
+            return None
+        return pythonic_receipt(tx_receipt)
+
+    async def _check(self, tx_hashes):
+        """Ask for the receipts of the transactions concurrently, and resolve the ones available"""
+
+        receipts = await asyncio.gather(*[self._receipt(tx_hash) for tx_hash in tx_hashes])
+        for tx_hash, tx_receipt in zip(tx_hashes, receipts):
+            if tx_receipt is None:
+                continue
+            with self.lock:
+                future = self.pending.pop(tx_hash, None)
+            if future is not None and not future.done():
+                future.set_result(tx_receipt)
+
+    async def _block_transactions(self, block_index: int) -> list:
+        async with self.requests:
+            block = await self.tolar.call_async("GetBlockByIndex", {"block_index": block_index}, quiet=True)
+        if block is None:
+            raise Exception(f"Can not get block {block_index}")
+        return [hash(tx_hash) for tx_hash in block.get("transactionHashes", [])]
+
+    async def _follow(self):
+        interval = self.min_interval
+
+        while True:
+            # Sleep while nobody is waiting for receipts
+            with self.lock:
+                idle = len(self.pending) == 0
+            if idle:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                # The blocks mined while idle are not followed: start again from the latest one
+                self.last_block = None
+                interval = self.min_interval
+                continue
+
+            try:
+                out = await self.tolar.call_async("GetBlockCount", quiet=True)
+                if out is None:
+                    raise Exception("Can not get the block count")
+                latest_block = int(out["blockCount"]) - 1
+                if self.last_block is None:
+                    # The transactions already in a block up to the latest one are asked directly
+                    self.last_block = latest_block
+                    with self.lock:
+                        tx_hashes = list(self.pending)
+                    await self._check(tx_hashes)
+
+                if latest_block > self.last_block:
+                    # Get the new blocks, and the receipts of our transactions in them
+                    new_blocks = range(self.last_block + 1, latest_block + 1)
+                    blocks = await asyncio.gather(*[self._block_transactions(index) for index in new_blocks])
+                    with self.lock:
+                        found = [tx_hash for block in blocks for tx_hash in block if tx_hash in self.pending]
+                    await self._check(found)
+                    self.last_block = latest_block
+                    interval = self.min_interval
+                else:
+                    interval = min(interval * 2, self.max_interval)
+
+            except Exception as e:
+                log.error(f"Error waiting for Tolar receipts: {e}")
+                interval = min(interval * 2, self.max_interval)
+
+            await asyncio.sleep(interval)
+
+
 class Tolar():
 
     services = {
@@ -135,6 +355,10 @@ class Tolar():
 
     def __init__(self, server) -> None:
         self.server = server
+        self._client = None
+        self._native = settings.TOLAR_NATIVE_GRPC and tolar_grpc.available()
+        self.nonces = TolarNonceManager(self)
+        self.receipts = TolarReceiptWaiter(self)
 
     def set_contract_wrapper(self, wrapper):
         self.contract_wrapper = wrapper
@@ -143,6 +367,87 @@ class Tolar():
         p = run(cmd, capture_output=True, text=True)
         return p
 
+    def client(self) -> Optional[tolar_grpc.TolarClient]:
+        """The native gRPC client, created on first use, or None to use grpcurl"""
+
+        if self._native and self._client is None:
+            try:
+                self._client = tolar_grpc.TolarClient(self.server)
+            except Exception as e:
+                log.warning(f"Using grpcurl, the native gRPC client can not be created: {e}")
+                self._native = False
+        return self._client
+
+    def call(self, method: str, data: dict = None, check: bool = False) -> Optional[dict]:
+        """Call a method of the node (one of the services) with the native gRPC client,
+        or running grpcurl if not available. The response is in the JSON format of grpcurl.
+        Returns None if there was an error, or raises an exception if check is True.
+        """
+
+        client = self.client()
+        if client is not None:
+            try:
+                return client.call(self.services[method], data)
+            except tolar_grpc.grpc.RpcError as e:
+                error = f"{e.code()}: {e.details()}"
+        else:
+            cmd = [grcmd]
+            if data is not None:
+                cmd += ["-d", json.dumps(data)]
+            cmd += ["-plaintext", self.server, self.services[method]]
+            p = self._run_cmd(cmd)
+            if p.returncode == 0:
+                return json.loads(p.stdout)
+            error = p.stderr
+
+        if check:
+            raise Exception(f"Error calling {method}: {error}")
+        print(f"There was an error: {error}")
+        return None
+
+    def stream(self, method: str, data: dict = None) -> Iterator[dict]:
+        """Call a method of the node returning a stream of responses"""
+
+        client = self.client()
+        if client is not None:
+            yield from client.stream(self.services[method], data)
+            return
+
+        # grpcurl writes the responses one after the other
+        cmd = [grcmd]
+        if data is not None:
+            cmd += ["-d", json.dumps(data)]
+        cmd += ["-plaintext", self.server, self.services[method]]
+        p = self._run_cmd(cmd)
+        if p.returncode != 0:
+            raise Exception(f"Error calling {method}: {p.stderr}")
+        decoder = json.JSONDecoder()
+        text = p.stdout.strip()
+        while len(text) > 0:
+            response, end = decoder.raw_decode(text)
+            yield response
+            text = text[end:].strip()
+
+    async def call_async(self, method: str, data: dict = None, quiet: bool = False) -> Optional[dict]:
+        """Async version of call. With quiet, errors are not printed."""
+
+        client = self.client()
+        if client is None:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(None, self.call, method, data, True)
+            except Exception as e:
+                error = e
+        else:
+            try:
+                return await client.call_async(self.services[method], data)
+            except tolar_grpc.grpc.RpcError as e:
+                error = f"{e.code()}: {e.details()}"
+
+        if not quiet:
+            print(f"There was an error: {error}")
+        return None
+
     def list(self):
         run([grcmd, "-plaintext", self.server, "list", "tolar.proto.AccountService"])
         print()
@@ -156,23 +461,17 @@ class Tolar():
     def open(self):
         """Open keystore
         """
-        p = run([grcmd, "-plaintext", self.server, self.services["Open"]], capture_output=True, text=True)
-        if p.returncode != 0:
-            print(f"There was an error: {p.stderr}")
+        self.call("Open")
 
     def create(self):
         """Create keystore
         """
-        p = self._run_cmd([grcmd, "-plaintext", self.server, self.services["Create"]])
-        if p.returncode != 0:
-            print(f"There was an error: {p.stderr}")
+        self.call("Create")
 
     def list_adddresses(self):
         """List addresses
         """
-        p = self._run_cmd([grcmd, "-plaintext", self.server, self.services["ListAddresses"]])
-        p.check_returncode()
-        out = json.loads(p.stdout)
+        out = self.call("ListAddresses", check=True)
         addresses = out["addresses"]
         for i in range(len(addresses)):
             addresses[i] = address(addresses[i])
@@ -182,9 +481,7 @@ class Tolar():
     def create_new_address(self):
         """Create new address
         """
-        p = self._run_cmd([grcmd, "-plaintext", self.server, self.services["CreateNewAddress"]])
-        p.check_returncode()
-        out = json.loads(p.stdout)
+        out = self.call("CreateNewAddress", check=True)
         print(f"Created: {out['address']}")
         return address(out['address'])
 
@@ -199,13 +496,9 @@ class Tolar():
         data = {
             "raw_private_key": private_key,
         }
-        data = json.dumps(data)
-
-        p = self._run_cmd([grcmd, "-d", data, "-plaintext", self.server, self.services["ImportRawPrivateKey"]])
-        if p.returncode != 0:
-            print(f"There was an error: {p.stderr}")
+        out = self.call("ImportRawPrivateKey", data)
+        if out is None:
             return
-        out = json.loads(p.stdout)
         print(f"{out}")
 
     def SendDeployContractTransaction(self, address: str):
@@ -234,13 +527,9 @@ class Tolar():
             "nonce": nonce,
         }
         debug(data)
-        data = json.dumps(data)
-
-        p = self._run_cmd([grcmd, "-d", data, "-plaintext", self.server, self.services["SendDeployContractTransaction"]])
-        if p.returncode != 0:
-            print(f"There was an error: {p.stderr}")
+        out = self.call("SendDeployContractTransaction", data)
+        if out is None:
             return
-        out = json.loads(p.stdout)
         print(f"{out}")
 
 
@@ -268,19 +557,19 @@ class Tolar():
         }
         debug(data)
 
-        data = json.dumps(data)
-
-        p = self._run_cmd([grcmd, "-d", data, "-plaintext", self.server, self.services["TryCallTransaction"]])
-        if p.returncode != 0:
-            print(f"There was an error: {p.stderr}")
+        out = self.call("TryCallTransaction", data)
+        if out is None:
             return
-        out = json.loads(p.stdout)
         print(f"{out}")
 
     def get_transaction_data(self, hash1, hash2):
 
         # Get the contract wrapper
         contract_fun = self.contract_wrapper.functions.timestamp(hash1, hash2)
+        return self.get_function_data(contract_fun)
+
+    def get_function_data(self, contract_fun):
+        """The data of a transaction calling a function of a contract wrapper built with web3"""
 
         # Create a transaction parameter specification with enough gas for executions
         txparms = {
@@ -298,8 +587,10 @@ class Tolar():
         transaction_data,
         sender_address: str = "54d0b0bc6cbbd54d0ec605cbf87819763445e70ef24fc85c20",
         receiver_address: str = "54ece245cc634e8fb2ef6ba2d80fac0d8bb25a5979c2340279",
+        wait: bool = True
         ) -> dict:
         """SendExecuteFunctionTransaction
+        With wait=False, returns the hash of the transaction without waiting for its receipt.
         
         --- Definitions ---
         {"name": "sender_address", "prompt": "Sender address", "default": "54d0b0bc6cbbd54d0ec605cbf87819763445e70ef24fc85c20"}
@@ -318,7 +609,8 @@ class Tolar():
         contract_data = HexBytes(contract_data)
         contract_data = bytes_to_b64str(contract_data)
         
-        nonce = int_to_b64str(self.get_nonce(sender_address))
+        # The nonce is allocated locally, to send transactions back-to-back
+        nonce = int_to_b64str(self.nonces.next_nonce(sender_address))
 
         data = {
             "sender_address": sender_address_b64,
@@ -330,16 +622,17 @@ class Tolar():
             "nonce": nonce,
         }
         debug(data)
-        data = json.dumps(data)
-
-        p = self._run_cmd([grcmd, "-d", data, "-plaintext", self.server, self.services["SendExecuteFunctionTransaction"]])
-        if p.returncode != 0:
-            print(f"There was an error: {p.stderr}")
+        out = self.call("SendExecuteFunctionTransaction", data)
+        if out is None:
+            # The nonce may be out of sync with the node
+            self.nonces.resync(sender_address)
             return
-        out = json.loads(p.stdout)
         out["transactionHash"] = hash(out["transactionHash"])
         print(f"{out}")
-        tx_receipt = self.GetTransactionReceipt(out["transactionHash"])
+        if not wait:
+            return out["transactionHash"]
+
+        tx_receipt = self.receipts.wait(out["transactionHash"])
         return tx_receipt
 
     def GetTransactionReceipt(self, transaction_hash: str) -> dict:
@@ -349,41 +642,12 @@ class Tolar():
         {"name": "transaction_hash", "prompt": "transaction_hash", "default": "9483821e7e9d214a1ad218889d0dc3308a0f7f4b2fe4dc1129b2e77fe32e6e12"}
         """
 
-        data = {
-            "transaction_hash": hashb64(transaction_hash),
-        }
-        data = json.dumps(data)
-
-        import time
-        # Retry several times, waiting 1 second between retries
-        num_retries = 30
-        for i in range(num_retries):
-            p = self._run_cmd([grcmd, "-d", data, "-plaintext", self.server, self.services["GetTransactionReceipt"]])
-            if p.returncode == 0:
-                break
-            time.sleep(1)
-
-        if p.returncode != 0:
-            print(f"There was an error: {p.stderr}")
+        # Wait until the transaction is in a block, without spawning a request every second
+        tx_receipt = self.receipts.wait(transaction_hash, timeout=30)
+        if tx_receipt is None:
+            print(f"There was an error: transaction {transaction_hash} is not in a block after 30 seconds")
             return
 
-        tx_receipt = json.loads(p.stdout)
-
-        # Build a pythonic transaction receipt
-        tx_receipt["blockHash"] = hash(tx_receipt['blockHash'])
-        tx_receipt['transactionHash'] = hash(tx_receipt['transactionHash'])
-        tx_receipt['senderAddress'] = address(tx_receipt['senderAddress'])
-        tx_receipt['receiverAddress'] = address(tx_receipt['receiverAddress'])
-        tx_receipt['newAddress'] = address(tx_receipt['newAddress'])
-        tx_receipt['gasUsed'] = b64str_to_int(tx_receipt['gasUsed'])
-
-        if "logs" in tx_receipt:
-            for log in tx_receipt["logs"]:
-                log['address'] = address(log['address'])
-                topics = log['topics']
-                for j in range(len(topics)):
-                    topics[j] = hash(topics[j])
-
         print(json.dumps(tx_receipt, ensure_ascii=False, indent=3))
 
         return tx_receipt
@@ -401,13 +665,9 @@ class Tolar():
         data = {
             "address": a
         }
-        data = json.dumps(data)
-
-        p = self._run_cmd([grcmd, "-d", data, "-plaintext", self.server, self.services["GetNonce"]])
-        if p.returncode != 0:
-            print(f"There was an error: {p.stderr}")
+        out = self.call("GetNonce", data)
+        if out is None:
             return 0
-        out = json.loads(p.stdout)
         nonce_encoded = out["nonce"]
 
         nonce = b64str_to_int(nonce_encoded)
@@ -417,11 +677,9 @@ class Tolar():
     def get_latest_block(self):
         """Get Latest Block
         """
-        p = self._run_cmd([grcmd, "-plaintext", self.server, self.services["GetLatestBlock"]])
-        if p.returncode != 0:
-            print(f"There was an error: {p.stderr}")
+        out = self.call("GetLatestBlock")
+        if out is None:
             return
-        out = json.loads(p.stdout)
         print(f"{out}")
 
     def get_block_by_index(self, index: int):
@@ -434,23 +692,26 @@ class Tolar():
         data = {
             "block_index": index
         }
-        data = json.dumps(data)
-
-        p = self._run_cmd([grcmd, "-d", data, "-plaintext", self.server, self.services["GetBlockByIndex"]])
-        if p.returncode != 0:
-            print(f"There was an error: {p.stderr}")
+        out = self.call("GetBlockByIndex", data)
+        if out is None:
             return
-        out = json.loads(p.stdout)
         print(f"{out}")
 
+    def get_blocks(self, starting_index: int, number_of_blocks: int) -> Iterator[dict]:
+        """Get consecutive blocks with a single streaming call"""
+
+        data = {
+            "starting_block_index": starting_index,
+            "number_of_blocks": number_of_blocks
+        }
+        return self.stream("GetPaginatedBlocksByIndexStream", data)
+
     def list_balance_per_address(self):
         """List Balance Per Address
         """
-        p = self._run_cmd([grcmd, "-plaintext", self.server, self.services["ListBalancePerAddress"]])
-        if p.returncode != 0:
-            print(f"There was an error: {p.stderr}")
+        out = self.call("ListBalancePerAddress")
+        if out is None:
             return
-        out = json.loads(p.stdout)
         addresses = out["addresses"]
         for item in addresses:
             address = item["address"]
@@ -471,13 +732,9 @@ class Tolar():
         data = {
             "address": a
         }
-        data = json.dumps(data)
-
-        p = self._run_cmd([grcmd, "-d", data, "-plaintext", self.server, self.services["GetLatestBalance"]])
-        if p.returncode != 0:
-            print(f"There was an error: {p.stderr}")
+        out = self.call("GetLatestBalance", data)
+        if out is None:
             return
-        out = json.loads(p.stdout)
         balance = out["balance"]
 
         balance = b64str_to_int(balance)
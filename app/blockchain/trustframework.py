@@ -12,7 +12,6 @@ from eth_account import Account
 from eth_account.signers.local import LocalAccount
 from eth_keys.datatypes import PrivateKey, PublicKey
 import json
-import sqlite3
 from pprint import pprint
 from hexbytes import HexBytes
 from typing_extensions import Annotated
@@ -28,6 +27,9 @@ from pydantic import BaseModel, BaseSettings, ValidationError
 from blockchain import redt as b
 from blockchain import wallet
 
+from web3.exceptions import BadFunctionCallOutput, ContractLogicError
+from eth_abi.exceptions import DecodingError
+
 from ens.utils import label_to_hash, raw_name_to_hash
 
 try:
@@ -39,6 +41,7 @@ except ImportError:
 
 # The settings for the system
 from settings import settings
+from utils.db import get_connection
 
 # Initialize some global variables
 ENS = None
@@ -160,7 +163,7 @@ class DIDDocument:
         self.doc["updated"] = formatted_now
 
     # Create the Identity associated to the DIDDocument
-    def createIdentity(self, ens, resolver):
+    def createIdentity(self, ens, resolver, wait: bool = True):
 
         # Set the DID and DIDDocument
         print(json.dumps(self.doc, ensure_ascii=False, indent=3))
@@ -172,7 +175,8 @@ class DIDDocument:
             DIDDocument=json.dumps(self.doc, ensure_ascii=False, indent=3),
             active=True,
             new_owner_address=self.address,
-            caller_key=self.manager_account.key
+            caller_key=self.manager_account.key,
+            wait=wait
         )
         return success, tx_receipt, tx_hash
 
@@ -229,16 +233,16 @@ class ENS_class:
             contract_fun, current_owner_key)
         return success, tx_receipt, tx_hash
 
-    def setApprovalForAll(self, operator_address, approved, current_owner_key):
+    def setApprovalForAll(self, operator_address, approved, current_owner_key, wait=True):
 
         contract_fun = ENS.functions.setApprovalForAll(
             operator_address,
             approved)
         success, tx_receipt, tx_hash = b.send_signed_tx(
-            contract_fun, current_owner_key)
+            contract_fun, current_owner_key, wait=wait)
         return success, tx_receipt, tx_hash
 
-    def setResolver(self, node_name="root", resolver_address=None, current_owner_key=None):
+    def setResolver(self, node_name="root", resolver_address=None, current_owner_key=None, wait=True):
 
         if node_name == "root":
             node_hash = b.to_32byte_hex(0)
@@ -249,7 +253,7 @@ class ENS_class:
             node_hash,
             resolver_address)
         success, tx_receipt, tx_hash = b.send_signed_tx(
-            contract_fun, current_owner_key)
+            contract_fun, current_owner_key, wait=wait)
         return success, tx_receipt, tx_hash
 
     def numberSubnodes(self, node_name="root"):
@@ -262,6 +266,14 @@ class ENS_class:
         subnode = ENS.functions.subnode(node_hash, int(index)).call()
         return subnode
 
+    async def numberSubnodes_async(self, node_name="root"):
+        node_hash = raw_name_to_hash(node_name)
+        return await b.call_async(ENS.functions.numberSubnodes(node_hash))
+
+    async def subnode_async(self, node_name="root", index=0):
+        node_hash = raw_name_to_hash(node_name)
+        return await b.call_async(ENS.functions.subnode(node_hash, int(index)))
+
 # END: ENS
 ####################################################
 ####################################################
@@ -269,15 +281,22 @@ class ENS_class:
 ####################################################
 ####################################################
 # START: PUBLIC RESOLVER
+# The errors calling a view which does not exist in the deployed contract.
+# Not ValueError: web3 raises it for any error of the node, which may be transient
+MISSING_VIEW_ERRORS = (ContractLogicError, BadFunctionCallOutput, DecodingError)
+
 class PublicResolver_class:
 
     def __init__(self):
-        pass
+        # Whether the deployed PublicResolver has AlaDIDPublicEntityByDIDHash, to resolve DIDs in a
+        # single call. Contracts deployed before it was added need nodeFromDID and AlaDIDPublicEntity.
+        # It is None until checked with the node.
+        self.single_call = None
 
     def address(self):
         return PublicResolver.address
 
-    def setName(self, node_name="root", name_to_resolve="root", current_owner_key=None):
+    def setName(self, node_name="root", name_to_resolve="root", current_owner_key=None, wait=True):
 
         if node_name == "root":
             node_hash = b.to_32byte_hex(0)
@@ -288,7 +307,7 @@ class PublicResolver_class:
             node_hash,
             name_to_resolve)
         success, tx_receipt, tx_hash = b.send_signed_tx(
-            contract_fun, current_owner_key)
+            contract_fun, current_owner_key, wait=wait)
         return success, tx_receipt, tx_hash
 
     def name(self, node_name="root", node_hash=None):
@@ -389,7 +408,7 @@ class PublicResolver_class:
     def hash(self, text_to_hash):
         return(b.Web3.keccak(text=text_to_hash))
 
-    def setAlaDIDPublicEntity(self, node_name, label, DID, name, DIDDocument, active, new_owner_address, caller_key):
+    def setAlaDIDPublicEntity(self, node_name, label, DID, name, DIDDocument, active, new_owner_address, caller_key, wait=True):
 
         if node_name == "root":
             node_hash = b.to_32byte_hex(0)
@@ -411,7 +430,8 @@ class PublicResolver_class:
                 active,
                 new_owner_address,
             ),
-            caller_key
+            caller_key,
+            wait=wait
         )
 
         return success, tx_receipt, tx_hash
@@ -427,6 +447,23 @@ class PublicResolver_class:
         DIDHash, name, DIDDocument, active = PublicResolver.functions.AlaDIDPublicEntity(
             node_hash).call()
 
+        return self._checkDIDPublicEntity(DIDHash, name, DIDDocument, active)
+
+    async def AlaDIDPublicEntity_async(self, node_name="root", node_hash=None):
+
+        if node_hash is None:
+            if node_name == "root":
+                node_hash = b.to_32byte_hex(0)
+            else:
+                node_hash = raw_name_to_hash(node_name)
+
+        DIDHash, name, DIDDocument, active = await b.call_async(
+            PublicResolver.functions.AlaDIDPublicEntity(node_hash))
+
+        return self._checkDIDPublicEntity(DIDHash, name, DIDDocument, active)
+
+    def _checkDIDPublicEntity(self, DIDHash, name, DIDDocument, active):
+
         if DIDDocument == "":
             return None, None, None, None
 
@@ -439,33 +476,164 @@ class PublicResolver_class:
         else:
             return None, None, None, None
 
+    def _has_single_call_view(self) -> bool:
+        """Check the ABI of the PublicResolver. It does not say if the deployed contract has the view."""
+
+        if any(f.get("name") == "AlaDIDPublicEntityByDIDHash" for f in PublicResolver.abi):
+            return True
+
+        self.single_call = False
+        return False
+
+    def _single_call_checked(self, error: Exception = None):
+        if error is None:
+            self.single_call = True
+        else:
+            log.warning(f"The PublicResolver deployed can not resolve DIDs in a single call: {error}")
+            self.single_call = False
+
+    def canResolveInSingleCall(self) -> bool:
+        """Check once if the deployed PublicResolver has the view AlaDIDPublicEntityByDIDHash"""
+
+        if self.single_call is None and self._has_single_call_view():
+            try:
+                PublicResolver.functions.AlaDIDPublicEntityByDIDHash(b.to_32byte_hex(0)).call()
+                self._single_call_checked()
+            except MISSING_VIEW_ERRORS as e:
+                self._single_call_checked(e)
+            except Exception as e:
+                # The node failed: resolve with several calls this time, and check again in the next one
+                log.warning(f"Error checking if the PublicResolver can resolve DIDs in a single call: {e}")
+                return False
+
+        return self.single_call
+
+    async def canResolveInSingleCall_async(self) -> bool:
+        """Async version of canResolveInSingleCall"""
+
+        if self.single_call is None and self._has_single_call_view():
+            try:
+                await b.call_async(PublicResolver.functions.AlaDIDPublicEntityByDIDHash(b.to_32byte_hex(0)))
+                self._single_call_checked()
+            except MISSING_VIEW_ERRORS as e:
+                self._single_call_checked(e)
+            except Exception as e:
+                # The node failed: resolve with several calls this time, and check again in the next one
+                log.warning(f"Error checking if the PublicResolver can resolve DIDs in a single call: {e}")
+                return False
+
+        return self.single_call
+
     def resolveDID(self, _DID: str = None, _DIDHash: HexBytes = None) -> Tuple[str, str, Dict, bool]:
 
+        node_hash, DID, name, didDoc, active = self.resolveDIDNode(_DID, _DIDHash)
+        return DID, name, didDoc, active
+
+    def resolveDIDNode(self, _DID: str = None, _DIDHash: HexBytes = None) -> Tuple[HexBytes, str, str, Dict, bool]:
+        """The same as resolveDID, returning also the node of the DID in ENS, used to invalidate cached resolutions"""
+
         if _DID is not None:
 
             # Check that the DID is a string starting with "did:" and that it has some more characters (we accept ANY DID)
             if (not _DID.startswith("did:")) or (len(_DID) <= 4):
-                return None, None, None, False
+                return None, None, None, None, False
 
             # Calculate the hash of the DID
             _DIDHash = b.Web3.keccak(text=_DID)
 
-        # Get the node_hash associated to the DID. If the DID is wrong, we get the nil node_hash: bytes32(0)
-        node_hash = PublicResolver.functions.nodeFromDID(_DIDHash).call()
-        print(f"Node hash for DID {_DID}: {node_hash}")
+        if self.canResolveInSingleCall():
 
-        # Get the Entity Data associated to the node.
-        DID, name, didDoc, active = self.AlaDIDPublicEntity(
-            node_hash=node_hash)
+            # Get the node_hash and the Entity Data associated to the DID in a single call
+            node_hash, DIDHash, name, DIDDocument, active = PublicResolver.functions.AlaDIDPublicEntityByDIDHash(
+                _DIDHash).call()
+            DID, name, didDoc, active = self._checkDIDPublicEntity(DIDHash, name, DIDDocument, active)
+
+        else:
+
+            # Get the node_hash associated to the DID. If the DID is wrong, we get the nil node_hash: bytes32(0)
+            node_hash = PublicResolver.functions.nodeFromDID(_DIDHash).call()
+
+            # Get the Entity Data associated to the node.
+            DID, name, didDoc, active = self.AlaDIDPublicEntity(
+                node_hash=node_hash)
+
+        log.debug(f"Node hash for DID {_DID}: {node_hash}")
 
         if didDoc is None:
-            return None, None, None, False
+            return node_hash, None, None, None, False
 
         # Convert didDoc to python object
         didDoc = json.loads(didDoc)
 
+        return node_hash, DID, name, didDoc, active
+
+    async def resolveDID_async(self, _DID: str = None, _DIDHash: HexBytes = None) -> Tuple[str, str, Dict, bool]:
+        """The same as resolveDID, without blocking the event loop while asking the blockchain node"""
+
+        node_hash, DID, name, didDoc, active = await self.resolveDIDNode_async(_DID, _DIDHash)
         return DID, name, didDoc, active
 
+    async def resolveDIDNode_async(self, _DID: str = None, _DIDHash: HexBytes = None) -> Tuple[HexBytes, str, str, Dict, bool]:
+        """Async version of resolveDIDNode"""
+
+        if _DID is not None:
+
+            if (not _DID.startswith("did:")) or (len(_DID) <= 4):
+                return None, None, None, None, False
+
+            _DIDHash = b.Web3.keccak(text=_DID)
+
+        if await self.canResolveInSingleCall_async():
+            node_hash, DIDHash, name, DIDDocument, active = await b.call_async(
+                PublicResolver.functions.AlaDIDPublicEntityByDIDHash(_DIDHash))
+            DID, name, didDoc, active = self._checkDIDPublicEntity(DIDHash, name, DIDDocument, active)
+        else:
+            node_hash = await b.call_async(PublicResolver.functions.nodeFromDID(_DIDHash))
+            DID, name, didDoc, active = await self.AlaDIDPublicEntity_async(
+                node_hash=node_hash)
+
+        if didDoc is None:
+            return node_hash, None, None, None, False
+
+        didDoc = json.loads(didDoc)
+
+        return node_hash, DID, name, didDoc, active
+
+    async def resolveDIDNodes_async(self, DIDs: list) -> list:
+        """Resolve several DIDs like resolveDIDNode, with one batch of requests to the node
+        for all of them (or two batches, one for all the nodeFromDID calls and another one for
+        all the AlaDIDPublicEntity calls, if the PublicResolver can not resolve in a single call).
+        The results are in the same order as the DIDs.
+        """
+
+        results = [(None, None, None, None, False)] * len(DIDs)
+
+        # Only the well formed DIDs are asked to the blockchain
+        valid = [i for i, DID in enumerate(DIDs) if DID.startswith("did:") and len(DID) > 4]
+
+        if await self.canResolveInSingleCall_async():
+            resolutions = await b.batch_call_async([
+                PublicResolver.functions.AlaDIDPublicEntityByDIDHash(b.Web3.keccak(text=DIDs[i])) for i in valid
+            ])
+            node_hashes = [resolution[0] for resolution in resolutions]
+            entities = [resolution[1:] for resolution in resolutions]
+        else:
+            node_hashes = await b.batch_call_async([
+                PublicResolver.functions.nodeFromDID(b.Web3.keccak(text=DIDs[i])) for i in valid
+            ])
+            entities = await b.batch_call_async([
+                PublicResolver.functions.AlaDIDPublicEntity(node_hash) for node_hash in node_hashes
+            ])
+
+        for i, node_hash, entity in zip(valid, node_hashes, entities):
+            DID, name, didDoc, active = self._checkDIDPublicEntity(*entity)
+            if didDoc is None:
+                results[i] = (node_hash, None, None, None, False)
+            else:
+                results[i] = (node_hash, DID, name, json.loads(didDoc), active)
+
+        return results
+
     def setAlaDIDDocument(self, _DID, DIDDocument, caller_key):
 
         # Check that the DID is a string starting with "did:" and that it has some more characters (we accept ANY DID)
@@ -628,37 +796,45 @@ def m_dump_tf():
     ROOT_address, ROOT_key = wallet.account_from_name("ROOT", "ThePassword")
     print(f"ROOT address from wallet: {ROOT_address}")
 
+    # The records of all the subnodes are read together, with a few round trips to the node
     n_subnodes = ens.numberSubnodes(0)
     print(f"Number of subnodes of root: {n_subnodes}")
-    for i in range(n_subnodes):
-        hash = ens.subnode(index=i).hex()
-        print(f"   Subnode hash {i}: {ens.subnode(i).hex()}")
-        name = resolver.name(node_hash=hash)
-        print(f"   Name: {name}")
-        resolver_address = ENS.functions.resolver(hash).call()
-        print(f"   Resolver: {resolver_address}")
-        ala_address = ens.resolver(name)
-        print(f"   Resolver by name: {ala_address}")
-        owner = owner = ENS.functions.owner(hash).call()
-        print(f"   Owner: {owner}")
-        ROOT_address, ROOT_key = wallet.account_from_name("Alastria", "ThePassword")
-        print(f"   Address from wallet: {ROOT_address}")
+    ROOT_address, ROOT_key = wallet.account_from_name("Alastria", "ThePassword")
+    name = dump_subnodes(raw_name_to_hash("root"), n_subnodes, ROOT_address)
 
     n_subnodes = ens.numberSubnodes("ala")
     print(f"Number of subnodes of {name}: {n_subnodes}")
-    for i in range(n_subnodes):
-        hash = ens.subnode(node_name="ala", index=i).hex()
+    dump_subnodes(raw_name_to_hash("ala"), n_subnodes)
+
+def dump_subnodes(node_hash, n_subnodes: int, wallet_address: str = None) -> str:
+    """Display the name, resolver and owner of the subnodes of a node. Returns the last name."""
+
+    hashes = [subnode.hex() for subnode in b.batch_call(
+        [ENS.functions.subnode(node_hash, i) for i in range(n_subnodes)])]
+
+    records = b.batch_call(
+        [f for hash in hashes for f in (
+            PublicResolver.functions.name(hash),
+            ENS.functions.resolver(hash),
+            ENS.functions.owner(hash))])
+    names = records[0::3]
+
+    # The resolver of each node by its name
+    resolvers_by_name = b.batch_call(
+        [ENS.functions.resolver(b.to_32byte_hex(0) if name == "root" else raw_name_to_hash(name)) for name in names])
+
+    name = None
+    for i, hash in enumerate(hashes):
+        name = names[i]
         print(f"   Subnode hash {i}: {hash}")
-        name = resolver.name(node_hash=hash)
         print(f"   Name: {name}")
-        resolver_address = ENS.functions.resolver(hash).call()
-        print(f"   Resolver: {resolver_address}")
-        ala_address = ens.resolver(name)
-        print(f"   Resolver by name: {ala_address}")
-        owner = owner = ENS.functions.owner(hash).call()
-        print(f"   Owner: {owner}")
-
+        print(f"   Resolver: {records[3*i + 1]}")
+        print(f"   Resolver by name: {resolvers_by_name[i]}")
+        print(f"   Owner: {records[3*i + 2]}")
+        if wallet_address is not None:
+            print(f"   Address from wallet: {wallet_address}")
 
+    return name
 
 
 def m_create_test_identities():
@@ -865,12 +1041,16 @@ def create_identity_subnode(
     }
     didDoc.addService(service)
 
-    # Store the info in the blockchain trust framework
-    success, tx_receipt, tx_hash = didDoc.createIdentity(ens, resolver)
+    # Store the info in the blockchain trust framework.
+    # Both transactions are independent, so we send them back-to-back and then wait for the receipts
+    _, _, identity_tx_hash = didDoc.createIdentity(ens, resolver, wait=False)
+    _, _, approval_tx_hash = ens.setApprovalForAll(resolver.address(), True, subnode_account.key, wait=False)
+
+    success, tx_receipt, tx_hash = b.wait_for_tx(identity_tx_hash, address=Manager_account.address)
     if not success:
         return "Failed to create identity in blockchain", None
 
-    success, tx_receipt, tx_hash = ens.setApprovalForAll(resolver.address(), True, subnode_account.key)
+    success, tx_receipt, tx_hash = b.wait_for_tx(approval_tx_hash, address=subnode_account.address)
     if not success:
         return "Failed in setApprovalForAll", None
 
@@ -927,12 +1107,16 @@ def create_identity(did: str, domain_name: str, website: str, commercial_name: s
     }
     didDoc.addService(service)
 
-    # Store the info in the blockchain trust framework
-    success, tx_receipt, tx_hash = didDoc.createIdentity(ens, resolver)
+    # Store the info in the blockchain trust framework.
+    # Both transactions are independent, so we send them back-to-back and then wait for the receipts
+    _, _, identity_tx_hash = didDoc.createIdentity(ens, resolver, wait=False)
+    _, _, approval_tx_hash = ens.setApprovalForAll(resolver.address(), True, account.key, wait=False)
+
+    success, tx_receipt, tx_hash = b.wait_for_tx(identity_tx_hash, address=Manager_account.address)
     if not success:
         return "Failed to create identity in blockchain", None
 
-    success, tx_receipt, tx_hash = ens.setApprovalForAll(resolver.address(), True, account.key)
+    success, tx_receipt, tx_hash = b.wait_for_tx(approval_tx_hash, address=account.address)
     if not success:
         return "Failed in setApprovalForAll", None
 
@@ -961,24 +1145,45 @@ def m_create_identity(DID, domain_name, website, commercial_name, parent_node_ac
     print(f"Created")
 
 
-def dump_trusted_identities():
+def dump_trusted_identities(node_name: str = "ala"):
     """Returns all Identities in the system depending from the ala node
     """
 
-    node_name = "ala"
+    node_hash = raw_name_to_hash(node_name)
 
     numberSubnodes = ens.numberSubnodes(node_name)
-    id_list = []
 
-    # Iterate for each node
-    for i in range(numberSubnodes):
+    # Get all the subnodes (in name_hash format), and then the data for all of them,
+    # each step in a single round trip to the node
+    subnode_hashes = b.batch_call(
+        [ENS.functions.subnode(node_hash, i) for i in range(numberSubnodes)])
+    entities = b.batch_call(
+        [PublicResolver.functions.AlaDIDPublicEntity(subnode_hash) for subnode_hash in subnode_hashes])
 
-        # Get the subnode (in name_hash format)
-        subnode_hash = ens.subnode(node_name, i)
+    return trusted_identities(subnode_hashes, entities)
 
-        # Get the data for the subnode
-        DID, name, DIDDocument, active = resolver.AlaDIDPublicEntity(
-            node_hash=subnode_hash)
+async def dump_trusted_identities_async(node_name: str = "ala"):
+    """The same as dump_trusted_identities, without blocking the event loop
+    """
+
+    node_hash = raw_name_to_hash(node_name)
+
+    numberSubnodes = await ens.numberSubnodes_async(node_name)
+
+    subnode_hashes = await b.batch_call_async(
+        [ENS.functions.subnode(node_hash, i) for i in range(numberSubnodes)])
+    entities = await b.batch_call_async(
+        [PublicResolver.functions.AlaDIDPublicEntity(subnode_hash) for subnode_hash in subnode_hashes])
+
+    return trusted_identities(subnode_hashes, entities)
+
+def trusted_identities(subnode_hashes: list, entities: list) -> list:
+
+    id_list = []
+    for subnode_hash, entity in zip(subnode_hashes, entities):
+
+        # Check the data for the subnode
+        DID, name, DIDDocument, active = resolver._checkDIDPublicEntity(*entity)
 
         identity = {
             "DID": DID,
@@ -986,7 +1191,7 @@ def dump_trusted_identities():
             "node_hash": subnode_hash.hex()
         }
         id_list.append(identity)
-        
+
     return id_list
 
 def m_dump_identities(node_name):
@@ -1183,10 +1388,21 @@ def m_credential_display(node_name, key):
     print(f"Credential hash: {credentialHash}")
     print(f"Number of participants: {numParticipants}")
 
-    for i in range(numParticipants):
-        DIDHash, signed = resolver.credentialParticipant(
-            node_name=node_name, key=key, index=i)
-        DID, name, DIDDocument, active = resolver.resolveDID(_DIDHash=DIDHash)
+    if node_name == "root":
+        node_hash = b.to_32byte_hex(0)
+    else:
+        node_hash = raw_name_to_hash(node_name)
+
+    # Get all the participants, their nodes and their entity data, each step in a single round trip
+    participants = b.batch_call(
+        [PublicResolver.functions.credentialParticipant(node_hash, key, i) for i in range(numParticipants)])
+    nodes = b.batch_call(
+        [PublicResolver.functions.nodeFromDID(DIDHash) for DIDHash, signed in participants])
+    entities = b.batch_call(
+        [PublicResolver.functions.AlaDIDPublicEntity(participant_node) for participant_node in nodes])
+
+    for (DIDHash, signed), entity in zip(participants, entities):
+        DID, name, DIDDocument, active = resolver._checkDIDPublicEntity(*entity)
 
         print(f"\n    DID: {DID}")
         print(f"    Name: {name}")
@@ -1275,6 +1491,7 @@ def connect_blockchain(provider=settings.BLOCKCHAIN_NODE_IP):
     # The path to the contracts deployment artifacts
     ENSRegistry_full_path = os.path.join(settings.CONTRACTS_OUTPUT_DIR, "ENSRegistry")
     PublicResolver_full_path = os.path.join(settings.CONTRACTS_OUTPUT_DIR, "PublicResolver")
+    Multicall_full_path = os.path.join(settings.CONTRACTS_OUTPUT_DIR, "Multicall")
 
     # Bind the ENS and Resolver contracts
     global ENS
@@ -1284,6 +1501,9 @@ def connect_blockchain(provider=settings.BLOCKCHAIN_NODE_IP):
     ENS = b.bind_contract(ENSRegistry_full_path)
     PublicResolver = b.bind_contract(PublicResolver_full_path)
 
+    # Reads of many records are aggregated with Multicall, if it has been deployed
+    b.bind_multicall(Multicall_full_path)
+
     # Initialize the high-level contract classes
     ens = ENS_class()
     resolver = PublicResolver_class()
@@ -1294,9 +1514,7 @@ def connect_blockchain(provider=settings.BLOCKCHAIN_NODE_IP):
 
 def get_db():
     db_name = os.path.join(settings.DATABASE_DIR, "pubcred_config.sqlite")
-    db = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-    db.row_factory = sqlite3.Row
-    return db
+    return get_connection(db_name)
 
 
 def m_setName(node_name="root", name_to_resolve="root", current_owner_alias="ROOT"):
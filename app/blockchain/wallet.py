@@ -1,17 +1,22 @@
 import os
-import sqlite3
+import copy
 import json
+import time
+import hmac
+import hashlib
+import threading
 from hexbytes import HexBytes
 from eth_account import Account
 from eth_account.signers.local import LocalAccount
 from eth_keys.datatypes import PrivateKey, PublicKey
 from jwcrypto.jwk import JWK
 from pydantic import BaseModel
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple
 from jwcrypto import jwt, jwk, jws
 from jwcrypto.common import base64url_decode, base64url_encode
 
 from settings import settings
+from utils.db import get_connection, transaction
 
 DATABASE_FILE = "wallet.sqlite"
 
@@ -30,9 +35,110 @@ CREATE TABLE testaccount (
 """
 
 def get_wallet_db():
-    db = sqlite3.connect(DATABASE_NAME, detect_types=sqlite3.PARSE_DECLTYPES)
-    db.row_factory = sqlite3.Row
-    return db
+    return get_connection(DATABASE_NAME)
+
+############################################################
+# START: Signer registry
+
+class UnlockedSigner:
+    """An account unlocked with its password, kept in memory until it expires.
+    The account object is private to the registry: callers get their own copy of it.
+    """
+
+    def __init__(self, account: LocalAccount, password_digest: bytes, expires: float) -> None:
+        self.account = account
+        self.password_digest = password_digest
+        self.expires = expires
+
+    def wipe(self):
+        """Remove the private key from the account object of the registry.
+        Python bytes are immutable, so we zero the references instead of the memory itself.
+        The copies given to the callers are not modified, and are released when they are done.
+        """
+        self.account._private_key = bytes(32)
+        self.account._key_obj = None
+        self.account = None
+
+
+class SignerRegistry:
+    """Keeps in memory the accounts already unlocked, so the (deliberately slow) decryption
+    of the keystore runs only once per account and not on every signature.
+    Accounts are unlocked on first use (or explicitly at startup) and evicted after ttl seconds.
+    A ttl of 0 means that accounts never expire.
+    """
+
+    def __init__(self, ttl: int = 3600) -> None:
+        self.ttl = ttl
+        self.signers: Dict[str, UnlockedSigner] = {}
+        self.lock = threading.Lock()
+        # Random salt for the digests of the passwords, which are never kept in memory
+        self.salt = os.urandom(32)
+
+    def _digest(self, password: str) -> bytes:
+        return hmac.new(self.salt, bytes(password, "utf-8"), hashlib.sha256).digest()
+
+    def get(self, account_name: str, password: str) -> Optional[LocalAccount]:
+        """Get a copy of the unlocked account, decrypting it from the wallet only if it is not in memory.
+        Returns None if the account does not exist, and raises ValueError if the password is wrong.
+        """
+
+        digest = self._digest(password)
+        now = time.monotonic()
+
+        with self.lock:
+            self._evict_expired(now)
+            signer = self.signers.get(account_name)
+            if signer is not None and hmac.compare_digest(signer.password_digest, digest):
+                return copy.copy(signer.account)
+
+        db = get_wallet_db()
+        acc = db.execute(
+            'SELECT privatekey FROM testaccount WHERE name = ?', (account_name,)
+        ).fetchone()
+        if acc is None:
+            return None
+
+        # This is the slow part
+        private_key = Account.decrypt(acc["privatekey"], password)
+        eth_acc = Account.from_key(private_key)
+
+        expires = now + self.ttl if self.ttl > 0 else float("inf")
+        with self.lock:
+            old = self.signers.get(account_name)
+            self.signers[account_name] = UnlockedSigner(eth_acc, digest, expires)
+        if old is not None:
+            old.wipe()
+
+        return copy.copy(eth_acc)
+
+    def unlock(self, account_name: str, password: str) -> bool:
+        """Unlock the account in advance, for example at startup"""
+        return self.get(account_name, password) is not None
+
+    def evict(self, account_name: str):
+        """Forget the unlocked account, for example because its key has changed"""
+        with self.lock:
+            signer = self.signers.pop(account_name, None)
+        if signer is not None:
+            signer.wipe()
+
+    def clear(self):
+        with self.lock:
+            signers = list(self.signers.values())
+            self.signers = {}
+        for signer in signers:
+            signer.wipe()
+
+    def _evict_expired(self, now: float):
+        expired = [name for name, signer in self.signers.items() if signer.expires <= now]
+        for name in expired:
+            self.signers.pop(name).wipe()
+
+# The accounts unlocked by this process
+signer_registry = SignerRegistry(settings.SIGNER_TTL)
+
+# END: Signer registry
+############################################################
 
 def erase_wallet_db():
     """WARNING !!! Erases ALL wallet accounts.
@@ -46,6 +152,7 @@ def erase_wallet_db():
     # Erase and create the table from scratch
     print(f"\n==> Creating the database schema")
     db.executescript(accounts_schema)
+    signer_registry.clear()
     print(f"Database schema created")
 
     return db
@@ -64,12 +171,13 @@ def create_and_save_account(account_name, password):
     key_encrypted = json.dumps(key_encrypted)
 
     print(f"Saving {address} and its private key in database)")
-    db.execute(
-        'REPLACE INTO testaccount (name, address, publickey, privatekey) VALUES (?, ?, ?, ?)',
-        (account_name, address, publicKey, key_encrypted)
-    )
-    # Commit database, just in case
-    db.commit()
+    # Commit database, or roll back if it fails
+    with transaction(db):
+        db.execute(
+            'REPLACE INTO testaccount (name, address, publickey, privatekey) VALUES (?, ?, ?, ?)',
+            (account_name, address, publicKey, key_encrypted)
+        )
+    signer_registry.evict(account_name)
 
     # Return account to caller
     return acc
@@ -77,18 +185,11 @@ def create_and_save_account(account_name, password):
 
 def account_from_name(name, password):
     """Get the account with the specified name."""
-    db = get_wallet_db()
-
-    account = db.execute(
-        'SELECT * FROM testaccount WHERE name = ?', (name,)
-    ).fetchone()
-
-    if account is None:
+    eth_acc = signer_registry.get(name, password)
+    if eth_acc is None:
         return None, None
 
-    private_key = Account.decrypt(account["privatekey"], password)
-
-    return account["address"], private_key
+    return eth_acc.address, eth_acc.key
 
 def account_from_address(address):
     """Get the account with the specified address."""
@@ -157,18 +258,8 @@ def account(account_name: str, password: str) -> LocalAccount:
     if len(account_name) == 0 or len(password) == 0:
         return None
 
-    db = get_wallet_db()
-
-    acc = db.execute(
-        'SELECT * FROM testaccount WHERE name = ?', (account_name,)
-    ).fetchone()
-
-    if acc is None:
-        return None
-
-    # Attemp to decrypt with the provided password
-    pk = Account.decrypt(acc["privatekey"], password)
-    eth_acc = Account.from_key(pk)
+    # Attemp to decrypt with the provided password, if not already unlocked
+    eth_acc = signer_registry.get(account_name, password)
 
     return eth_acc
 
@@ -202,12 +293,13 @@ def new_account(account_name: str, password: str, overwrite: bool = False) -> Lo
     key_encrypted = eth_acc.encrypt(password)
     key_encrypted = json.dumps(key_encrypted)
 
-    db.execute(
-        'REPLACE INTO testaccount (name, address, publickey, privatekey) VALUES (?, ?, ?, ?)',
-        (account_name, address, publicKey.to_hex(), key_encrypted)
-    )
-    # Commit database
-    db.commit()
+    # Commit database, or roll back if it fails
+    with transaction(db):
+        db.execute(
+            'REPLACE INTO testaccount (name, address, publickey, privatekey) VALUES (?, ?, ?, ?)',
+            (account_name, address, publicKey.to_hex(), key_encrypted)
+        )
+    signer_registry.evict(account_name)
 
     # Return account data to caller
     return eth_acc
@@ -237,12 +329,13 @@ def create_account(account_name, password, overwrite=False):
     key_encrypted = acc.encrypt(password)
     key_encrypted = json.dumps(key_encrypted)
 
-    db.execute(
-        'REPLACE INTO testaccount (name, address, publickey, privatekey) VALUES (?, ?, ?, ?)',
-        (account_name, address, publicKey, key_encrypted)
-    )
-    # Commit database
-    db.commit()
+    # Commit database, or roll back if it fails
+    with transaction(db):
+        db.execute(
+            'REPLACE INTO testaccount (name, address, publickey, privatekey) VALUES (?, ?, ?, ?)',
+            (account_name, address, publicKey, key_encrypted)
+        )
+    signer_registry.evict(account_name)
 
     # Return account to caller
     return acc
@@ -290,7 +383,7 @@ def get_address(account_name, password=""):
 
     # Attemp to decrypt with the provided password
     if len(password) > 0:
-        pk = Account.decrypt(account["privatekey"], password).hex()
+        pk = signer_registry.get(account_name, password).key.hex()
         return {"address": account["address"], "publicKey": account["publickey"], "privateKey": pk}
     else:
         return {"address": account["address"], "publicKey": account["publickey"]}
@@ -348,19 +441,14 @@ def key_JWK(account_name, password):
     if password is None:
         return None
 
-    db = get_wallet_db()
-
-    account = db.execute(
-        'SELECT * FROM testaccount WHERE name = ?', (account_name,)
-    ).fetchone()
+    # Attempt to decrypt the private key with the password (if not already unlocked)
+    acc = signer_registry.get(account_name, password)
 
     # Check if account_name was in the database
-    if account is None:
+    if acc is None:
         return None
 
-    # Attempt to decrypt the private key with the password and derive the public key
-    private_key = Account.decrypt(account["privatekey"], password)
-    acc = Account.from_key(private_key)
+    # Derive the public key
     publicKey = PublicKey.from_private(acc._key_obj)
 
     # The public key is 64 bytes composed of the x and y curve coordinates
@@ -389,17 +477,8 @@ def get_account(account_name, password):
     {"name": "password", "prompt": "Password to decrypt private key", "default": "Mypassword"}
     """
 
-    db = get_wallet_db()
-
-    account = db.execute(
-        'SELECT * FROM testaccount WHERE name = ?', (account_name,)
-    ).fetchone()
-
-    if account is None:
-        return None
-
-    private_key = Account.decrypt(account["privatekey"], password)
-    acc = Account.from_key(private_key)
+    # The account is decrypted only the first time, or after it expires
+    acc = signer_registry.get(account_name, password)
 
     return acc
 
@@ -14,6 +14,7 @@ from settings import settings
 
 # Acces to the bockchain
 from blockchain import trustframework as tf
+from blockchain import didcache, issuerregistry
 
 # Create logger
 logging.basicConfig(
@@ -70,9 +71,9 @@ async def startup_event():
 
     log.info("######### Configuration values #########")
     if settings.PRODUCTION:
-        log.info(f"Running in PRODUCTION")
+        log.info("Running in PRODUCTION")
     else:
-        log.info(f"Running in DEVELOPMENT")
+        log.info("Running in DEVELOPMENT")
     log.info(f"Current directory: {settings.INITIAL_DIR}")
     log.info(f"SmartContract source dir: {settings.CONTRACTS_DIR}")
     log.info(f"SmartContract binary dir: {settings.CONTRACTS_OUTPUT_DIR}")
@@ -80,7 +81,15 @@ async def startup_event():
     log.info(f"Database Dir: {settings.DATABASE_DIR}")
     
     tf.connect_blockchain(settings.BLOCKCHAIN_NODE_IP)
-    log.info(f"Connected to the blockchain provider")
+    log.info("Connected to the blockchain provider")
+
+    if settings.DIDCACHE_EVENT_WATCHER:
+        didcache.start_event_watcher()
+        log.info("Watching changes of DID Documents")
+
+    if settings.ISSUERS_REGISTRY:
+        issuerregistry.start_registry()
+        log.info("Building the registry of trusted issuers")
 
     log.info("########################################")
 
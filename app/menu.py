@@ -54,6 +54,7 @@ def main_menu():
         ("Deploy the FIWARE Canis Major Smart Contracts", invoke, {"operation":compile.m_deploy_canis_major}),
         ("Compile the Standard Smart Contracts", invoke, {"operation":compile.m_compile}),
         ("Deploy the Standard Smart Contracts", invoke, {"operation":compile.m_deploy}),
+        ("Deploy the Multicall Smart Contract", invoke, {"operation":compile.m_deploy_multicall}),
     ])
 
     
@@ -1,14 +1,16 @@
 # Standard python library
 import json
 import logging
+import orjson
 
 # The Fastapi web server
-from fastapi import status, HTTPException, Body, Request, Depends, Header
+from fastapi import status, HTTPException, Body, Request, Response, Depends, Header, Query
 from fastapi import APIRouter
-from fastapi.responses import ORJSONResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 # For the data models
-from typing import Dict, Optional, cast
+from typing import Dict, List, Optional, cast
 from pydantic import BaseModel, BaseSettings
 
 # The settings for the system
@@ -16,10 +18,7 @@ from settings import settings
 
 from blockchain import canismajor
 
-from utils.que import FIFOFile
-
-# Create a persistent FIFO queue, using the default file name
-f = FIFOFile(truncate=True)
+from utils.que import FullError
 
 # Create logger
 logging.basicConfig(
@@ -29,6 +28,17 @@ log = logging.getLogger(__name__)
 # Create the timestamping table, only if it does not exists
 canismajor.create_db()
 
+# Decrypt the signing key only once
+canismajor.unlock_owner_account()
+
+# Start the background anchoring of entities received asynchronously
+if settings.CANISMAJOR_ASYNC_INGESTION:
+    canismajor.start_async_ingestion()
+
+# Start indexing the Timestamp events, used to verify entities locally
+if settings.CANISMAJOR_EVENT_INDEXER:
+    canismajor.start_event_indexer()
+
 router = APIRouter()
 
 def error_object(error_type: str, error_title: str = "", error_detail: str = "") -> dict:
@@ -41,18 +51,60 @@ def error_object(error_type: str, error_title: str = "", error_detail: str = "")
 def check_request_requirements():
     pass
 
+async def timestamp_entity(msg: dict, response: Response, hashes=None) -> dict:
+    """Timestamp the entity, waiting until it is anchored in the blockchain.
+    With asynchronous ingestion, the entity is accepted as soon as it is durably
+    stored, and we reply with a ticket instead of the receipt.
+    """
+
+    if settings.CANISMAJOR_ASYNC_INGESTION:
+        try:
+            # Hashing and the fsyncs of the database and the log are done in a thread
+            ticket = await run_in_threadpool(canismajor.timestamp_async, msg["id"], msg, hashes)
+        except FullError as e:
+            detail = "Too many entities pending to be anchored"
+            log.error(detail)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=detail)
+
+        # The same entity may have been anchored before, and then we already have the receipt
+        if ticket.get("status") == "pending":
+            response.status_code = status.HTTP_202_ACCEPTED
+        return ticket
+
+    try:
+        receipt = await canismajor.timestamp_wait_async(msg["id"], msg, hashes)
+    except TimeoutError as e:
+        detail = str(e)
+        log.error(detail)
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=detail)
+
+    return receipt
+
 ######################################################
 # FIWARE Canis Major APIs
 ######################################################
 
+# Pagination of the list of entities
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 1000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
 link_object = 'Link: <https://json-ld.org/contexts/person.jsonld>; rel="http://www.w3.org/ns/json-ld#context"; type="application/ld+json'
 
+# The handlers waiting for the blockchain are async, so a request waiting for its entity to be
+# anchored does not take a thread. The ones which only read the local database are plain
+# functions, run in the thread pool. The async handlers also run their database work (and the
+# hashing of entities) in the thread pool, never in the event loop.
+
 
 @router.post("/ngsi-ld/v1/entities",
     response_class=ORJSONResponse,
     status_code=201,
     tags=["NGSI-LD Entity List"])
-def entity_creation(
+async def entity_creation(
+    response: Response,
     Link: Optional[str] = Header(None),
     msg: dict = Body(
         ...,
@@ -113,17 +165,172 @@ def entity_creation(
         )
 
     # Register and timestamp the received message in the blockchain
-    receipt = canismajor.timestamp(msg["id"], msg)
+    receipt = await timestamp_entity(msg, response)
 
     return receipt
 
+async def batch_operation(entities: List[dict], response: Response, create_only: bool) -> dict:
+    """Timestamp a list of entities, anchoring them together.
+    Returns a BatchOperationResult, with the receipt (or ticket) of each entity in "results".
+    """
+
+    results = []
+    valid = []
+
+    # Entities already stamped can not be created again
+    existing = set()
+    if create_only:
+        existing = await run_in_threadpool(
+            canismajor.existing_entities, [e["id"] for e in entities if isinstance(e, dict) and "id" in e])
+
+    for entity in entities:
+        if not isinstance(entity, dict) or ("id" not in entity) or ("type" not in entity):
+            results.append({"error": error_object(
+                "https://uri.etsi.org/ngsi-ld/errors/BadRequestData",
+                "Bad request data",
+                "Missing id or type fields"
+            )})
+        elif entity["id"] in existing:
+            results.append({"id": entity["id"], "error": error_object(
+                "https://uri.etsi.org/ngsi-ld/errors/AlreadyExists",
+                "Already exists",
+                f"Entity {entity['id']} already exists"
+            )})
+        else:
+            results.append({"id": entity["id"]})
+            valid.append((entity, results[-1]))
+
+    if settings.CANISMAJOR_ASYNC_INGESTION:
+        # Accept the entities to be anchored in the background, storing them from a thread of the pool
+        def accept_all():
+            for entity, result in valid:
+                try:
+                    result.update(canismajor.timestamp_async(entity["id"], entity))
+                except FullError:
+                    result["error"] = error_object(
+                        "https://uri.etsi.org/ngsi-ld/errors/InternalError",
+                        "Service unavailable",
+                        "Too many entities pending to be anchored"
+                    )
+
+        await run_in_threadpool(accept_all)
+    else:
+        # Hash all entities in one pass and anchor them together
+        # The transactions are sent from this request, in a thread of the pool
+        items = await run_in_threadpool(canismajor.timestamp_many, [entity for entity, result in valid])
+        for (entity, result), item in zip(valid, items):
+            if item.error is not None:
+                result["error"] = error_object(
+                    "https://uri.etsi.org/ngsi-ld/errors/InternalError",
+                    "Anchoring failed",
+                    str(item.error)
+                )
+            elif item.ticket is not None:
+                # The same entity was already accepted and is pending to be anchored
+                result["status"] = "pending"
+                result["ticket"] = item.ticket
+            else:
+                result["status"] = "anchored"
+                result["receipt"] = item.receipt
+
+    batch_result = {
+        "success": [r["id"] for r in results if "error" not in r],
+        "errors": [{"entityId": r.get("id"), "error": r["error"]} for r in results if "error" in r],
+        "results": results
+    }
+
+    if len(batch_result["errors"]) > 0:
+        response.status_code = status.HTTP_207_MULTI_STATUS
+    elif settings.CANISMAJOR_ASYNC_INGESTION:
+        response.status_code = status.HTTP_202_ACCEPTED
+
+    return batch_result
+
+@router.post("/ngsi-ld/v1/entityOperations/create",
+    response_class=ORJSONResponse,
+    status_code=201,
+    tags=["NGSI-LD Batch Operations"])
+async def batch_entity_creation(
+    response: Response,
+    entities: List[dict] = Body(...)
+):
+    """Register the hashes of a list of new entities, anchoring all of them together.
+    Entities which were already registered are reported as errors.
+    """
+    return await batch_operation(entities, response, create_only=True)
+
+@router.post("/ngsi-ld/v1/entityOperations/upsert",
+    response_class=ORJSONResponse,
+    status_code=201,
+    tags=["NGSI-LD Batch Operations"])
+async def batch_entity_upsert(
+    response: Response,
+    entities: List[dict] = Body(...)
+):
+    """Register the hashes of a list of entities, new or new versions of existing ones,
+    anchoring all of them together.
+    """
+    return await batch_operation(entities, response, create_only=False)
+
 @router.get("/ngsi-ld/v1/entities",
     response_class=ORJSONResponse,
     tags=["NGSI-LD Entity List"])
-def query_entities():
-    """List all entities.
+def query_entities(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=0),
+    offset: int = Query(0, ge=0),
+    count: bool = False,
+    cursor: Optional[int] = None,
+    type: Optional[str] = None,
+    Accept: Optional[str] = Header(None)
+):
+    """List the stamped entities, in the order they were stamped, one page at a time.
+    For deep pages, use the cursor in the "next" Link header instead of offset.
+    With "Accept: application/x-ndjson" the entities are streamed, one JSON object per line.
+    With limit=0 and count=true, only the number of entities is returned, in the NGSILD-Results-Count header.
     """
-    items = canismajor.list_all()
+
+    # Only the count, as in NGSI-LD. Without count there would be nothing to return
+    if limit == 0:
+        if not count:
+            detail = "Limit 0 is only allowed with count=true"
+            log.error(detail)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+        response.headers["NGSILD-Results-Count"] = str(canismajor.count_items(type))
+        return []
+
+    # Stream all the entities (or up to limit) in NDJSON format
+    if Accept is not None and NDJSON_MEDIA_TYPE in Accept:
+        headers = {}
+        if count:
+            headers["NGSILD-Results-Count"] = str(canismajor.count_items(type))
+        items = canismajor.iter_items(cursor, type, limit)
+        return StreamingResponse(
+            (orjson.dumps(item) + b"\n" for item in items),
+            media_type=NDJSON_MEDIA_TYPE,
+            headers=headers
+        )
+
+    if limit is None:
+        limit = DEFAULT_PAGE_SIZE
+    if limit > MAX_PAGE_SIZE:
+        detail = f"Limit can not be greater than {MAX_PAGE_SIZE}"
+        log.error(detail)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+    items = canismajor.query_items(limit, offset, cursor, type)
+
+    if count:
+        response.headers["NGSILD-Results-Count"] = str(canismajor.count_items(type))
+
+    # Link to the next page, if there may be more entities
+    if len(items) == limit:
+        next_url = request.url.remove_query_params("offset").include_query_params(cursor=items[-1]["version"])
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+
     return items
 
 
@@ -131,11 +338,25 @@ def query_entities():
     response_class=ORJSONResponse,
     tags=["NGSI-LD Entity by ID"])
 def entity_retrieval_by_id(entityId: str):
-    """List one entity.
+    """List one entity, with its receipt or its status if it is still pending to be anchored.
     """
     item = canismajor.list_one_item(entityId)
     return item
 
+@router.get("/ngsi-ld/v1/entities/{entityId}/history",
+    response_class=ORJSONResponse,
+    tags=["NGSI-LD Entity by ID"])
+def entity_history_by_id(
+    entityId: str,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[int] = None
+):
+    """List the versions of one entity with their receipts, newest first.
+    To get the next page, pass as cursor the "next" field of the previous page.
+    """
+    history = canismajor.list_item_history(entityId, limit, cursor)
+    return history
+
 @router.delete("/ngsi-ld/v1/entities/{entityId}",
     response_class=ORJSONResponse,
     tags=["NGSI-LD Entity by ID"])
@@ -144,39 +365,127 @@ def entity_delete_by_id(entityId: str):
     """
     return {"message": "Not yet implemented"}
 
+async def modify_attributes(entityId: str, attributes: dict, response: Response, append: bool, overwrite: bool = True) -> dict:
+    """Timestamp a new version of the entity with the attributes modified.
+    Returns an UpdateResult, with the receipt (or ticket) of the new version.
+    """
+
+    # Reading the latest version and hashing the new attributes are done in a thread
+    result = await run_in_threadpool(canismajor.update_attributes, entityId, attributes, append, overwrite)
+    if result is None:
+        detail = f"Entity {entityId} not found"
+        log.error(detail)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+    value, hashes, updated, not_updated = result
+
+    update_result = {
+        "updated": updated,
+        "notUpdated": not_updated
+    }
+    if len(updated) > 0:
+        update_result["receipt"] = await timestamp_entity(value, response, hashes)
+
+    if len(not_updated) > 0:
+        response.status_code = status.HTTP_207_MULTI_STATUS
+
+    return update_result
+
 @router.post("/ngsi-ld/v1/entities/{entityId}/attrs/",
     response_class=ORJSONResponse,
     tags=["NGSI-LD Entity Attribute List"])
-def append_entity_attributes(entityId: str):
-    """List one entity.
+async def append_entity_attributes(
+    entityId: str,
+    response: Response,
+    attributes: dict = Body(...),
+    options: Optional[str] = None
+):
+    """Add attributes to the entity, timestamping the new version.
+    Existing attributes are replaced, unless options is "noOverwrite".
     """
-    item = canismajor.list_one_item(entityId)
-    return item
+    return await modify_attributes(entityId, attributes, response, append=True, overwrite=(options != "noOverwrite"))
 
 @router.patch("/ngsi-ld/v1/entities/{entityId}/attrs/",
     response_class=ORJSONResponse,
     tags=["NGSI-LD Entity Attribute List"])
-def update_entity_attributes(entityId: str):
-    """List one entity.
+async def update_entity_attributes(
+    entityId: str,
+    response: Response,
+    attributes: dict = Body(...)
+):
+    """Update existing attributes of the entity, timestamping the new version.
+    Only the modified attributes are hashed again.
     """
-    item = canismajor.list_one_item(entityId)
-    return item
+    return await modify_attributes(entityId, attributes, response, append=False)
+
+@router.get("/ngsi-ld/v1/entities/{entityId}/attrs/{attrId}/proof",
+    response_class=ORJSONResponse,
+    tags=["NGSI-LD Entity Blockchain Proof"])
+def attribute_proof(entityId: str, attrId: str):
+    """Get the proof that an attribute is part of the latest version of the entity,
+    without the rest of the entity. The root of the proof is the value hash in the receipt.
+    """
+
+    try:
+        proof = canismajor.attribute_proof(entityId, attrId)
+    except Exception as e:
+        detail = str(e)
+        log.error(detail)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=detail)
+
+    if proof is None:
+        detail = f"Attribute {attrId} of entity {entityId} not found"
+        log.error(detail)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+
+    return proof
 
 
 @router.get("/ngsi-ld/v1/entities/txreceipt/{tx_hash}",
     response_class=ORJSONResponse,
     tags=["NGSI-LD Entity Blockchain Proof"])
-def entity_proof_from_dlt(tx_hash: str):
+async def entity_proof_from_dlt(tx_hash: str):
     """Get the transaction receipt from the blockchain.
     """
-    receipt = canismajor.get_receipt(tx_hash)
+    receipt = await canismajor.get_receipt_async(tx_hash)
 
     return receipt
 
+@router.post("/ngsi-ld/v1/entities/verify",
+    response_class=ORJSONResponse,
+    tags=["NGSI-LD Entity Blockchain Proof"])
+def entity_verification(
+    msg: dict = Body(
+        ...,
+        example={
+            "id": "urn:ngsi-ld:ParkingSpot:santander:daoiz_velarde_1_5:3",
+            "type": "ParkingSpot",
+            "status": {
+                "type": "Property",
+                "value": "free"
+            }
+        }
+    )
+):
+    """Check if this exact entity was anchored in the blockchain, and in which block.
+    The answer comes from the Timestamp events indexed locally, without asking the blockchain node.
+    """
+
+    if "id" not in msg:
+        detail = "Missing id field"
+        log.error(detail)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+    return canismajor.verify_entity(msg["id"], msg)
+
 @router.post("/v2/entities",
     response_class=ORJSONResponse,
     tags=["NGSI V2 Entity Creation"])
-def entity_creation_v2(
+async def entity_creation_v2(
+    response: Response,
     msg: dict = Body(
         ...,
         example={
@@ -204,7 +513,7 @@ def entity_creation_v2(
         )
 
     # Register and timestamp the received message in the blockchain
-    receipt = canismajor.timestamp(msg["id"], msg)
+    receipt = await timestamp_entity(msg, response)
 
     return receipt
 
@@ -5,29 +5,24 @@ import logging
 # The Fastapi web server
 from fastapi import status, HTTPException, Body, Request, Depends
 from fastapi import APIRouter
+from fastapi.responses import Response
 
 # For the data models
-from typing import Dict, Optional, cast
+from typing import Dict, List, Optional, cast
 from pydantic import BaseModel, BaseSettings
 
 # The settings for the system
 from settings import settings
 
-# A very fast cache with expiration
-from cachetools import TTLCache
-
 # From this project packages
 from blockchain import trustframework as tf
-from blockchain import wallet, didutils, safeisland, pubcred, redt
+from blockchain import wallet, didutils, safeisland, pubcred, redt, didcache, issuerregistry
 
 # Create logger
 logging.basicConfig(
     format='%(levelname)s - %(asctime)s - %(message)s', level=logging.WARNING)
 log = logging.getLogger(__name__)
 
-# Create a cache for 100 DID Documents for 3 hours
-doc_cache = TTLCache(100, 3*60*60)
-
 
 router = APIRouter(
     tags=["Universal Resolver: DID resolution"]
@@ -89,13 +84,33 @@ class DIDDocument_reply(BaseModel):
             }
         }
 
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check the If-None-Match header of a request against the ETag of the resource.
+    The comparison is weak, as required for If-None-Match.
+    """
+
+    if if_none_match is None:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+
+    return False
+
 # Resolves a DID and returns the DID Document (JSON format), if it exists
 # We support four DID methods: ebsi, elsi, ala, peer.
 # TODO: support LACChain DIDs
 
 
 @router.get("/api/did/v1/identifiers/{DID}", response_model=DIDDocument_reply)
-def resolve_DID(DID: str):
+async def resolve_DID(DID: str, request: Request):
     """Resolves a DID and returns the DID Document (JSON format), if it exists.  
     We support four DID methods: **ebsi**, **elsi**, **ala**, **peer**.
 
@@ -105,6 +120,9 @@ def resolve_DID(DID: str):
 
     For example, for **EBSI** we call the corresponding Universal Resolver API, currently in testing and available at
     *https://api.ebsi.xyz/did/v1/identifiers/{did}*
+
+    The reply has an **ETag** header, and **Last-Modified** with the *updated* field of the DID Document.
+    Send the ETag in **If-None-Match** to get a *304 Not Modified* if the DID Document did not change.
     """
 
     # Parse the DID and check if it is one of the supported types
@@ -116,36 +134,36 @@ def resolve_DID(DID: str):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
 
-    # DIDs and associated DID Documents do not change a lot after creation
-    # Caching the DID Documents for several hours is an acceptable compromise
-    # and can increase performance substantially (default: 3 hours)
-    # Check if the DID is already in the cache
-    didDoc = cast(dict, doc_cache.get(DID))
-    if didDoc is not None:
-        return {"payload": didDoc}
-
     did_method = did_struct["method"]
 
     # Process ELSI DID method
     if did_method == "elsi":
 
-        # Try to resolve from the blockchain node
+        # Try to resolve from the DID cache, which asks the blockchain node when needed.
+        # DIDs and associated DID Documents do not change a lot after creation, and the
+        # cache is invalidated when they change, so it can increase performance substantially
         try:
-            _DID, name, didDoc, active = tf.resolver.resolveDID(DID)
+            resolution = await didcache.resolution_async(DID)
         except Exception as e:
             detail = str(e)
             log.error(detail)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
 
-        if didDoc is None:
+        if resolution.didDoc is None:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, detail="DID not found")
 
-        # Store the DID and associated DIDDocument in the cache
-        doc_cache[DID] = didDoc
+        headers = {"ETag": resolution.etag}
+        if resolution.last_modified is not None:
+            headers["Last-Modified"] = resolution.last_modified
+
+        # The client already has the current version
+        if etag_matches(request.headers.get("if-none-match"), resolution.etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
 
-        return {"payload": didDoc}
+        # The reply is already serialized in the cache, so it is sent as it is
+        return Response(content=resolution.body, media_type="application/json", headers=headers)
 
     # Process EBSI DID method
     elif did_method == "ebsi":
@@ -175,23 +193,112 @@ def resolve_DID(DID: str):
                         detail="DID parsing failed")
 
 
+######################################################
+# UNIVERSAL RESOLVER: BATCH DID RESOLUTION
+######################################################
+
+# The request message
+class DIDBatch_request(BaseModel):
+    DIDs: List[str]
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "DIDs": [
+                    "did:elsi:VATES-B60645900",
+                    "did:elsi:VATES-A87471264"
+                ]
+            }
+        }
+
+@router.post("/api/did/v1/identifiers/batch")
+async def resolve_DID_batch(request: DIDBatch_request):
+    """Resolves several DIDs in a single call, for verifiers checking presentations with
+    credentials of different issuers.  
+    Returns for each DID an object with its DID Document in **didDocument**, or with the
+    reason it could not be resolved in **error**.
+
+    DIDs in the cache are answered immediately, and the rest are resolved together
+    with a single batch of requests to the blockchain node.
+    """
+
+    if len(request.DIDs) > settings.DID_BATCH_MAX:
+        detail = f"Too many DIDs, the maximum is {settings.DID_BATCH_MAX}"
+        log.error(detail)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+    results = {}
+    elsi_DIDs = []
+
+    # Only the ELSI DID method is resolved, like in resolve_DID
+    for DID in request.DIDs:
+        try:
+            did_struct = didutils.parseDid(DID)
+        except didutils.DIDParseError as e:
+            results[DID] = {"error": str(e)}
+            continue
+
+        if did_struct["method"] == "elsi":
+            elsi_DIDs.append(DID)
+        else:
+            results[DID] = {"error": "Not implemented"}
+
+    resolutions = await didcache.resolve_many_async(elsi_DIDs)
+
+    for DID, resolution in resolutions.items():
+        if isinstance(resolution, Exception):
+            log.error(str(resolution))
+            results[DID] = {"error": str(resolution)}
+            continue
+
+        _DID, name, didDoc, active = resolution
+        if didDoc is None:
+            results[DID] = {"error": "DID not found"}
+        else:
+            results[DID] = {"didDocument": didDoc}
+
+    return {"payload": results}
+
+
 ######################################################
 # Lists the Trusted Issuers in the system
 ######################################################
 
 @router.get("/api/trusted-issuers-registry/v1/issuers")
-def list_trusted_issuers():
-    """Returns the list of all trusted issuers registered in the blockchain for the SafeIsland ecosystem.
+async def list_trusted_issuers(request: Request, offset: int = 0, limit: Optional[int] = None):
+    """Returns the list of all trusted issuers registered in the blockchain for the SafeIsland ecosystem.  
+    Use **offset** and **limit** to get a page of the list. The reply has the **total** number of issuers.
+
+    The list is kept updated by the server, so it is answered without asking the blockchain.
+    The reply has an **ETag** header: send it in **If-None-Match** to get a *304 Not Modified*
+    if the list did not change.
     """
 
-    # Query the blockchain and manage exceptions
-    try:
-        trusted_issuers = tf.dump_trusted_identities()
-    except Exception as e:
-        detail = str(e)
+    if offset < 0 or (limit is not None and (limit <= 0 or limit > settings.ISSUERS_MAX_PAGE_SIZE)):
+        detail = f"Invalid page, the limit must be between 1 and {settings.ISSUERS_MAX_PAGE_SIZE}"
         log.error(detail)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
 
-    return {"payload": trusted_issuers}
+    registry = issuerregistry.registry
+
+    # Until the registry is built, query the blockchain and manage exceptions
+    if registry is None or not registry.ready():
+        try:
+            trusted_issuers = await tf.dump_trusted_identities_async()
+        except Exception as e:
+            detail = str(e)
+            log.error(detail)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+        return issuerregistry.page_reply(trusted_issuers, offset, limit)
+
+    body, etag = registry.page(offset, limit)
+
+    # The client already has the current version
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
 
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
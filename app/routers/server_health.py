@@ -31,19 +31,19 @@ router = APIRouter(
 # HEALTH CHECKING
 #####################################################
 @router.get("/api/ping")
-def ping(request: Request):
+async def ping(request: Request):
     """A simple ping to check for server health
     """
 
     return {"payload": "Hello, v1.0.1"}
 
 @router.get("/api/pinge2e")
-def end_to_end_ping(request: Request):
+async def end_to_end_ping(request: Request):
     """End-to-end ping up to the Smart Contract to check that everything is working.
     """
 
     try:
-        canismajor.checktimestamp()
+        await canismajor.checktimestamp_async()
     except Exception as e:
         detail = str(e)
         log.error(detail)
@@ -13,9 +13,6 @@ from pydantic import BaseModel, BaseSettings
 # The settings for the system
 from settings import settings
 
-# A very fast cache with expiration
-from cachetools import TTLCache
-
 # From this project packages
 from blockchain import trustframework as tf
 from blockchain import wallet, didutils, safeisland, pubcred, redt
@@ -28,9 +25,6 @@ logging.basicConfig(
     format='%(levelname)s - %(asctime)s - %(message)s', level=logging.WARNING)
 log = logging.getLogger(__name__)
 
-# Create a cache for 100 DID Documents for 3 hours
-doc_cache = TTLCache(100, 3*60*60)
-
 router = APIRouter(
     tags=["EBSI-style Verifiable Credentials"]
 )
@@ -53,7 +47,7 @@ class VerifyJWTMessage(BaseModel):
 
 
 @router.post("/api/verifiable-credential/v1/verifiable-credential-validations")
-def credential_verify(msg: VerifyJWTMessage):
+async def credential_verify(msg: VerifyJWTMessage):
     """Verify a Credential in JWT format, checking its digital signature
     with the Identity of the Issuer in the Blockchain.
     """
@@ -66,7 +60,7 @@ def credential_verify(msg: VerifyJWTMessage):
 
     # Verify the certificate
     try:
-        claims, didDoc = safeisland.verify_cert_token(jwt_cert)
+        claims, didDoc = await safeisland.verify_cert_token_async(jwt_cert)
     except JWException as e:
         detail = str(e)
         log.error(e)
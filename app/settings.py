@@ -7,7 +7,7 @@ import os
 from pathlib import Path
 
 # For the data models
-from typing import Any, Dict, Tuple, Optional, cast
+from typing import Any, Dict, List, Tuple, Optional, cast
 from pydantic import BaseModel, BaseSettings
 
 from devtools import debug
@@ -39,8 +39,78 @@ class Settings(BaseModel):
     # Location and name of the SQLite database with local config data
     DATABASE_SUBDIR = os.path.join("db")
 
+    # Tuning of the SQLite connections: memory-mapped I/O (bytes), page cache (KiB)
+    # and number of prepared statements cached by each connection
+    SQLITE_MMAP_SIZE: int = 268435456
+    SQLITE_CACHE_SIZE_KB: int = 16384
+    SQLITE_STATEMENT_CACHE: int = 256
+
     # Location of the Tolar artifacts
     TOLAR_SUBDIR = os.path.join("tolar")
+    # Use the native gRPC client for Tolar (needs grpcio and grpcio-tools) instead of running grpcurl
+    TOLAR_NATIVE_GRPC: bool = True
+
+    # Anchoring of NGSI entities in the blockchain:
+    # "single" sends one transaction per entity, "merkle" accumulates entities and
+    # anchors only the root of a Merkle Tree built with all of them, "batch" accumulates
+    # entities and sends them in one batchTimestamp transaction (one event per entity)
+    CANISMAJOR_ANCHOR_MODE = "merkle"
+    # Anchor the Merkle Tree when it has MERKLE_MAX_LEAVES entities or when the oldest
+    # entity has been waiting for MERKLE_MAX_INTERVAL seconds, whatever happens first
+    MERKLE_MAX_LEAVES: int = 1024
+    MERKLE_MAX_INTERVAL: float = 2.0
+    # The same for batchTimestamp. The gas of the transaction grows with the number of entities
+    BATCH_MAX_ENTITIES: int = 200
+    BATCH_MAX_INTERVAL: float = 2.0
+    # Maximum time (seconds) that a request waits for its entity to be anchored
+    ANCHOR_TIMEOUT: int = 60
+    # Ledgers where entities are anchored concurrently ("redt" and/or "tolar"). A request returns
+    # when ANCHOR_QUORUM ledgers have confirmed, and the receipts of the others are added later.
+    # The time to wait for each ledger can be set in LEDGER_TIMEOUTS (default ANCHOR_TIMEOUT)
+    ANCHOR_LEDGERS: List[str] = ["redt"]
+    ANCHOR_QUORUM: int = 1
+    LEDGER_TIMEOUTS: Dict[str, float] = {"redt": 60.0, "tolar": 30.0}
+    # Threads of each ledger to send transactions and wait for receipts. In "single" mode every
+    # request anchors its own entity, so it should be at least the number of concurrent requests
+    LEDGER_WORKERS: int = 40
+    # Set to True to acknowledge new entities (202 Accepted) as soon as they are durably
+    # stored in the write-ahead log, and anchor them in the background
+    CANISMAJOR_ASYNC_INGESTION: bool = False
+    # Maximum number of entities in the write-ahead log waiting to be anchored
+    ASYNC_INGESTION_QUEUE_SIZE: int = 100000
+    # Index locally the Timestamp events of the blockchain, to verify entities without asking the node.
+    # Events are pulled from INDEXER_START_BLOCK in ranges of INDEXER_CHUNK_SIZE blocks,
+    # with INDEXER_WORKERS ranges requested in parallel, every INDEXER_POLL_INTERVAL seconds
+    CANISMAJOR_EVENT_INDEXER: bool = True
+    INDEXER_START_BLOCK: int = 0
+    INDEXER_CHUNK_SIZE: int = 2000
+    INDEXER_WORKERS: int = 4
+    INDEXER_POLL_INTERVAL: float = 2.0
+
+    # Cache of resolved DID Documents: DIDCACHE_MEMORY_SIZE entries in memory per process, and a
+    # SQLite tier shared by all the processes. Entries expire after DIDCACHE_TTL seconds, and are
+    # invalidated before if DIDCACHE_EVENT_WATCHER follows the changes in the blockchain,
+    # checking for new events every DIDCACHE_POLL_INTERVAL seconds.
+    # DIDs not found are remembered in memory for DIDCACHE_NEGATIVE_TTL seconds
+    DIDCACHE_MEMORY_SIZE: int = 10000
+    DIDCACHE_TTL: int = 10800
+    DIDCACHE_NEGATIVE_TTL: int = 30
+    DIDCACHE_EVENT_WATCHER: bool = True
+    DIDCACHE_POLL_INTERVAL: float = 5.0
+    # Maximum number of DIDs in a request to the batch resolution API
+    DID_BATCH_MAX: int = 100
+
+    # Registry of trusted issuers kept in memory and SQLite, built at startup and refreshed with the
+    # events of ENS and the PublicResolver every ISSUERS_POLL_INTERVAL seconds. It is fully compared
+    # with the blockchain every ISSUERS_DIFF_INTERVAL seconds, in case some change is missed.
+    # Pages of the API have at most ISSUERS_MAX_PAGE_SIZE issuers
+    ISSUERS_REGISTRY: bool = True
+    ISSUERS_POLL_INTERVAL: float = 5.0
+    ISSUERS_DIFF_INTERVAL: float = 600.0
+    ISSUERS_MAX_PAGE_SIZE: int = 1000
+
+    # Seconds that an account unlocked with its password is kept in memory for signing (0: forever)
+    SIGNER_TTL: int = 3600
 
     # Protect the server against clients sending big requests
     MAX_CONTENT_LENGTH: int = 30000
@@ -0,0 +1,31 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.5.0;
+pragma experimental ABIEncoderV2;
+
+/**
+ * Aggregates the results of several calls to view functions in a single eth_call,
+ * so reading many records of the Trust Framework costs one request to the node.
+ * A failed call does not make the others fail: its result has success = false.
+ * Written for 0.5.x, to be compiled by m_compile with the same solc as the rest of the Trust Framework.
+ */
+contract Multicall {
+
+    struct Call {
+        address target;
+        bytes callData;
+    }
+
+    struct Result {
+        bool success;
+        bytes returnData;
+    }
+
+    function aggregate(Call[] memory calls) public view returns (uint256 blockNumber, Result[] memory results) {
+        blockNumber = block.number;
+        results = new Result[](calls.length);
+        for (uint256 i = 0; i < calls.length; i++) {
+            (bool success, bytes memory returnData) = calls[i].target.staticcall(calls[i].callData);
+            results[i] = Result(success, returnData);
+        }
+    }
+}
@@ -112,6 +112,32 @@ contract AlaDIDPublicEntityResolver is ResolverBase {
         );
     }
 
+    /**
+     * Resolves a DID in a single call: the node associated to the DID and its entity data.
+     * It is the same as calling nodeFromDID and then AlaDIDPublicEntity with the node.
+     * @param _DIDHash The hash of the DID to resolve.
+     * @return The node and its entity data (all empty if the DID is not registered).
+     */
+    function AlaDIDPublicEntityByDIDHash(bytes32 _DIDHash) external view returns (
+        bytes32 _node,
+        bytes32 _entityDIDHash,
+        string memory _domain_name,
+        string memory _DIDDocument,
+        bool _active
+        ) {
+
+        bytes32 node = nodes[_DIDHash];
+        EntityData storage entity = entities[node];
+
+        return (
+            node,
+            entity.DIDHash,
+            entity.domain_name,
+            entity.DIDDocument,
+            entity.active
+        );
+    }
+
     function nodeFromDID(bytes32 _DIDHash) external view returns (bytes32 _node) {
         // Check for lengths of strings
         return nodes[_DIDHash];
@@ -0,0 +1,23 @@
+# Common setup for the tests of the server
+#
+# The modules are imported as the server does, with the app directory in the path.
+# The SQLite databases are created in a temporary directory, so the tests never touch app/db
+
+import os
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+# Imported only for their side effects, before the settings: settings imports attributedict,
+# which inserts None in sys.path, and importing eth_account after that may fail
+import web3
+import eth_account
+
+from settings import settings
+
+settings.DATABASE_DIR = tempfile.mkdtemp(prefix="canispy-tests-")
+settings.DATABASE_NAME = os.path.join(settings.DATABASE_DIR, "pubcred_config.sqlite")
+settings.FASTAPI_SIMPLE_SECURITY_DB_LOCATION = settings.DATABASE_NAME
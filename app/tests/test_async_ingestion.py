@@ -0,0 +1,121 @@
+# Tests of the asynchronous ingestion of entities and the recovery of its write-ahead log
+
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+import pytest
+
+from blockchain import canismajor as cm
+from utils.db import transaction
+from utils.que import FullError
+
+
+@pytest.fixture
+def db():
+    db = cm.create_db()
+    with transaction(db):
+        for table in ("stamping", "stamping_value", "stamping_leaves", "tx_receipt"):
+            db.execute(f"DELETE FROM {table}")
+    return db
+
+
+@pytest.fixture
+def wal_file(tmp_path):
+    return str(tmp_path / "fifo.que")
+
+
+def entity(n: int) -> dict:
+    return {"id": f"urn:ngsi-ld:Test:{n}", "type": "Test", "value": {"type": "Property", "value": n}}
+
+
+def submit(ingestion: cm.AsyncIngestion, value: dict) -> int:
+    sorted_dict, id_hash, value_hash, leaves = cm.entity_hashes(value["id"], value)
+    return ingestion.submit(value["id"], sorted_dict, id_hash, value_hash, value["type"], leaves)
+
+
+def test_pending_entities_survive_a_restart(db, wal_file):
+    ingestion = cm.AsyncIngestion(wal_file)
+    tickets = [submit(ingestion, entity(n)) for n in range(3)]
+
+    # The server stops before anchoring them, and starts again
+    ingestion.wal.close()
+    ingestion = cm.AsyncIngestion(wal_file)
+    ingestion.recover()
+
+    batch = ingestion._pending_stamps(ingestion.wal.peek_many(10))
+    assert [item.row_id for item in batch] == tickets
+    assert [orjson.loads(item.sorted_dict) for item in batch] == [entity(n) for n in range(3)]
+
+
+def test_pending_row_missing_from_the_log_is_recovered(db, wal_file):
+    ingestion = cm.AsyncIngestion(wal_file)
+    submit(ingestion, entity(1))
+
+    # A crash after committing the row and before appending it to the log
+    ingestion.wal.drop(1)
+    ingestion.wal.close()
+
+    ingestion = cm.AsyncIngestion(wal_file)
+    ingestion.recover()
+
+    batch = ingestion._pending_stamps(ingestion.wal.peek_many(10))
+    assert [item.id for item in batch] == [entity(1)["id"]]
+
+
+def test_anchored_entity_left_in_the_log_is_skipped(db, wal_file):
+    ingestion = cm.AsyncIngestion(wal_file)
+    first = submit(ingestion, entity(1))
+    second = submit(ingestion, entity(2))
+
+    # A crash after storing the receipt of the first one and before dropping it from the log
+    with transaction(db):
+        db.execute("UPDATE stamping SET status = 'anchored', ngsi_receipt = '{}' WHERE id = ?", (first,))
+    ingestion.wal.close()
+
+    ingestion = cm.AsyncIngestion(wal_file)
+    ingestion.recover()
+
+    records = ingestion.wal.peek_many(10)
+    assert len(records) == 2
+    assert [item.row_id for item in ingestion._pending_stamps(records)] == [second]
+
+
+def test_concurrent_submissions_of_the_same_entity(db, wal_file, monkeypatch):
+    ingestion = cm.AsyncIngestion(wal_file)
+    monkeypatch.setattr(cm, "async_ingestion", ingestion)
+
+    value = entity(1)
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda _: cm.timestamp_async(value["id"], value), range(8)))
+
+    assert len({result["ticket"] for result in results}) == 1
+    assert all(result["status"] == "pending" for result in results)
+    assert len(ingestion.wal.peek_many(10)) == 1
+    assert cm.submitting == {}
+
+
+def test_recovery_of_more_entities_than_fit_in_the_log(db, wal_file, tmp_path):
+    ingestion = cm.AsyncIngestion(wal_file)
+    tickets = [submit(ingestion, entity(n)) for n in range(10)]
+    ingestion.wal.close()
+
+    # The log is lost, and the new one is smaller than the number of pending entities
+    ingestion = cm.AsyncIngestion(str(tmp_path / "small.que"), maxsize=4)
+    ingestion.recover()
+    assert ingestion.wal.full()
+
+    # New entities wait until the recovered ones are in the log
+    with pytest.raises(FullError):
+        submit(ingestion, entity(100))
+
+    # Drain the log as the background drainer does
+    drained = []
+    while not ingestion.wal.empty():
+        records = ingestion.wal.peek_many(ingestion.maxItems)
+        drained.extend(item.row_id for item in ingestion._pending_stamps(records))
+        with ingestion.lock:
+            ingestion.wal.drop(len(records))
+            ingestion._refill()
+
+    assert drained == tickets
+    submit(ingestion, entity(100))
@@ -0,0 +1,74 @@
+# Tests of the shared access to the SQLite databases
+
+import os
+import threading
+
+import pytest
+
+from settings import settings
+from utils.db import get_connection, transaction
+
+
+@pytest.fixture
+def db():
+    db = get_connection(os.path.join(settings.DATABASE_DIR, "test_db.sqlite"))
+    db.execute("CREATE TABLE IF NOT EXISTS item (id INTEGER PRIMARY KEY, name TEXT NOT NULL)")
+    db.execute("DELETE FROM item")
+    db.commit()
+    return db
+
+
+def test_connection_is_reused_by_the_thread(db):
+    assert get_connection(os.path.join(settings.DATABASE_DIR, "test_db.sqlite")) is db
+
+
+def test_transaction_commits(db):
+    with transaction(db):
+        db.execute("INSERT INTO item (id, name) VALUES (1, 'one')")
+
+    assert not db.in_transaction
+    assert db.execute("SELECT count(*) FROM item").fetchone()[0] == 1
+
+
+def test_failed_transaction_is_rolled_back(db):
+    with pytest.raises(Exception):
+        with transaction(db):
+            db.execute("INSERT INTO item (id, name) VALUES (1, 'one')")
+            db.execute("INSERT INTO item (id, name) VALUES (2, NULL)")
+
+    # The lock is released, and the half-done work is not committed by the next transaction
+    assert not db.in_transaction
+    with transaction(db):
+        db.execute("INSERT INTO item (id, name) VALUES (3, 'three')")
+    assert [row["id"] for row in db.execute("SELECT id FROM item")] == [3]
+
+
+def test_other_threads_can_write_after_a_failure(db):
+    with pytest.raises(Exception):
+        with transaction(db):
+            db.execute("INSERT INTO item (id, name) VALUES (1, NULL)")
+
+    errors = []
+    def write():
+        other = get_connection(os.path.join(settings.DATABASE_DIR, "test_db.sqlite"))
+        other.execute("PRAGMA busy_timeout = 100")
+        try:
+            with transaction(other):
+                other.execute("INSERT INTO item (id, name) VALUES (2, 'two')")
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    thread.join()
+    assert errors == []
+
+
+def test_durable_transaction(db):
+    with transaction(db, durable=True):
+        assert db.execute("PRAGMA synchronous").fetchone()[0] == 2
+        db.execute("INSERT INTO item (id, name) VALUES (1, 'one')")
+
+    # Back to synchronous=NORMAL for the rest of the writes
+    assert db.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert db.execute("SELECT count(*) FROM item").fetchone()[0] == 1
@@ -0,0 +1,80 @@
+# Tests of the deduplication of entities and their history of versions
+
+import itertools
+
+import orjson
+import pytest
+
+from blockchain import canismajor as cm
+from utils.db import transaction
+
+
+@pytest.fixture
+def anchoring(monkeypatch):
+    """Anchor each entity with a new fake receipt, without a blockchain"""
+
+    db = cm.create_db()
+    with transaction(db):
+        for table in ("stamping", "stamping_value", "stamping_leaves", "tx_receipt"):
+            db.execute(f"DELETE FROM {table}")
+
+    counter = itertools.count(1)
+    anchored = []
+
+    def anchor_single(item):
+        item.receipt = {"receipt": next(counter)}
+        anchored.append(item)
+
+    monkeypatch.setattr(cm, "timestamp_buffer", None)
+    monkeypatch.setattr(cm, "anchor_single", anchor_single)
+    return anchored
+
+
+def entity(status: str) -> dict:
+    return {"id": "urn:ngsi-ld:ParkingSpot:1", "type": "ParkingSpot", "status": {"type": "Property", "value": status}}
+
+
+def test_same_value_is_not_stamped_again(anchoring):
+    first = cm.timestamp(entity("free")["id"], entity("free"))
+    again = cm.timestamp(entity("free")["id"], entity("free"))
+
+    assert again == first
+    assert len(anchoring) == 1
+
+
+def test_value_going_back_is_a_new_version(anchoring):
+    receipts = [cm.timestamp(e["id"], e) for e in (entity("free"), entity("occupied"), entity("free"))]
+
+    # A -> B -> A: the last A is anchored again and has its own version
+    assert [r["receipt"] for r in receipts] == [1, 2, 3]
+
+    history = cm.list_item_history(entity("free")["id"])
+    assert [v["value"]["status"]["value"] for v in history["versions"]] == ["free", "occupied", "free"]
+    assert cm.list_one_item(entity("free")["id"])["value"]["status"]["value"] == "free"
+
+    # Repeating the latest value does not create another version
+    assert cm.timestamp(entity("free")["id"], entity("free")) == receipts[-1]
+    assert len(cm.list_item_history(entity("free")["id"])["versions"]) == 3
+
+
+def test_batch_with_several_versions(anchoring, monkeypatch):
+    def anchor_batch(batch):
+        for item in batch:
+            cm.anchor_single(item)
+
+    monkeypatch.setattr(cm, "anchor_function", lambda anchor_mode: anchor_batch)
+
+    items = cm.timestamp_many([entity("free"), entity("occupied"), entity("occupied"), entity("free")])
+
+    # The repeated B is the same version, but the value going back to A is a new one
+    assert [item.receipt["receipt"] for item in items] == [1, 2, 2, 3]
+    assert len(cm.list_item_history(entity("free")["id"])["versions"]) == 3
+    assert cm.in_flight == {}
+
+
+def test_list_all_has_the_values(anchoring):
+    for e in (entity("free"), entity("occupied")):
+        cm.timestamp(e["id"], e)
+
+    items = cm.list_all()
+    assert [orjson.loads(item["ngsi_value"])["status"]["value"] for item in items] == ["free", "occupied"]
@@ -0,0 +1,186 @@
+# Tests of the cache of DID Documents and its invalidation
+
+import asyncio
+import threading
+
+import pytest
+
+from blockchain import didcache
+from blockchain import trustframework as tf
+
+NODE = b"\x01" * 32
+DID = "did:elsi:VATES-B60645900"
+
+
+class FakeResolver:
+    """Resolves one DID, counting the calls. on_read runs while the DID is being read."""
+
+    def __init__(self) -> None:
+        self.version = 1
+        self.calls = 0
+        self.on_read = None
+
+    def resolution(self, DID: str) -> tuple:
+        self.calls += 1
+        version = self.version
+        if self.on_read is not None:
+            self.on_read()
+        if DID != globals()["DID"]:
+            return (bytes(32), DID, None, None, False)
+        return (NODE, DID, "Issuer", {"id": DID, "version": version}, True)
+
+    def resolveDIDNode(self, DID: str) -> tuple:
+        return self.resolution(DID)
+
+    async def resolveDIDNode_async(self, DID: str) -> tuple:
+        return self.resolution(DID)
+
+    async def resolveDIDNodes_async(self, DIDs: list) -> list:
+        return [self.resolution(DID) for DID in DIDs]
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    fake = FakeResolver()
+    monkeypatch.setattr(tf, "resolver", fake, raising=False)
+    didcache.clear()
+    return fake
+
+
+def shared_row(DID: str):
+    return didcache.get_db().execute("SELECT diddoc FROM did_document WHERE did = ?", (DID,)).fetchone()
+
+
+def test_resolution_is_cached_in_both_tiers(resolver):
+    assert didcache.resolve(DID)[2] == {"id": DID, "version": 1}
+    assert didcache.resolve(DID)[2] == {"id": DID, "version": 1}
+    assert resolver.calls == 1
+    assert shared_row(DID) is not None
+
+
+def test_invalidation_removes_the_node_from_both_tiers(resolver):
+    didcache.resolve(DID)
+
+    resolver.version = 2
+    didcache.invalidate_node(NODE)
+
+    assert shared_row(DID) is None
+    assert didcache.resolve(DID)[2]["version"] == 2
+    assert resolver.calls == 2
+
+
+def test_invalidation_during_resolution(resolver):
+    # The DID Document changes while we are reading the previous version
+    def change():
+        resolver.version = 2
+        didcache.invalidate_node(NODE)
+    resolver.on_read = change
+
+    assert didcache.resolve(DID)[2]["version"] == 1
+
+    # The stale version is not cached, and the next resolution reads the new one
+    resolver.on_read = None
+    assert shared_row(DID) is None
+    assert didcache.resolve(DID)[2]["version"] == 2
+    assert didcache.resolve(DID)[2]["version"] == 2
+    assert resolver.calls == 2
+
+
+def test_invalidation_during_async_resolutions(resolver):
+    def change():
+        resolver.version = 2
+        didcache.invalidate_node(NODE)
+    resolver.on_read = change
+
+    asyncio.run(didcache.resolve_async(DID))
+    results = asyncio.run(didcache.resolve_many_async([DID]))
+    assert results[DID][2]["version"] == 2
+
+    resolver.on_read = None
+    assert asyncio.run(didcache.resolve_async(DID))[2]["version"] == 2
+    assert resolver.calls == 3
+
+
+def test_not_found_is_cached_until_an_invalidation(resolver):
+    unknown = "did:elsi:unknown"
+    assert didcache.resolve(unknown)[2] is None
+    assert didcache.resolve(unknown)[2] is None
+    assert resolver.calls == 1
+
+    didcache.invalidate_node(b"\x02" * 32)
+    didcache.resolve(unknown)
+    assert resolver.calls == 2
+
+
+def test_batch_resolution_with_fewer_entries(resolver, monkeypatch):
+    other = "did:elsi:VATES-A00000000"
+
+    async def short(DIDs):
+        return [resolver.resolution(DIDs[0])]
+    monkeypatch.setattr(resolver, "resolveDIDNodes_async", short)
+
+    async def run():
+        return await asyncio.wait_for(didcache.resolve_many_async([DID, other]), 5)
+    results = asyncio.run(run())
+
+    assert results[DID][2]["version"] == 1
+    assert isinstance(results[other], RuntimeError)
+    assert didcache.inflight_async == {}
+
+
+def test_batch_resolution_cancelled(resolver, monkeypatch):
+    started = None
+
+    async def forever(DIDs):
+        started.set()
+        await asyncio.sleep(3600)
+    monkeypatch.setattr(resolver, "resolveDIDNodes_async", forever)
+
+    async def run():
+        nonlocal started
+        started = asyncio.Event()
+        waiter = asyncio.ensure_future(didcache.resolve_many_async([DID]))
+        await started.wait()
+
+        # Cancel the task resolving the DIDs, not the caller
+        for task in asyncio.all_tasks():
+            if task is not waiter and task is not asyncio.current_task():
+                task.cancel()
+        return await asyncio.wait_for(waiter, 5)
+    results = asyncio.run(run())
+
+    assert isinstance(results[DID], RuntimeError)
+    assert didcache.inflight_async == {}
+    assert didcache.resolving_tasks == set()
+
+
+def test_async_resolution_uses_the_shared_tier_in_a_thread(resolver, monkeypatch):
+    threads = []
+    get_shared = didcache._get_shared
+    put_shared = didcache._put_shared
+
+    def recording(function):
+        def wrapper(*args):
+            threads.append(threading.current_thread())
+            return function(*args)
+        return wrapper
+
+    monkeypatch.setattr(didcache, "_get_shared", recording(get_shared))
+    monkeypatch.setattr(didcache, "_put_shared", recording(put_shared))
+
+    async def run():
+        await didcache.resolve_async(DID)
+        # Only in the shared tier, as if another process had resolved it
+        with didcache.memory_lock:
+            didcache.memory_cache.clear()
+        await didcache.resolve_async(DID)
+        with didcache.memory_lock:
+            didcache.memory_cache.clear()
+        return await didcache.resolve_many_async([DID, "did:elsi:unknown"])
+
+    results = asyncio.run(run())
+
+    assert list(results) == [DID, "did:elsi:unknown"]
+    assert resolver.calls == 2
+    assert len(threads) >= 3
+    assert threading.current_thread() not in threads
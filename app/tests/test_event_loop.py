@@ -0,0 +1,97 @@
+# The async functions of canismajor must not run database work in the event loop
+
+import asyncio
+import threading
+
+from blockchain import canismajor as cm
+from settings import settings
+
+
+def test_timestamp_wait_async_looks_for_the_entity_in_a_thread(monkeypatch):
+    threads = []
+
+    def claim(item):
+        threads.append(threading.current_thread())
+        return None, {"status": "anchored", "ngsi_receipt": b'{"receipt": 1}'}
+
+    monkeypatch.setattr(cm, "claim", claim)
+    value = {"id": "urn:ngsi-ld:Test:1", "type": "Test"}
+
+    receipt = asyncio.run(cm.timestamp_wait_async(value["id"], value))
+
+    assert receipt == {"receipt": 1}
+    assert threads and threads[0] is not threading.current_thread()
+
+
+def test_get_receipt_async_reads_the_store_in_a_thread(monkeypatch):
+    threads = []
+
+    def stored_receipt(tx_hash):
+        threads.append(threading.current_thread())
+        return {"stored": True}
+
+    monkeypatch.setattr(cm, "stored_receipt", stored_receipt)
+    monkeypatch.setattr(cm, "receipt_as_vc2", lambda raw_receipt: raw_receipt)
+
+    assert asyncio.run(cm.get_receipt_async("0x01")) == {"stored": True}
+    assert threads and threads[0] is not threading.current_thread()
+
+
+def test_single_anchoring_does_not_take_a_thread_per_request(monkeypatch):
+    """More requests than threads in the default executor wait for their receipts at the same time"""
+
+    num_requests = 100
+    waiting = 0
+    store_threads = []
+
+    class FakeTimestamper:
+        class functions:
+            @staticmethod
+            def timestamp(id_hash, value_hash):
+                return (id_hash, value_hash)
+
+    async def send_to_redt_async(contract_funs):
+        nonlocal waiting
+        waiting += 1
+        await all_waiting.wait()
+        return [{"tx": fun} for fun in contract_funs]
+
+    def ledgers_receipt(batch, confirmed, late):
+        for item in batch:
+            item.receipt = confirmed["redt"][item.tx_index]
+
+    def store_batch(batch):
+        store_threads.append(threading.current_thread())
+        for item in batch:
+            item.set_result(receipt=item.receipt)
+
+    monkeypatch.setattr(cm, "timestamp_buffer", None)
+    monkeypatch.setattr(cm, "Timestamper", FakeTimestamper, raising=False)
+    monkeypatch.setattr(cm, "claim", lambda item: (None, None))
+    monkeypatch.setattr(cm, "ledgers_receipt", ledgers_receipt)
+    monkeypatch.setattr(cm, "store_batch", store_batch)
+    monkeypatch.setitem(cm.LEDGERS_ASYNC, "redt", send_to_redt_async)
+    monkeypatch.setitem(settings, "ANCHOR_LEDGERS", ["redt"])
+
+    async def run():
+        nonlocal all_waiting
+        all_waiting = asyncio.Event()
+
+        async def release():
+            while waiting < num_requests:
+                await asyncio.sleep(0.01)
+            all_waiting.set()
+
+        values = [{"id": f"urn:ngsi-ld:Test:{i}", "type": "Test"} for i in range(num_requests)]
+        releaser = asyncio.ensure_future(release())
+        receipts = await asyncio.wait_for(
+            asyncio.gather(*(cm.timestamp_wait_async(value["id"], value) for value in values)), 10)
+        await releaser
+        return receipts
+
+    all_waiting = None
+    receipts = asyncio.run(run())
+
+    assert len(receipts) == num_requests
+    assert waiting == num_requests
+    assert threading.current_thread() not in store_threads
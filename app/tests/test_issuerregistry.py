@@ -0,0 +1,190 @@
+# Tests of the registry of trusted issuers, with a fake blockchain in memory
+
+import orjson
+import pytest
+from hexbytes import HexBytes
+from web3 import Web3
+from ens.utils import raw_name_to_hash
+
+from blockchain import issuerregistry
+from blockchain import trustframework as tf
+from blockchain.didcache import DIDDOCUMENT_CHANGED_TOPIC, NEW_OWNER_TOPIC
+from utils.db import transaction
+
+ALA = HexBytes(raw_name_to_hash("ala"))
+OTHER = HexBytes(raw_name_to_hash("other"))
+
+
+class FakeChain:
+    """The subnodes of ENS under ala, their entities in the PublicResolver and the events"""
+
+    def __init__(self) -> None:
+        self.block_number = 100
+        self.subnodes = []
+        self.entities = {}
+        self.logs = []
+        self.eth = self
+
+    def _event(self, topics: list):
+        self.block_number += 1
+        self.logs.append({"blockNumber": self.block_number, "topics": [HexBytes(t) for t in topics]})
+
+    def add_issuer(self, label: str, DID: str, node: HexBytes = ALA) -> HexBytes:
+        label_hash = Web3.keccak(text=label)
+        subnode = Web3.keccak(node + label_hash)
+        if node == ALA:
+            self.subnodes.append(subnode)
+            self.entities[subnode] = (DID, label)
+        self._event([NEW_OWNER_TOPIC, node, label_hash])
+        return subnode
+
+    def change_DID(self, subnode: HexBytes, DID: str):
+        self.entities[subnode] = (DID, self.entities[subnode][1])
+        self._event([DIDDOCUMENT_CHANGED_TOPIC, subnode])
+
+    # The calls of w3 and the contracts used by the registry
+
+    def get_logs(self, filter_params: dict) -> list:
+        return [log for log in self.logs if filter_params["fromBlock"] <= log["blockNumber"] <= filter_params["toBlock"]]
+
+    def batch_call(self, calls: list) -> list:
+        results = []
+        for kind, arg in calls:
+            if kind == "subnode":
+                results.append(bytes(self.subnodes[arg]))
+            else:
+                results.append(self.entities[HexBytes(arg)])
+        return results
+
+    def numberSubnodes(self, node_name: str) -> int:
+        return len(self.subnodes)
+
+    def _checkDIDPublicEntity(self, DID: str, name: str):
+        return DID, name, None, True
+
+
+class FakeContract:
+    def __init__(self, address: str) -> None:
+        self.address = address
+        self.functions = self
+
+    def subnode(self, node_hash, index):
+        return ("subnode", index)
+
+    def AlaDIDPublicEntity(self, subnode_hash):
+        return ("entity", subnode_hash)
+
+
+@pytest.fixture
+def chain(monkeypatch):
+    chain = FakeChain()
+    monkeypatch.setattr(issuerregistry.b, "w3", chain)
+    monkeypatch.setattr(issuerregistry.b, "batch_call", chain.batch_call)
+    monkeypatch.setattr(tf, "ens", chain, raising=False)
+    monkeypatch.setattr(tf, "resolver", chain, raising=False)
+    monkeypatch.setattr(tf, "ENS", FakeContract("0x" + "01" * 20), raising=False)
+    monkeypatch.setattr(tf, "PublicResolver", FakeContract("0x" + "02" * 20), raising=False)
+
+    with transaction(issuerregistry.get_db()) as db:
+        db.execute("DELETE FROM trusted_issuer")
+        db.execute("DELETE FROM registry_checkpoint")
+    return chain
+
+
+def published(registry: issuerregistry.IssuerRegistry) -> list:
+    return [(issuer["DID"], issuer["name"]) for issuer in registry.version[0]]
+
+
+def test_build_and_load(chain):
+    for n in range(3):
+        chain.add_issuer(f"issuer{n}", f"did:elsi:VATES-{n}")
+
+    registry = issuerregistry.IssuerRegistry()
+    registry.build()
+    assert published(registry) == [(f"did:elsi:VATES-{n}", f"issuer{n}") for n in range(3)]
+    assert registry.last_block == chain.block_number
+
+    # Another process starts from the checkpoint, with the same reply
+    other = issuerregistry.IssuerRegistry()
+    assert other.load()
+    assert published(other) == published(registry)
+    assert other.last_block == registry.last_block
+    assert other.page() == registry.page()
+
+
+def test_refresh_reads_only_the_issuers_changed(chain, monkeypatch):
+    first = chain.add_issuer("issuer0", "did:elsi:VATES-0")
+    chain.add_issuer("issuer1", "did:elsi:VATES-1")
+
+    registry = issuerregistry.IssuerRegistry()
+    registry.build()
+    body, etag = registry.page()
+
+    # A DID Document changed, a new issuer, and a subnode of another node which is not ours
+    chain.change_DID(first, "did:elsi:VATES-0-new")
+    chain.add_issuer("issuer2", "did:elsi:VATES-2")
+    chain.add_issuer("outsider", "did:elsi:VATES-X", node=OTHER)
+
+    calls = []
+    batch_call = chain.batch_call
+    monkeypatch.setattr(issuerregistry.b, "batch_call", lambda funs: calls.append(funs) or batch_call(funs))
+
+    assert registry.refresh_once() == 2
+    assert published(registry) == [
+        ("did:elsi:VATES-0-new", "issuer0"),
+        ("did:elsi:VATES-1", "issuer1"),
+        ("did:elsi:VATES-2", "issuer2"),
+    ]
+    # Only the new subnode, and then the entities of the changed and the new issuers
+    assert calls == [[("subnode", 2)], [("entity", first), ("entity", HexBytes(chain.subnodes[2]))]]
+    assert registry.last_block == chain.block_number
+
+    new_body, new_etag = registry.page()
+    assert new_etag != etag
+    assert orjson.loads(new_body)["total"] == 3
+
+    # Nothing changed since the last refresh
+    assert registry.refresh_once() == 0
+
+    # The changes were saved with their block
+    other = issuerregistry.IssuerRegistry()
+    assert other.load()
+    assert published(other) == published(registry)
+    assert other.last_block == chain.block_number
+
+
+def test_changes_match_events_to_positions(chain):
+    subnodes = [chain.add_issuer(f"issuer{n}", f"did:elsi:VATES-{n}") for n in range(3)]
+    registry = issuerregistry.IssuerRegistry()
+    positions = {subnode.hex(): n for n, subnode in enumerate(subnodes)}
+
+    chain.logs.clear()
+    chain.change_DID(subnodes[2], "did:elsi:VATES-2-new")
+    chain.add_issuer("outsider", "did:elsi:VATES-X", node=OTHER)
+    # A DID Document changed in a node which is not one of our issuers
+    chain._event([DIDDOCUMENT_CHANGED_TOPIC, Web3.keccak(text="unknown")])
+
+    assert registry.changes(chain.logs, positions) == ({2}, False)
+
+    # An issuer registered again with the same label is not new
+    chain.logs.clear()
+    chain._event([NEW_OWNER_TOPIC, ALA, Web3.keccak(text="issuer1")])
+    chain._event([NEW_OWNER_TOPIC, ALA, Web3.keccak(text="issuer3")])
+    assert registry.changes(chain.logs, positions) == ({1}, True)
+
+
+def test_pages_have_their_own_etag(chain):
+    for n in range(5):
+        chain.add_issuer(f"issuer{n}", f"did:elsi:VATES-{n}")
+    registry = issuerregistry.IssuerRegistry()
+    registry.build()
+
+    body, etag = registry.page()
+    page, page_etag = registry.page(offset=1, limit=2)
+    other_page, other_etag = registry.page(offset=3, limit=2)
+
+    assert [issuer["name"] for issuer in orjson.loads(page)["payload"]] == ["issuer1", "issuer2"]
+    assert orjson.loads(page)["total"] == 5
+    assert len({etag, page_etag, other_etag}) == 3
+    # The same page of the same version has the same ETag
+    assert registry.page(offset=1, limit=2)[1] == page_etag
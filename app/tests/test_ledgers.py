@@ -0,0 +1,40 @@
+# Tests of the anchoring of entities in several ledgers, with fake ledgers
+
+import threading
+
+import pytest
+
+from blockchain import canismajor as cm
+from settings import settings
+
+
+@pytest.fixture
+def ledgers(monkeypatch):
+    release = threading.Event()
+
+    def stuck(contract_funs):
+        release.wait(10)
+        return ["redt"] * len(contract_funs)
+
+    def fast(contract_funs):
+        return ["tolar"] * len(contract_funs)
+
+    monkeypatch.setitem(cm.LEDGERS, "redt", stuck)
+    monkeypatch.setitem(cm.LEDGERS, "tolar", fast)
+    monkeypatch.setitem(settings, "ANCHOR_LEDGERS", ["redt", "tolar"])
+    monkeypatch.setitem(settings, "ANCHOR_QUORUM", 1)
+    yield release
+    release.set()
+
+
+def test_slow_ledger_does_not_take_the_threads_of_the_others(ledgers):
+    # Keep busy all the threads of the slow ledger
+    for _ in range(settings.LEDGER_WORKERS):
+        cm.ledger_executors["redt"].submit(cm.LEDGERS["redt"], [None])
+
+    confirmed, late = cm.send_to_ledgers([None, None])
+    assert confirmed == {"tolar": ["tolar", "tolar"]}
+    assert list(late) == ["redt"]
+
+    ledgers.set()
+    assert late["redt"].result(5) == ["redt", "redt"]
@@ -0,0 +1,38 @@
+# Tests of the Merkle Hash Tree and its inclusion proofs
+
+import pytest
+
+from utils.merkletree import MerkleTree, leaf_hash, verify_MHT_proof
+
+
+@pytest.mark.parametrize("num_leaves", [1, 2, 3, 4, 5, 7, 8, 13, 64])
+def test_inclusion_proof_round_trip(num_leaves):
+    leaves = [leaf_hash(bytes([i]) * 64) for i in range(num_leaves)]
+    tree = MerkleTree(leaves, prehashed=True)
+    root = tree.build_MHT().value
+
+    for index in range(num_leaves):
+        proof = tree.inclusion_proof_by_index(index)
+        assert tree.verify_inclusion_proof(index, root, proof)
+
+        exported = tree.export_inclusion_proof(index)
+        assert verify_MHT_proof(leaves[index], exported, root)
+
+
+def test_wrong_proof_is_rejected():
+    leaves = [leaf_hash(bytes([i]) * 64) for i in range(5)]
+    tree = MerkleTree(leaves, prehashed=True)
+    root = tree.build_MHT().value
+
+    proof = tree.inclusion_proof_by_index(3)
+    assert not tree.verify_inclusion_proof(2, root, proof)
+    assert not verify_MHT_proof(leaves[2], tree.export_inclusion_proof(3), root)
+
+
+def test_proof_of_leaf_not_in_tree():
+    leaves = [leaf_hash(bytes([i]) * 64) for i in range(4)]
+    tree = MerkleTree(leaves, prehashed=True)
+    root = tree.build_MHT().value
+
+    other = leaf_hash(b"not in the tree")
+    assert not verify_MHT_proof(other, tree.export_inclusion_proof(0), root)
@@ -0,0 +1,103 @@
+# Tests of the allocation of nonces of redt under concurrency
+
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from blockchain import redt
+
+ADDRESS = "0x" + "ab" * 20
+
+
+class FakeNode:
+    """The transaction count of the accounts, read slowly to widen the races"""
+
+    def __init__(self, count: int = 10) -> None:
+        self.count = count
+        self.reads = 0
+        self.lock = threading.Lock()
+        self.eth = self
+
+    def getTransactionCount(self, address, block_identifier):
+        assert block_identifier == "pending"
+        time.sleep(0.01)
+        with self.lock:
+            self.reads += 1
+            return self.count
+
+
+class FakeAsyncNode(FakeNode):
+
+    async def get_transaction_count(self, address, block_identifier):
+        assert block_identifier == "pending"
+        await asyncio.sleep(0.01)
+        with self.lock:
+            self.reads += 1
+            return self.count
+
+
+@pytest.fixture
+def node(monkeypatch):
+    node = FakeNode()
+    monkeypatch.setattr(redt, "w3", node, raising=False)
+    return node
+
+
+@pytest.fixture
+def async_node(monkeypatch):
+    node = FakeAsyncNode()
+    monkeypatch.setattr(redt, "aw3", node, raising=False)
+    return node
+
+
+def test_threads_get_consecutive_nonces(node):
+    manager = redt.NonceManager()
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        nonces = list(executor.map(lambda i: manager.next_nonce(ADDRESS), range(500)))
+
+    assert sorted(nonces) == list(range(10, 510))
+    assert node.reads == 1
+
+
+def test_coroutines_get_consecutive_nonces(async_node):
+    manager = redt.NonceManager()
+
+    async def run():
+        return await asyncio.gather(*(manager.next_nonce_async(ADDRESS) for _ in range(200)))
+    nonces = asyncio.run(run())
+
+    # All of them may read the node before the first one stores the nonce, but none is repeated
+    assert sorted(nonces) == list(range(10, 210))
+
+
+def test_threads_and_coroutines_together(node, async_node):
+    manager = redt.NonceManager()
+
+    async def run():
+        return await asyncio.gather(*(manager.next_nonce_async(ADDRESS) for _ in range(100)))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(manager.next_nonce, ADDRESS) for _ in range(100)]
+        nonces = asyncio.run(run())
+        nonces += [future.result() for future in futures]
+
+    assert sorted(nonces) == list(range(10, 210))
+
+
+def test_resync_reads_the_node_again(node):
+    manager = redt.NonceManager()
+    assert [manager.next_nonce(ADDRESS) for _ in range(3)] == [10, 11, 12]
+
+    # The transaction with nonce 12 was not sent, so the node still has 12
+    node.count = 12
+    manager.resync(ADDRESS)
+    assert manager.next_nonce(ADDRESS) == 12
+    assert node.reads == 2
+
+    # Other accounts have their own nonces
+    assert manager.next_nonce("0x" + "cd" * 20) == 12
+    assert manager.next_nonce(ADDRESS) == 13
@@ -0,0 +1,123 @@
+# Tests of the tracker of receipts of redt, with a fake node in memory
+
+import asyncio
+import threading
+
+import pytest
+from hexbytes import HexBytes
+from web3.exceptions import TransactionNotFound
+
+from blockchain import redt
+
+
+class FakeEth:
+    """The calls of w3.eth used by the tracker, over a chain kept in memory"""
+
+    def __init__(self, block_number: int = 100) -> None:
+        self.lock = threading.Lock()
+        self.blocks = {n: [] for n in range(block_number + 1)}
+        self.receipts = {}
+        self.blocks_read = []
+        self.block_number_threads = []
+
+    @property
+    def block_number(self) -> int:
+        with self.lock:
+            self.block_number_threads.append(threading.current_thread())
+            return len(self.blocks) - 1
+
+    def mine(self, tx_hashes=(), empty_blocks: int = 0):
+        with self.lock:
+            for _ in range(empty_blocks):
+                self.blocks[len(self.blocks)] = []
+            n = len(self.blocks)
+            self.blocks[n] = [HexBytes(h) for h in tx_hashes]
+            for h in tx_hashes:
+                self.receipts[HexBytes(h)] = {"transactionHash": HexBytes(h), "blockNumber": n, "status": 1}
+
+    def get_block(self, n):
+        with self.lock:
+            self.blocks_read.append(n)
+            return {"number": n, "transactions": self.blocks[n]}
+
+    def get_transaction_receipt(self, tx_hash):
+        with self.lock:
+            try:
+                return self.receipts[HexBytes(tx_hash)]
+            except KeyError:
+                raise TransactionNotFound(tx_hash)
+
+
+class FakeW3:
+    def __init__(self) -> None:
+        self.eth = FakeEth()
+
+
+@pytest.fixture
+def chain(monkeypatch):
+    fake = FakeW3()
+    monkeypatch.setattr(redt, "w3", fake)
+    return fake.eth
+
+
+def test_receipt_of_tracked_transaction(chain):
+    tracker = redt.ReceiptTracker(poll_interval=0.01)
+
+    tx_hash = b"\x01" * 32
+    future = tracker.track(tx_hash)
+    chain.mine([tx_hash])
+
+    receipt = future.result(5)
+    assert receipt["blockNumber"] == 101
+    assert chain.blocks_read == [101]
+
+
+def test_track_after_idle_period(chain):
+    tracker = redt.ReceiptTracker(poll_interval=0.01)
+
+    first = b"\x01" * 32
+    tracker.track(first)
+    chain.mine([first])
+    tracker.wait(first, timeout=5)
+
+    # Many blocks are mined while nobody is waiting for receipts
+    chain.mine(empty_blocks=5000)
+    chain.blocks_read.clear()
+
+    second = b"\x02" * 32
+    future = tracker.track(second)
+    chain.mine([second])
+
+    receipt = future.result(5)
+    assert receipt["transactionHash"] == HexBytes(second)
+
+    # Only the blocks mined after the transaction was tracked are read
+    assert chain.blocks_read == [receipt["blockNumber"]]
+
+
+def test_track_async_reads_the_block_with_the_async_provider(chain, monkeypatch):
+    class AsyncEth:
+        @property
+        async def block_number(self):
+            return len(chain.blocks) - 1
+
+        async def get_transaction_receipt(self, tx_hash):
+            return chain.get_transaction_receipt(tx_hash)
+
+    class AsyncW3:
+        eth = AsyncEth()
+
+    monkeypatch.setattr(redt, "aw3", AsyncW3(), raising=False)
+    tracker = redt.ReceiptTracker(poll_interval=0.01)
+    tx_hash = b"\x03" * 32
+
+    async def run():
+        await tracker.track_async(tx_hash)
+        assert tracker.last_block == 100
+        chain.mine([tx_hash])
+        return await tracker.wait_async(tx_hash, timeout=5)
+
+    assert asyncio.run(run())["blockNumber"] == 101
+
+    # The sync provider is only used by the thread following the blocks, never in the event loop
+    assert threading.current_thread() not in chain.block_number_threads
@@ -0,0 +1,38 @@
+# Tests of the registry of unlocked accounts of the wallet
+
+import pytest
+from eth_account.messages import encode_defunct
+
+from blockchain import wallet
+
+
+@pytest.fixture(scope="module")
+def account():
+    wallet.erase_wallet_db()
+    return wallet.create_and_save_account("test", "secret")
+
+
+def test_callers_keep_their_account_after_eviction(account, monkeypatch):
+    registry = wallet.SignerRegistry(ttl=60)
+
+    signer = registry.get("test", "secret")
+    assert signer.address == account.address
+    assert registry.get("test", "secret") is not signer
+
+    # The account expires while the caller is still using it
+    monkeypatch.setattr(wallet.time, "monotonic", lambda: float("inf"))
+    registry.get("test", "secret")
+    registry.evict("test")
+    registry.clear()
+
+    assert signer.key == account.key
+    message = encode_defunct(text="Hello")
+    assert signer.sign_message(message).signature == account.sign_message(message).signature
+
+
+def test_wrong_password(account):
+    registry = wallet.SignerRegistry(ttl=60)
+    registry.get("test", "secret")
+
+    with pytest.raises(ValueError):
+        registry.get("test", "wrong")
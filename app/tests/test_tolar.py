@@ -0,0 +1,135 @@
+# Tests of the nonces and receipts of Tolar HashNet, with a fake node in memory
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from blockchain import tolar_hashnet as th
+
+
+class FakeTolar:
+    """The calls to the node used by the nonce manager and the receipt waiter"""
+
+    def __init__(self, blocks: int = 10) -> None:
+        self.lock = threading.Lock()
+        self.blocks = [[] for _ in range(blocks)]
+        self.receipts = {}
+        self.nonce = 7
+        self.fail = False
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+
+    def mine(self, tx_hashes=(), empty_blocks: int = 0):
+        with self.lock:
+            self.blocks.extend([] for _ in range(empty_blocks))
+            self.blocks.append(list(tx_hashes))
+            for tx_hash in tx_hashes:
+                self.receipts[tx_hash] = {
+                    "blockHash": "b" * 64, "transactionHash": tx_hash, "senderAddress": "5" * 50,
+                    "receiverAddress": "5" * 50, "newAddress": "5" * 50, "gasUsed": th.int_to_b64str(21000)
+                }
+
+    def call(self, method: str, data: dict = None, check: bool = False):
+        self.calls.append(method)
+        if self.fail:
+            if check:
+                raise Exception(f"Error calling {method}: UNAVAILABLE")
+            return None
+        if method == "GetNonce":
+            return {"nonce": th.int_to_b64str(self.nonce)}
+
+    async def call_async(self, method: str, data: dict = None, quiet: bool = False):
+        with self.lock:
+            self.calls.append(method)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0.001)
+            with self.lock:
+                if method == "GetBlockCount":
+                    return {"blockCount": str(len(self.blocks))}
+                if method == "GetBlockByIndex":
+                    return {"transactionHashes": self.blocks[data["block_index"]]}
+                if method == "GetTransactionReceipt":
+                    return self.receipts.get(th.hash(data["transaction_hash"]))
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def test_nonces_under_concurrency():
+    node = FakeTolar()
+    nonces = th.TolarNonceManager(node)
+
+    with ThreadPoolExecutor(16) as executor:
+        allocated = list(executor.map(lambda _: nonces.next_nonce("5" * 50), range(200)))
+
+    assert sorted(allocated) == list(range(7, 207))
+    assert node.calls.count("GetNonce") == 1
+
+
+def test_nonce_is_not_cached_on_error():
+    node = FakeTolar()
+    nonces = th.TolarNonceManager(node)
+
+    node.fail = True
+    with pytest.raises(Exception):
+        nonces.next_nonce("5" * 50)
+
+    node.fail = False
+    assert nonces.next_nonce("5" * 50) == 7
+
+
+def test_receipt_after_idle_period():
+    node = FakeTolar()
+    waiter = th.TolarReceiptWaiter(node, min_interval=0.01, max_interval=0.05)
+
+    first = "1" * 64
+    node.mine([first])
+    assert waiter.wait(first, timeout=5)["transactionHash"] == first
+
+    # Many blocks are mined while nobody is waiting for receipts
+    node.mine(empty_blocks=5000)
+    time.sleep(0.1)
+    node.calls.clear()
+
+    second = "2" * 64
+    future = waiter.track(second)
+    node.mine([second])
+    assert future.result(5)["transactionHash"] == second
+
+    # Only the blocks mined after the waiter started again are read
+    assert node.calls.count("GetBlockByIndex") < 10
+
+
+def test_receipt_mined_before_following_blocks():
+    node = FakeTolar()
+    waiter = th.TolarReceiptWaiter(node, min_interval=0.01, max_interval=0.05)
+
+    # Sent and mined just before the waiter asks for the latest block
+    tx_hash = "3" * 64
+    node.mine([tx_hash])
+    node.mine(empty_blocks=3)
+    assert waiter.wait(tx_hash, timeout=5)["transactionHash"] == tx_hash
+
+
+def test_concurrent_requests_are_limited():
+    node = FakeTolar()
+    waiter = th.TolarReceiptWaiter(node, min_interval=0.01, max_interval=0.05, max_requests=4)
+
+    first = "1" * 64
+    node.mine([first])
+    waiter.wait(first, timeout=5)
+
+    second = "2" * 64
+    future = waiter.track(second)
+    # Many blocks arrive at once while the waiter is following them
+    node.mine(empty_blocks=500)
+    node.mine([second])
+
+    assert future.result(10)["transactionHash"] == second
+    assert node.max_running <= 4
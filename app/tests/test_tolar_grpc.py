@@ -0,0 +1,93 @@
+# Tests of the native gRPC client of Tolar against an in-process server
+
+import sys
+import base64
+import asyncio
+from concurrent import futures
+
+import pytest
+
+grpc = pytest.importorskip("grpc")
+pytest.importorskip("grpc_tools")
+
+from blockchain import tolar_grpc
+
+ADDRESS = bytes.fromhex("54" + "11" * 24)
+
+
+def handlers(client: tolar_grpc.TolarClient):
+    """The methods of BlockchainService used in the tests, implemented with the message classes of the client"""
+
+    protos = client.modules["tolar/proto/blockchain.proto"]
+
+    def get_block_count(request, context):
+        return protos.GetBlockCountResponse(block_count=1234567890123)
+
+    def get_nonce(request, context):
+        assert request.address == ADDRESS
+        return protos.GetNonceResponse(nonce=(7).to_bytes(32, "big"))
+
+    def handler(function, request_class):
+        return grpc.unary_unary_rpc_method_handler(
+            function,
+            request_deserializer=request_class.FromString,
+            response_serializer=lambda response: response.SerializeToString(),
+        )
+
+    return grpc.method_handlers_generic_handler("tolar.proto.BlockchainService", {
+        "GetBlockCount": handler(get_block_count, protos.GetBlockCountRequest),
+        "GetNonce": handler(get_nonce, protos.GetNonceRequest),
+    })
+
+
+@pytest.fixture
+def client():
+    path = list(sys.path)
+    client = tolar_grpc.TolarClient("localhost:0")
+    # Compiling the .proto files leaves sys.path as it was
+    assert sys.path == path
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    server.add_generic_rpc_handlers((handlers(client),))
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+
+    client.close()
+    client = tolar_grpc.TolarClient(f"localhost:{port}")
+    yield client
+    client.close()
+    server.stop(None)
+
+
+def test_call(client):
+    # The same JSON as grpcurl: 64 bit integers as strings and bytes in base64
+    assert client.call("tolar.proto.BlockchainService.GetBlockCount", timeout=5) == {"blockCount": "1234567890123"}
+
+    reply = client.call(
+        "tolar.proto.BlockchainService.GetNonce",
+        {"address": base64.b64encode(ADDRESS).decode()},
+        timeout=5,
+    )
+    assert base64.b64decode(reply["nonce"]) == (7).to_bytes(32, "big")
+
+
+def test_call_async(client):
+    async def run():
+        return await asyncio.gather(
+            client.call_async("tolar.proto.BlockchainService.GetBlockCount", timeout=5),
+            client.call_async(
+                "tolar.proto.BlockchainService.GetNonce",
+                {"address": base64.b64encode(ADDRESS).decode()},
+                timeout=5,
+            ),
+        )
+    block_count, nonce = asyncio.run(run())
+
+    assert block_count == {"blockCount": "1234567890123"}
+    assert base64.b64decode(nonce["nonce"]) == (7).to_bytes(32, "big")
+
+
+def test_call_error(client):
+    with pytest.raises(grpc.RpcError) as e:
+        client.call("tolar.proto.BlockchainService.GetLatestBlock", timeout=5)
+    assert e.value.code() == grpc.StatusCode.UNIMPLEMENTED
@@ -0,0 +1,71 @@
+# Tests of the check of the views of the deployed PublicResolver
+
+import asyncio
+
+import pytest
+from web3.exceptions import ContractLogicError
+
+from blockchain import trustframework as tf
+
+
+class FakePublicResolver:
+    """A PublicResolver whose view AlaDIDPublicEntityByDIDHash fails with the errors given"""
+
+    abi = [{"type": "function", "name": "AlaDIDPublicEntityByDIDHash"}]
+
+    def __init__(self, errors: list) -> None:
+        self.errors = list(errors)
+        self.calls = 0
+        self.functions = self
+
+    def AlaDIDPublicEntityByDIDHash(self, DIDHash):
+        return self
+
+    def call(self):
+        self.calls += 1
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        return None
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    def setup(errors: list) -> FakePublicResolver:
+        fake = FakePublicResolver(errors)
+        monkeypatch.setattr(tf, "PublicResolver", fake, raising=False)
+
+        async def call_async(contract_function):
+            return contract_function.call()
+        monkeypatch.setattr(tf.b, "call_async", call_async)
+        return fake
+    return setup
+
+
+def test_node_error_is_checked_again(resolver):
+    fake = resolver([ValueError({"code": -32000, "message": "header not found"})])
+    public_resolver = tf.PublicResolver_class()
+
+    assert public_resolver.canResolveInSingleCall() is False
+    assert public_resolver.single_call is None
+
+    assert public_resolver.canResolveInSingleCall() is True
+    assert public_resolver.canResolveInSingleCall() is True
+    assert fake.calls == 2
+
+
+def test_node_error_is_checked_again_async(resolver):
+    fake = resolver([ValueError({"code": -32000, "message": "header not found"})])
+    public_resolver = tf.PublicResolver_class()
+
+    assert asyncio.run(public_resolver.canResolveInSingleCall_async()) is False
+    assert asyncio.run(public_resolver.canResolveInSingleCall_async()) is True
+    assert fake.calls == 2
+
+
+def test_missing_view_is_checked_once(resolver):
+    fake = resolver([ContractLogicError("execution reverted")])
+    public_resolver = tf.PublicResolver_class()
+
+    assert public_resolver.canResolveInSingleCall() is False
+    assert public_resolver.canResolveInSingleCall() is False
+    assert fake.calls == 1
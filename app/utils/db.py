@@ -0,0 +1,97 @@
+# Shared access to the SQLite databases
+#
+# Each thread keeps one open connection per database file, instead of opening a new
+# connection in every call. Connections are tuned for concurrent readers and a writer:
+# WAL journal, synchronous=NORMAL, memory-mapped I/O and a bigger page cache.
+
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+# The settings for the system
+from settings import settings
+
+log = logging.getLogger(__name__)
+
+
+class PooledConnection(sqlite3.Connection):
+    """A connection which stays open and is reused by the same thread.
+    Calling close() does nothing, so existing code closing its handle keeps working.
+    """
+
+    def close(self):
+        pass
+
+    def really_close(self):
+        super().close()
+
+
+def _pragmas() -> str:
+    return f"""
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE};
+    PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB};
+    PRAGMA temp_store=MEMORY;
+    """
+
+# The connections of each thread, indexed by database file name
+_local = threading.local()
+
+def get_connection(database_name: str) -> sqlite3.Connection:
+    """Get the connection of the current thread to the database, creating it on first use"""
+
+    connections: Dict[str, PooledConnection] = getattr(_local, "connections", None)
+    if connections is None:
+        connections = {}
+        _local.connections = connections
+
+    db = connections.get(database_name)
+    if db is not None:
+        return db
+
+    db = sqlite3.connect(
+        database_name,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        factory=PooledConnection,
+        cached_statements=settings.SQLITE_STATEMENT_CACHE
+    )
+    db.row_factory = sqlite3.Row
+    db.executescript(_pragmas())
+
+    connections[database_name] = db
+    return db
+
+@contextmanager
+def transaction(db: sqlite3.Connection, durable: bool = False) -> Iterator[sqlite3.Connection]:
+    """Run the statements of the block in a transaction of the connection, as in:
+        with transaction(get_db()) as db:
+            db.execute(...)
+    The changes are committed when the block ends, and rolled back if it raises an exception,
+    so a failed write never keeps the database locked nor is committed later by someone else.
+    With synchronous=NORMAL a commit may be lost if the machine crashes. If durable is True the
+    commit is fsync'ed (synchronous=FULL), for the writes acknowledged to the caller as stored.
+    """
+
+    if durable:
+        db.execute("PRAGMA synchronous=FULL")
+    try:
+        yield db
+    except BaseException:
+        db.rollback()
+        raise
+    else:
+        db.commit()
+    finally:
+        if durable:
+            db.execute("PRAGMA synchronous=NORMAL")
+
+def close_connections():
+    """Close all the connections of the current thread"""
+
+    connections = getattr(_local, "connections", {})
+    for db in connections.values():
+        db.really_close()
+    connections.clear()
@@ -19,6 +19,16 @@ hash_function = sha256
 class MerkleError(Exception):
     pass
 
+# Domain separation prefixes for leaves and interior nodes, as per IETF-RFC6962
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+def leaf_hash(data: bytes) -> bytes:
+    """Calculate the hash of a leaf as per IETF-RFC6962: SHA-256(0x00 || data).
+    The result can be used to create the tree with prehashed=True.
+    """
+    return hash_function(LEAF_PREFIX + data).digest()
+
 ROOT_NODE = "ROOT"
 LEAF_NODE = "LEAF"
 INTERIOR_NODE = "INTERIOR"
@@ -210,13 +220,12 @@ class MerkleTree(object):
         my_index = left_child.index
         print_debug(f"My Level-Index: {my_level}, {my_index}")
 
-        newnode = Node(left_child.value + right_child.value, node_type=INTERIOR_NODE, level=my_level, index=my_index)
+        newnode = Node(NODE_PREFIX + left_child.value + right_child.value, node_type=INTERIOR_NODE, level=my_level, index=my_index)
         newnode.left_child, newnode.right_child = left_child, right_child
         left_child.side, right_child.side, left_child.parent, right_child.parent = 'L', 'R', newnode, newnode
         left_child.sibling, right_child.sibling = right_child, left_child
 
         return newnode
-        #return hash_function(b'1' + left + right).digest()
 
 
     def build(self) -> bytes:
@@ -292,6 +301,9 @@ class MerkleTree(object):
         return [self.get_chain(i) for i in range(self.num_leaves())]
 
     def verify_inclusion_proof(self, index: int, hash: bytes, proof: List[Tuple]) -> bool:
+        """Verify the proof returned by inclusion_proof_by_index for a tree built with build_MHT.
+        Interior nodes are hashed with NODE_PREFIX, as in build_MHT and verify_MHT_proof.
+        """
 
         # Check if index is within bounds
         if index < 0 or index >= self.num_leaves():
@@ -304,10 +316,10 @@ class MerkleTree(object):
         for item in proof:
             if item[2] == 'R':
                 print_debug(f"{h.hex()} + {item[3].hex()}")
-                h = hash_function(h + item[3]).digest()
+                h = hash_function(NODE_PREFIX + h + item[3]).digest()
             else:
-                print_debug(f"{item[3].hex() + {h.hex()}}")
-                h = hash_function(item[3] + h).digest()
+                print_debug(f"{item[3].hex()} + {h.hex()}")
+                h = hash_function(NODE_PREFIX + item[3] + h).digest()
             print_debug(h.hex())
 
         print_debug(f"Target hash: {h.hex()}")
@@ -317,6 +329,13 @@ class MerkleTree(object):
         else:
             return False
 
+    def export_inclusion_proof(self, index: int) -> List[dict]:
+        """Return the inclusion proof of a leaf of a tree built with build_MHT,
+        in a format that can be serialized to JSON.
+        """
+        proof = self.inclusion_proof_by_index(index)
+        return [{"side": item[2], "hash": item[3].hex()} for item in proof]
+
     def dump_tree(self, node: Node = None, indent: str =""):
         if node == None:
             node = self.root
@@ -338,6 +357,21 @@ class MerkleTree(object):
 
 
 
+def verify_MHT_proof(leaf: bytes, proof: List[dict], root: bytes) -> bool:
+    """Verify an inclusion proof exported with export_inclusion_proof, without the tree.
+    The leaf is the leaf hash (as calculated by leaf_hash) and root is the Merkle Tree Hash.
+    """
+
+    h = leaf
+    for item in proof:
+        sibling = bytes.fromhex(item["hash"])
+        if item["side"] == 'R':
+            h = hash_function(NODE_PREFIX + h + sibling).digest()
+        else:
+            h = hash_function(NODE_PREFIX + sibling + h).digest()
+
+    return h == root
+
 
 # data = [b"hola", b"que", b"tal", b"estas", b"hoy"]
 
@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from typing import Tuple
+from typing import List, Tuple
 import hashlib
 import struct
 import logging
@@ -98,11 +98,17 @@ class FIFOFile:
         self.fsync_task = None
 
     def close(self):
-        self.fsync_task.cancel()
+        if self.fsync_task is not None:
+            self.fsync_task.cancel()
         self.f.close()
                 
     def put(self, id: str, value: str):
 
+        # Store the hashes of the id and value
+        self.put_hashes(self._hash(id), self._hash(value))
+
+    def put_hashes(self, id_hash: bytes, value_hash: bytes):
+
         # On first put, create a background task which fsyncs every fsync_time (or 1 sec as a minimum)
         if self.fsync_task is None and self.fsync_time > 0:
             self.fsync_task = asyncio.create_task(self.fsync_background_task(max(self.fsync_time, 1)))
@@ -113,7 +119,7 @@ class FIFOFile:
             raise FullError("Queue is full")
 
         # Build the record to store
-        r = self._record_pack(id, value)
+        r = struct.pack("32s32s", id_hash, value_hash)
 
         # Write to where the head points
         self.f.seek(self.head)
@@ -155,6 +161,32 @@ class FIFOFile:
 
         return (id_hash, value_hash)
 
+    def peek_many(self, n: int) -> List[Tuple]:
+        """Return up to n elements from the tail of the queue, without removing them."""
+
+        records = []
+        offset = self.tail
+        while offset != self.head and len(records) < n:
+            self.f.seek(offset)
+            r_raw = self.f.read(self.RECORD_SIZE)
+            if len(r_raw) != self.RECORD_SIZE:
+                raise Exception(f"Error reading record, read {len(r_raw)} bytes")
+            records.append(self._record_unpack(r_raw))
+            offset = self._next_offset(offset)
+
+        return records
+
+    def drop(self, n: int):
+        """Remove n elements from the tail of the queue, usually after peek_many."""
+
+        for i in range(n):
+            if self.head == self.tail:
+                raise EmptyError("Queue empty")
+            self.tail = self._next_offset(self.tail)
+
+        # Write the updated header
+        self._write_header()
+
     def _write_header(self):
         # Write the updated header, flushing all buffers to disk
         h = self._header_pack(self.head, self.tail)